@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Packaging of a database directory into a compressed tarball using all the
+cores of the machine, without calling any external program.
+
+The tar stream is produced by `tarfile` and fed to one of two writers:
+
+    * `ParallelGzipWriter` - cuts the stream in blocks that are deflated
+                             on several threads (`zlib` releases the GIL).
+                             As with `pigz`, every block is primed with the
+                             last 32 KiB of the previous one and ended with
+                             a sync flush, so the output is one ordinary
+                             gzip member that any gzip reader accepts.
+    * zstd                 - through the optional `zstandard` package and
+                             its own worker threads. Faster, but readers
+                             need zstd support.
+
+While the archive is written, its size, SHA-256, MD5 and the ETag that S3
+will report for a multipart upload with parts of `part_size` bytes are
+computed, and saved next to it in a `.hashes.json` file. Uploading can then
+be skipped if nothing changed, without reading the archive again.
+
+Typically you would use it like this:
+
+    >>> make_archive('databases/silvamod138pr2', 'silvamod138pr2.tar.gz')
+"""
+
+# Built-in modules #
+import os, io, json, time, zlib, struct, hashlib, tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Constants #
+WINDOW = 2**15
+
+###############################################################################
+class ParallelGzipWriter(io.RawIOBase):
+    """
+    A write-only stream that gzip compresses what it receives on `jobs`
+    threads and writes it to the binary `handle`, keeping the order.
+    """
+
+    def __init__(self, handle, level=9, jobs=None, block_size=2**17):
+        self.handle     = handle
+        self.level      = level
+        self.jobs       = jobs or os.cpu_count()
+        self.block_size = block_size
+        # The state #
+        self.pending = bytearray()
+        self.last    = b''
+        self.crc     = 0
+        self.size    = 0
+        self.window  = deque()
+        self.pool    = ThreadPoolExecutor(self.jobs)
+        # The header: no name, no timestamp, unknown OS #
+        extra_flags = 2 if level == 9 else 4 if level == 1 else 0
+        self.handle.write(struct.pack('<BBBBIBB', 0x1f, 0x8b, 8, 0, 0,
+                                      extra_flags, 255))
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.pending += data
+        while len(self.pending) >= self.block_size:
+            block = bytes(self.pending[:self.block_size])
+            del self.pending[:self.block_size]
+            self.submit(block, last=False)
+        return len(data)
+
+    def submit(self, block, last):
+        """Queue a block, writing out the oldest ones if too many wait."""
+        self.crc   = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.window.append(self.pool.submit(self.deflate, block, self.last,
+                                            last))
+        self.last = block[-WINDOW:]
+        while len(self.window) > self.jobs * 4:
+            self.handle.write(self.window.popleft().result())
+
+    def deflate(self, block, dictionary, last):
+        """This runs in a worker thread."""
+        if dictionary:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15,
+                                          zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        flush = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+        return compressor.compress(block) + compressor.flush(flush)
+
+    def close(self):
+        if self.closed: return
+        # The last block ends the deflate stream, even if it's empty #
+        self.submit(bytes(self.pending), last=True)
+        while self.window: self.handle.write(self.window.popleft().result())
+        self.pool.shutdown()
+        self.handle.write(struct.pack('<II', self.crc, self.size & 0xFFFFFFFF))
+        super().close()
+
+    def abort(self):
+        """Stop the worker threads without finishing the gzip stream."""
+        if self.closed: return
+        self.window.clear()
+        self.pool.shutdown(cancel_futures=True)
+        super().close()
+
+#-----------------------------------------------------------------------------#
+class HashingWriter(io.RawIOBase):
+    """
+    Passes what it receives to the binary `handle` (if any) while
+    computing the hashes of the whole content, and the MD5 of every part
+    of `part_size` bytes to predict the ETag of a multipart upload to S3.
+    """
+
+    def __init__(self, handle, part_size=2**23):
+        self.handle    = handle
+        self.part_size = part_size
+        self.size      = 0
+        self.sha256    = hashlib.sha256()
+        self.md5       = hashlib.md5()
+        self.parts     = []
+        self.part      = hashlib.md5()
+        self.part_left = part_size
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.handle is not None: self.handle.write(data)
+        self.sha256.update(data)
+        self.md5.update(data)
+        self.size += len(data)
+        view = memoryview(data)
+        while len(view) >= self.part_left:
+            self.part.update(view[:self.part_left])
+            view = view[self.part_left:]
+            self.parts.append(self.part.digest())
+            self.part, self.part_left = hashlib.md5(), self.part_size
+        self.part.update(view)
+        self.part_left -= len(view)
+        return len(data)
+
+    @property
+    def part_md5s(self):
+        """The MD5 of every part, the last one possibly shorter."""
+        last = [self.part.digest()] if self.part_left < self.part_size else []
+        return self.parts + last
+
+    @property
+    def etag(self):
+        """The ETag S3 gives to an object uploaded in parts of `part_size`."""
+        parts = self.part_md5s
+        if len(parts) <= 1: return self.md5.hexdigest()
+        return '%s-%i' % (hashlib.md5(b''.join(parts)).hexdigest(), len(parts))
+
+    def hashes(self):
+        return {'size':      self.size,
+                'sha256':    self.sha256.hexdigest(),
+                'md5':       self.md5.hexdigest(),
+                'etag':      self.etag,
+                'part_size': self.part_size,
+                'parts':     [digest.hex() for digest in self.part_md5s]}
+
+###############################################################################
+def hashes_path(archive_path):
+    """Where the hashes of an archive are stored."""
+    return str(archive_path) + '.hashes.json'
+
+def read_hashes(archive_path):
+    """
+    The hashes saved when the archive was made, or None if they are
+    missing or older than the archive.
+    """
+    path = hashes_path(archive_path)
+    if not os.path.exists(path): return None
+    if os.path.getmtime(path) < os.path.getmtime(str(archive_path)): return None
+    with open(path) as handle: hashes = json.load(handle)
+    if hashes['size'] != os.path.getsize(str(archive_path)): return None
+    return hashes
+
+def hash_file(path, part_size=2**23, chunk_size=2**20):
+    """Compute the same hashes for an existing file, by reading it."""
+    hashing = HashingWriter(None, part_size)
+    with open(str(path), 'rb') as handle:
+        while True:
+            chunk = handle.read(chunk_size)
+            if not chunk: return hashing.hashes()
+            hashing.write(chunk)
+
+def exclude_filter(names):
+    """A `tarfile` filter dropping the members with one of these names."""
+    def keep(info):
+        if os.path.basename(info.name) in names: return None
+        return info
+    return keep
+
+def make_archive(directory, output_path, compression='gzip', level=None,
+                 jobs=None, exclude=('.DS_Store',), part_size=2**23,
+                 verbose=True):
+    """
+    Write the contents of `directory` to a compressed tarball at
+    `output_path`, with the directory name as the top level entry. The
+    `compression` is either 'gzip' or 'zstd'. The working directory of the
+    process is not changed. Returns the hashes of the archive with the
+    time taken added.
+    """
+    # Check the compression #
+    if compression not in ('gzip', 'zstd'):
+        raise ValueError("The compression must be 'gzip' or 'zstd'.")
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            msg = "Writing zstd archives requires the `zstandard` package."
+            raise ImportError(msg) from None
+    # The top level name in the archive #
+    directory = os.path.normpath(str(directory))
+    arcname   = os.path.basename(directory)
+    jobs      = jobs or os.cpu_count()
+    start     = time.perf_counter()
+    tmp_path  = str(output_path) + '.tmp'
+    # Chain the writers #
+    compressor = None
+    try:
+        with open(tmp_path, 'wb') as handle:
+            hashing = HashingWriter(handle, part_size)
+            if compression == 'gzip':
+                compressor = ParallelGzipWriter(hashing, level or 9, jobs)
+            else:
+                params = zstandard.ZstdCompressionParameters.from_level(
+                                                  level or 10, threads=jobs)
+                zstd   = zstandard.ZstdCompressor(compression_params=params)
+                compressor = zstd.stream_writer(hashing, closefd=False)
+            with tarfile.open(fileobj=compressor, mode='w|') as tar:
+                tar.add(directory, arcname, filter=exclude_filter(exclude))
+            compressor.close()
+    except BaseException:
+        # Don't leave the worker threads or a partial archive behind #
+        if isinstance(compressor, ParallelGzipWriter): compressor.abort()
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, str(output_path))
+    # Save the hashes #
+    elapsed = time.perf_counter() - start
+    result  = dict(hashing.hashes(), compression=compression)
+    with open(hashes_path(output_path), 'w') as handle:
+        json.dump(result, handle, indent=4)
+    # Report #
+    if verbose:
+        size_in = sum(os.path.getsize(os.path.join(root, name))
+                      for root, dirs, files in os.walk(directory)
+                      for name in files if name not in exclude)
+        mib = 1024**2
+        print("Compressed %.1f MiB into %.1f MiB in %.1f s (%.1f MiB/s)" %
+              (size_in / mib, hashing.size / mib, elapsed,
+               size_in / mib / max(elapsed, 1e-9)))
+    return dict(result, seconds=elapsed)
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    import argparse
+    parser = argparse.ArgumentParser(description=
+        "Package a database directory into a compressed tarball.")
+    parser.add_argument("directory", help="The directory to package.")
+    parser.add_argument("output", help="The path of the archive to write.")
+    parser.add_argument("--zstd", action="store_true",
+                        help="Use zstd instead of gzip.")
+    parser.add_argument("--level", type=int, default=None,
+                        help="The compression level.")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="The number of threads (defaults to all cores).")
+    args = parser.parse_args()
+    # Run it #
+    make_archive(args.directory, args.output,
+                 'zstd' if args.zstd else 'gzip', args.level, args.jobs)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A compiled binary companion to the text files of a crest4 database.
+
+Parsing the `.map`, `.names` and `.tre` files of a large database with
+Python loops takes a long time and every process doing so holds its own
+copy in memory. The `.bin` file generated alongside them contains the same
+information in arrays that can be used directly from a memory map:
+
+    * `parent`       - int32, the parent of every node (-1 for the root and
+                       -2 for numbers that are not used).
+    * `depth`        - int32, the distance of every node to the root.
+    * `similarity`   - float64, the threshold from the `.names` file.
+    * `name_offsets` - int64, where the name of every node starts in the
+                       UTF-8 `names` blob (with one extra final offset).
+    * `acc_offsets`  - int64, the same for the accessions, which are sorted
+                       so that they can be found with a binary search.
+    * `acc_node`     - int32, the node of every sorted accession.
+
+Arrays are indexed by node number. Loading a database is just opening the
+file, so it takes milliseconds whatever its size, and all the processes
+reading the same file share the same memory pages.
+
+Typically you would use it like this:
+
+    >>> db = BinaryDatabase('silvamod138pr2.bin')
+    >>> node = db.acc_to_node['OQ071217']
+    >>> db.name(node), db.similarity[node], db.lineage(node)
+
+To compile the `.bin` file of an existing database from its text files:
+
+    $ ./binary_db.py ../databases/silvamod138pr2/silvamod138pr2
+"""
+
+# Built-in modules #
+import os, sys, mmap, json, struct
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+
+# Constants #
+MAGIC   = b'CREST4DB'
+VERSION = 1
+UNUSED  = -2
+
+# The sections in order, with their item type #
+SECTIONS = (('parent',       'i'),
+            ('depth',        'i'),
+            ('similarity',   'd'),
+            ('name_offsets', 'q'),
+            ('names',        'B'),
+            ('acc_offsets',  'q'),
+            ('accessions',   'B'),
+            ('acc_node',     'i'))
+
+###############################################################################
+def write_database(path, parent, depth, similarity, names, accessions):
+    """
+    Write a binary database to `path`.
+
+    * `parent`, `depth` and `similarity` are sequences indexed by node.
+    * `names` is a sequence of strings indexed by node.
+    * `accessions` is an iterable of `(acc, node)` tuples in any order.
+    """
+    # Encode the names #
+    encoded = [name.encode() for name in names]
+    name_offsets = offsets_of(encoded)
+    # Sort the accessions #
+    accessions = sorted((acc.encode(), node) for acc, node in accessions)
+    acc_offsets = offsets_of([acc for acc, node in accessions])
+    # All the contents #
+    contents = {'parent':       array('i', parent),
+                'depth':        array('i', depth),
+                'similarity':   array('d', similarity),
+                'name_offsets': name_offsets,
+                'names':        b''.join(encoded),
+                'acc_offsets':  acc_offsets,
+                'accessions':   b''.join(acc for acc, node in accessions),
+                'acc_node':     array('i', (node for acc, node in accessions))}
+    # Compute the position of every section, aligned on eight bytes #
+    blobs = [contents[name] if isinstance(contents[name], bytes)
+             else contents[name].tobytes() for name, code in SECTIONS]
+    layout, position = {}, 0
+    for (name, code), blob in zip(SECTIONS, blobs):
+        layout[name] = [position, len(blob)]
+        position += len(blob) + (-len(blob) % 8)
+    header = {'version':   VERSION,
+              'byteorder': sys.byteorder,
+              'nodes':     len(contents['parent']),
+              'entries':   len(accessions),
+              'layout':    layout}
+    header = json.dumps(header).encode()
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+    # Write to a temporary file first so a database is never partial #
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as handle:
+        handle.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for blob in blobs:
+            handle.write(blob)
+            handle.write(b'\0' * (-len(blob) % 8))
+    os.replace(tmp_path, path)
+    return path
+
+def offsets_of(blobs):
+    """The start of every blob when concatenated, plus the total length."""
+    offsets = array('q', [0])
+    total = 0
+    for blob in blobs:
+        total += len(blob)
+        offsets.append(total)
+    return offsets
+
+#-----------------------------------------------------------------------------#
+def compile_database(prefix, output_path=None):
+    """
+    Compile the `.bin` file from the `.tre`, `.names` and `.map` files that
+    start with `prefix`. Returns the path to the file written.
+    """
+    from taxonomy_tree import TaxonomyTree
+    # The names and similarities #
+    taxa = {}
+    with open(prefix + '.names') as handle:
+        for line in handle:
+            num, rest = line.rstrip('\n').split(',', 1)
+            name, smlrty = rest.rsplit(',', 1)
+            taxa[int(num)] = (name, float(smlrty))
+    # The structure #
+    with open(prefix + '.tre') as handle:
+        tre_names, tre_parents = TaxonomyTree.read_newick(handle)
+    numbers = [int(name) if name is not None else 0 for name in tre_names]
+    count   = max(max(numbers), max(taxa)) + 1
+    parent  = array('i', [UNUSED]) * count
+    depth   = array('i', [0]) * count
+    for i, num in enumerate(numbers):
+        up = tre_parents[i]
+        if up == -1:
+            parent[num] = -1
+        else:
+            parent[num] = numbers[up]
+            depth[num]  = depth[numbers[up]] + 1
+    # Nodes missing from the names file get an empty name #
+    names      = [taxa.get(num, ('', 0.0))[0] for num in range(count)]
+    similarity = [taxa.get(num, ('', 0.0))[1] for num in range(count)]
+    # The accessions #
+    def accessions():
+        with open(prefix + '.map') as handle:
+            for line in handle:
+                num, acc = line.rstrip('\n').split(',', 1)
+                yield acc, int(num)
+    # Write #
+    if output_path is None: output_path = prefix + '.bin'
+    return write_database(output_path, parent, depth, similarity, names,
+                          accessions())
+
+###############################################################################
+class BinaryDatabase:
+    """
+    A read-only view on a `.bin` file through a memory map. Nothing is
+    parsed on opening, every lookup reads the mapped pages directly.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self.mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        # Parse the header #
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            raise Exception("The file '%s' is not a crest4 binary database."
+                            % path)
+        size  = struct.unpack('<I', self.mmap[len(MAGIC):len(MAGIC) + 4])[0]
+        start = len(MAGIC) + 4
+        header = json.loads(self.mmap[start:start + size])
+        if header['version'] != VERSION:
+            raise Exception("The binary database '%s' has version %i, "
+                            "please compile it again." % (path, header['version']))
+        if header['byteorder'] != sys.byteorder:
+            raise Exception("The binary database '%s' was compiled on a "
+                            "machine with a different byte order." % path)
+        # Make views on every section #
+        self.header = header
+        data = memoryview(self.mmap)[start + size:]
+        for name, code in SECTIONS:
+            offset, length = header['layout'][name]
+            setattr(self, name, data[offset:offset + length].cast(code))
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        msg = "<%s object on '%s' with %i nodes and %i accessions>"
+        return msg % (self.__class__.__name__, self.path, len(self),
+                      len(self.acc_node))
+
+    def __len__(self):
+        """The number of node slots, including unused numbers."""
+        return len(self.parent)
+
+    # ------------------------------- Nodes --------------------------------- #
+    def name(self, node):
+        start, end = self.name_offsets[node], self.name_offsets[node + 1]
+        return bytes(self.names[start:end]).decode()
+
+    def lineage(self, node):
+        """The list of taxon names from the root down to this node."""
+        path = []
+        while node >= 0:
+            path.append(self.name(node))
+            node = self.parent[node]
+        return path[::-1]
+
+    def nodes(self):
+        """Iterate over the node numbers that are used."""
+        parent = self.parent
+        return (node for node in range(len(parent)) if parent[node] != UNUSED)
+
+    def descendants(self, node):
+        """
+        A bytearray flagging `node` and every node below it. The parents
+        are followed once per node thanks to the flags already computed.
+        """
+        parent = self.parent
+        state  = bytearray(len(parent))   # 0 unknown, 1 inside, 2 outside
+        state[node] = 1
+        for start in range(len(parent)):
+            path, current = [], start
+            while current >= 0 and not state[current]:
+                path.append(current)
+                current = parent[current]
+            flag = state[current] if current >= 0 else 2
+            for item in path: state[item] = flag
+        return bytearray(flag == 1 for flag in state)
+
+    def clade_accessions(self, node):
+        """The accessions of all the leaves in the clade of `node`."""
+        inside = self.descendants(node)
+        return [self.accession(i) for i, leaf in enumerate(self.acc_node)
+                if inside[leaf]]
+
+    # ----------------------------- Accessions ------------------------------ #
+    def accession(self, i):
+        """The accession at position `i` in sorted order."""
+        start, end = self.acc_offsets[i], self.acc_offsets[i + 1]
+        return bytes(self.accessions[start:end]).decode()
+
+    def find(self, acc):
+        """Return the first sorted position of `acc`, or -1 if absent."""
+        key = acc.encode()
+        sorted_keys = _SortedKeys(self)
+        i = bisect_left(sorted_keys, key)
+        if i < len(sorted_keys) and sorted_keys[i] == key: return i
+        return -1
+
+    @property
+    def acc_to_node(self):
+        """A read-only dictionary-like view from accession to node."""
+        return AccessionIndex(self)
+
+    def close(self):
+        for name, code in SECTIONS: getattr(self, name).release()
+        self.mmap.close()
+
+#-----------------------------------------------------------------------------#
+class _SortedKeys:
+    """The sorted accessions as bytes, for use with `bisect`."""
+
+    def __init__(self, db):
+        self.offsets, self.blob = db.acc_offsets, db.accessions
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+class AccessionIndex(Mapping):
+    """Maps accessions to node numbers with a binary search."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __getitem__(self, acc):
+        i = self.db.find(acc)
+        if i < 0: raise KeyError(acc)
+        return self.db.acc_node[i]
+
+    def __len__(self):
+        return len(self.db.acc_node)
+
+    def __iter__(self):
+        return (self.db.accession(i) for i in range(len(self)))
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    import argparse
+    parser = argparse.ArgumentParser(description=
+        "Compile the `.bin` file of a crest4 database from its text files.")
+    parser.add_argument("prefix", help="The path to the database files "
+                        "without their extension.")
+    args = parser.parse_args()
+    # Run it #
+    print(compile_database(args.prefix))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Opening of input files that might be compressed, with the decompression
+happening outside of the thread that parses the lines.
+
+The format is detected by reading the magic number of the file:
+
+    * gzip  (`1f 8b`)       - decompressed in a background thread. If the
+                              file is BGZF (a series of independent gzip
+                              members, as written by `bgzip`), the blocks
+                              are decompressed in parallel on several cores.
+    * zstd  (`28 b5 2f fd`) - decompressed in a background thread. This
+                              requires the optional `zstandard` package.
+    * anything else         - opened as a plain file.
+
+The decoded data is passed to the reading thread through a bounded queue,
+so memory usage stays constant whatever the size of the input. Since
+`zlib` releases the GIL, decompression and parsing really run at the same
+time. The object returned behaves like a file opened with `open()`.
+
+Typically you would use it like this:
+
+    >>> with open_input('ARB_export.tsv.gz', 'rt') as handle:
+    ...     for line in handle: pass
+"""
+
+# Built-in modules #
+import os, io, gzip, zlib, queue, struct, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Constants #
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+###############################################################################
+def open_input(path, mode='rb', jobs=None, chunk_size=2**20, queue_size=16):
+    """
+    Open `path` for reading in mode 'rb' or 'rt', uncompressing it in the
+    background if it is gzipped or zstd compressed. The `jobs` parameter
+    is the number of threads used for BGZF files (defaults to all cores).
+    """
+    # Check the mode #
+    if mode not in ('r', 'rb', 'rt'):
+        raise ValueError("Only the modes 'rb' and 'rt' are supported.")
+    # Check the format by reading the magic number #
+    with open(path, 'rb') as handle:
+        header = handle.read(18)
+    # Pick the right decompressor #
+    if header.startswith(GZIP_MAGIC):
+        if is_bgzf(header): chunks = bgzf_chunks(path, jobs or os.cpu_count())
+        else:               chunks = gzip_chunks(path, chunk_size)
+    elif header.startswith(ZSTD_MAGIC):
+        chunks = zstd_chunks(path, chunk_size)
+    else:
+        return open(path, mode)
+    # Wrap it to look like a file #
+    raw    = BackgroundReader(chunks, queue_size)
+    binary = io.BufferedReader(raw, buffer_size=chunk_size)
+    if mode == 'rb': return binary
+    return io.TextIOWrapper(binary)
+
+def is_compressed(path):
+    """True if `open_input()` would uncompress the file at `path`."""
+    with open(path, 'rb') as handle:
+        header = handle.read(4)
+    return header.startswith(GZIP_MAGIC) or header.startswith(ZSTD_MAGIC)
+
+###############################################################################
+class BackgroundReader(io.RawIOBase):
+    """
+    A read-only raw stream whose data comes from an iterator of `bytes`
+    chunks consumed in a background thread and passed through a bounded
+    queue. Exceptions raised by the iterator are raised again on reading.
+    """
+
+    def __init__(self, chunks, queue_size=16):
+        # The queue between the two threads #
+        self.queue   = queue.Queue(queue_size)
+        self.stopped = threading.Event()
+        # The chunk currently being read #
+        self.chunk    = b''
+        self.position = 0
+        self.finished = False
+        # Start producing #
+        self.thread = threading.Thread(target=self.produce, args=(chunks,),
+                                       daemon=True)
+        self.thread.start()
+
+    def produce(self, chunks):
+        """This runs in the background thread."""
+        try:
+            for chunk in chunks:
+                if not self.put(chunk): return
+        except BaseException as error:
+            self.put(error)
+        else:
+            self.put(None)
+
+    def put(self, item):
+        """Block until there is room in the queue or we are closed."""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # Get a new chunk if the current one is exhausted #
+        while self.position >= len(self.chunk):
+            if self.finished: return 0
+            item = self.queue.get()
+            if item is None:
+                self.finished = True
+                return 0
+            if isinstance(item, BaseException):
+                self.finished = True
+                raise item
+            self.chunk, self.position = item, 0
+        # Copy as much as we can #
+        count = min(len(buffer), len(self.chunk) - self.position)
+        buffer[:count] = self.chunk[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def close(self):
+        self.stopped.set()
+        super().close()
+
+###############################################################################
+def gzip_chunks(path, chunk_size):
+    """Decompress a regular gzip file (single or multi-member)."""
+    with gzip.open(path, 'rb') as handle:
+        while True:
+            chunk = handle.read(chunk_size)
+            if not chunk: return
+            yield chunk
+
+def zstd_chunks(path, chunk_size):
+    """
+    Decompress a zstd file, including ones with several frames. The
+    optional dependency is imported right away, not in the background.
+    """
+    try:
+        import zstandard
+    except ImportError:
+        msg = "Reading zstd files requires the `zstandard` package."
+        raise ImportError(msg) from None
+    decompressor = zstandard.ZstdDecompressor()
+    def chunks():
+        with open(path, 'rb') as handle, \
+             decompressor.stream_reader(handle,
+                                        read_across_frames=True) as reader:
+            while True:
+                chunk = reader.read(chunk_size)
+                if not chunk: return
+                yield chunk
+    return chunks()
+
+#-----------------------------------------------------------------------------#
+def is_bgzf(header):
+    """
+    A BGZF block is a gzip member with the FEXTRA flag whose first extra
+    subfield is called 'BC' and stores the size of the block.
+    """
+    return (len(header) >= 18 and header[3] & 4 and header[12:14] == b'BC')
+
+def bgzf_blocks(handle):
+    """Yield the raw deflate data, CRC and size of every BGZF block."""
+    while True:
+        header = handle.read(18)
+        if not header: return
+        if not is_bgzf(header):
+            raise ValueError("Invalid BGZF block in '%s'." % handle.name)
+        extra_len  = struct.unpack('<H', header[10:12])[0]
+        block_size = struct.unpack('<H', header[16:18])[0] + 1
+        rest = handle.read(block_size - 18)
+        data = rest[extra_len - 6:-8]
+        crc, size = struct.unpack('<II', rest[-8:])
+        yield data, crc, size
+
+def inflate_block(data, crc, size):
+    """Runs in a worker thread, `zlib` releases the GIL."""
+    result = zlib.decompress(data, -15)
+    if len(result) != size or zlib.crc32(result) != crc:
+        raise ValueError("Corrupted BGZF block (CRC or size mismatch).")
+    return result
+
+def bgzf_chunks(path, jobs):
+    """
+    Decompress the BGZF blocks on `jobs` threads while keeping their order.
+    Only a bounded number of blocks are in flight at any time.
+    """
+    window = deque()
+    with open(path, 'rb') as handle, ThreadPoolExecutor(jobs) as pool:
+        for block in bgzf_blocks(handle):
+            window.append(pool.submit(inflate_block, *block))
+            if len(window) >= jobs * 4:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
@@ -12,8 +12,10 @@ To analyze all databases, you can run this:
 """
 
 # Imports #
+import os, re, sys
 import argparse
 import inspect
+import tempfile
 from functools import cached_property
 from autopaths import Path
 
@@ -21,6 +23,11 @@ from autopaths import Path
 this_file = Path((inspect.stack()[0])[1])
 this_dir  = this_file.directory
 
+# Internal modules #
+sys.path.insert(0, str(this_dir.directory))
+from binary_db import BinaryDatabase, compile_database
+from fasta_tools import iter_fasta_ids
+
 ###############################################################################
 class AnalyzeTree:
 
@@ -37,12 +44,39 @@ class AnalyzeTree:
         self.tre_path   = self.input_dir + f'{db_name}.tre'
         self.names_path = self.input_dir + f'{db_name}.names'
         self.fasta_path = self.input_dir + f'{db_name}.fasta'
+        self.bin_path   = self.input_dir + f'{db_name}.bin'
 
     def __repr__(self):
         """A simple representation of this object to avoid memory addresses."""
         return "<%s object on '%s'>" % (self.__class__.__name__, self.input_dir)
 
     # ---------------------------- Properties ------------------------------- #
+    @cached_property
+    def binary(self):
+        """
+        The memory-mapped binary version of the database. If the `.bin` is
+        missing or older than the text files, a fresh one is compiled in a
+        temporary directory, as the analysis never writes to the database.
+        """
+        texts = (self.map_path, self.tre_path, self.names_path)
+        mtime = lambda path: os.path.getmtime(str(path))
+        if os.path.exists(str(self.bin_path)) and \
+           all(mtime(self.bin_path) >= mtime(path) for path in texts):
+            return BinaryDatabase(str(self.bin_path))
+        # Removed when this object is garbage collected #
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='analyze_')
+        bin_path = os.path.join(self.tmp_dir.name, self.bin_path.name)
+        compile_database(self.input_dir + self.input_dir.name, bin_path)
+        return BinaryDatabase(bin_path)
+
+    def summary(self):
+        """Return counts read directly from the binary database."""
+        db = self.binary
+        nodes = list(db.nodes())
+        return {'nodes':      len(nodes),
+                'accessions': len(db.acc_node),
+                'max_depth':  max(db.depth[node] for node in nodes)}
+
     @cached_property
     def tree3(self):
         """
@@ -88,49 +122,178 @@ class AnalyzeTree:
         return {'tree3': tree3_empty, 'tree4': tree4_empty}
 
     # ------------------------------ Methods -------------------------------- #
-    def parse_map_ids(self):
+    def parse_map(self):
+        """Yield the node id and accession of every line in one pass."""
         with open(self.map_path, 'rt') as handle:
             for line in handle:
-                yield line.split(',')[0].strip()
-
-    def parse_map_names(self):
-        with open(self.map_path, 'rt') as handle:
-            for line in handle:
-                yield line.split(',')[1].strip()
+                num, acc = line.split(',', 1)
+                yield num.strip(), acc.strip()
 
     def parse_names_ids(self):
         with open(self.names_path, 'rt') as handle:
             for line in handle:
                 yield line.split(',')[0].strip()
 
+    def parse_tree_ids(self, chunk_size=2**20):
+        """See `newick_names()`."""
+        with open(self.tre_path, 'rt') as handle:
+            yield from newick_names(handle, chunk_size)
+
     def parse_fasta_ids(self):
-        from Bio import SeqIO
-        with open(self.fasta_path) as handle:
-            for record in SeqIO.parse(handle, "fasta"):
-                yield record.id
-
-    def get_duplicates(self, seq):
-        seen = set()
-        add_to_seen = seen.add
-        return set(x for x in seq if x in seen or add_to_seen(x))
-
-    def __call__(self):
-        map_ids   = list(self.parse_map_ids())
-        map_names = list(self.parse_map_names())
-        tre_ids   = list(self.parse_tree4_ids())
-        names_ids = list(self.parse_names_ids())
-        fasta_ids = list(self.parse_fasta_ids())
-
-        dup_map_ids   = self.get_duplicates(map_ids)
-        dup_map_names = self.get_duplicates(map_names)
-        dup_tre_ids   = self.get_duplicates(tre_ids)
-        dup_names_ids = self.get_duplicates(names_ids)
-        dup_fasta_ids = self.get_duplicates(fasta_ids)
-
-        print(f"dup_map_names : {dup_map_names}",  len(dup_map_names))
-        print(f"dup_tre_ids   : {dup_tre_ids}",    len(dup_tre_ids))
-        print(f"dup_names_ids : {dup_names_ids}",  len(dup_names_ids))
-        print(f"dup_fasta_ids : {dup_fasta_ids}",  len(dup_fasta_ids))
+        """Only the header lines are looked at, sequences are skipped."""
+        return iter_fasta_ids(str(self.fasta_path))
+
+    # FASTA files above this size are analyzed with sketches by default #
+    sketch_above = 2**33
+
+    def __call__(self, sketch=None, examples=10):
+        """
+        Compute all statistics reading every file only once.
+
+        Node ids are numbers, so they are recorded in bitmaps. Strings
+        (accessions) are recorded in a `set`, or in a `BloomFilter` of
+        fixed size if `sketch` is true, in which case duplicates are only
+        probable and missing accessions might be under-reported. The sets
+        take about a hundred bytes per accession, i.e. a few GiB for tens
+        of millions of sequences. If `sketch` is None, the sketches are
+        used when the FASTA is larger than `sketch_above` bytes.
+        """
+        if sketch is None:
+            sketch = os.path.getsize(self.fasta_path) > self.sketch_above
+        # Keep a few examples and a total count for every problem #
+        report = {}
+        def problem(title, item):
+            entry = report.setdefault(title, [0, []])
+            entry[0] += 1
+            if len(entry[1]) < examples: entry[1].append(item)
+        make_set = BloomFilter if sketch else set
+        # FASTA file #
+        fasta_ids = make_set()
+        for acc in self.parse_fasta_ids():
+            if acc in fasta_ids: problem('dup_fasta_ids', acc)
+            else: fasta_ids.add(acc)
+        # Tree file #
+        tree_nodes, tree_leaves = Bitmap(), Bitmap()
+        for name, is_leaf in self.parse_tree_ids():
+            if not name:
+                problem('unnamed_tre_nodes', name)
+                continue
+            if tree_nodes.add(int(name)): problem('dup_tre_ids', name)
+            if is_leaf: tree_leaves.add(int(name))
+        # Names file #
+        names_nodes = Bitmap()
+        for num in self.parse_names_ids():
+            if names_nodes.add(int(num)): problem('dup_names_ids', num)
+            if int(num) not in tree_nodes:
+                problem('names_ids_not_in_tre', num)
+        for num in tree_nodes:
+            if num not in names_nodes: problem('tre_ids_not_in_names', num)
+        # Map file #
+        map_accs = make_set()
+        for num, acc in self.parse_map():
+            if acc in map_accs: problem('dup_map_names', acc)
+            else: map_accs.add(acc)
+            if int(num) not in tree_leaves:
+                problem('map_ids_not_tre_leaves', num)
+            if acc not in fasta_ids:
+                problem('map_names_not_in_fasta', acc)
+        # Print #
+        for title, (count, items) in report.items():
+            print(f"{title:<24}: {count:>9}  e.g. {items}")
+        if not report: print("No problems found.")
+        # Return #
+        return {title: count for title, (count, items) in report.items()}
+
+###############################################################################
+def newick_names(handle, chunk_size=2**20):
+    """
+    Yield the name of every node in the Newick file `handle` and whether
+    it is a leaf, reading the file in chunks without building any tree.
+    Unnamed nodes are yielded with an empty name: a `)` directly followed
+    by `,`, `)` or `;` is an unnamed internal node, and a `(` or `,`
+    directly followed by `,` or `)` is an unnamed leaf.
+    """
+    tokenize = re.compile(r'[(),;]|[^(),;]+').findall
+    # The last delimiter, or nothing if a name came after it #
+    last, rest = '', ''
+    while True:
+        chunk = handle.read(chunk_size)
+        text  = rest + chunk
+        # Keep a name that might be cut at the end of the chunk #
+        cut = max(text.rfind(c) for c in '(),;') + 1 if chunk else len(text)
+        text, rest = text[:cut], text[cut:]
+        for token in tokenize(text):
+            if token in '(),;':
+                if last == ')' and token in ',);': yield '', False
+                if last in ('(', ',') and token in ',)': yield '', True
+                last = token
+                continue
+            # Whitespace between delimiters is not a name #
+            token = token.strip()
+            if not token: continue
+            yield token.split(':')[0], last != ')'
+            last = ''
+        if not chunk: return
+
+#-----------------------------------------------------------------------------#
+class Bitmap:
+    """A set of non-negative integers stored as one byte per possible value."""
+
+    def __init__(self):
+        self.bits  = bytearray()
+        self.count = 0
+
+    def add(self, num):
+        """Add `num` and return True if it was already present."""
+        if num >= len(self.bits):
+            self.bits.extend(bytes(max(num + 1 - len(self.bits),
+                                       len(self.bits))))
+        if self.bits[num]: return True
+        self.bits[num] = 1
+        self.count += 1
+        return False
+
+    def __contains__(self, num):
+        return 0 <= num < len(self.bits) and self.bits[num] == 1
+
+    def __iter__(self):
+        return (num for num, bit in enumerate(self.bits) if bit)
+
+    def __len__(self):
+        return self.count
+
+#-----------------------------------------------------------------------------#
+class BloomFilter:
+    """
+    A probabilistic set of fixed size (`2**bits_log2` bits). It never
+    misses an item that was added, but can claim to contain items that
+    were not, with a probability that grows with the number of items.
+    """
+
+    def __init__(self, bits_log2=30, hashes=7):
+        self.bits   = bytearray(2**bits_log2 // 8)
+        self.mask   = 2**bits_log2 - 1
+        self.hashes = hashes
+
+    def positions(self, item):
+        """Double hashing from a single 64-bit hash."""
+        h = hash(item) & (2**64 - 1)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) & self.mask for i in range(self.hashes)]
+
+    def add(self, item):
+        """Add `item` and return True if it was probably already present."""
+        present = True
+        for pos in self.positions(item):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not self.bits[byte] & bit:
+                present = False
+                self.bits[byte] |= bit
+        return present
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self.positions(item))
 
 ###############################################################################
 if __name__ == '__main__':
@@ -145,10 +308,20 @@ if __name__ == '__main__':
         default=None,
         help="Directory containing .map, .tre, .names, .fasta files",
     )
+    # Optionally use fixed size sketches for huge databases #
+    parser.add_argument(
+        "--sketch",
+        action="store_true",
+        default=None,
+        help="Use Bloom filters instead of exact hash sets for accessions "
+             "(the default for FASTA files above 8 GiB).",
+    )
     # Run it #
     args = parser.parse_args()
     # Create an object #
     analysis = AnalyzeTree(args.directory)
     # Run some test functions #
     print(analysis)
+    print(analysis.summary())
+    analysis(sketch=args.sketch)
     print(analysis.check_empty_names())
\ No newline at end of file
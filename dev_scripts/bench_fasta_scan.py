@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A script to compare the time needed to read all identifiers of a FASTA
+file with `Bio.SeqIO` (as `analyze_tre_files.py` used to do) and with the
+memory-mapped header scanner of `fasta_tools.py`.
+
+A synthetic FASTA with `--records` entries wrapped at 60 columns is
+generated first. Both methods must return the same identifiers.
+
+You would call it like this:
+
+    $ ./dev_scripts/bench_fasta_scan.py --records 1000000
+"""
+
+# Built-in modules #
+import os, sys, time, random, argparse, tempfile
+
+# Internal modules #
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+from fasta_tools import fasta_ids, scan_fasta
+
+###############################################################################
+def make_synthetic_fasta(path, records, width=60):
+    """Write `records` entries of random length between 900 and 1800."""
+    rng = random.Random(0)
+    pool = ''.join(rng.choice('ACGU') for i in range(4000))
+    with open(path, 'w') as handle:
+        for i in range(records):
+            start  = rng.randrange(2000)
+            seq    = pool[start:start + rng.randrange(900, 1800)]
+            lines  = [seq[j:j + width] for j in range(0, len(seq), width)]
+            handle.write('>AB%06i.1.%i some description\n%s\n' %
+                         (i, len(seq), '\n'.join(lines)))
+    return path
+
+def ids_with_seqio(path):
+    """The way the identifiers used to be read."""
+    from Bio import SeqIO
+    return [record.id for record in SeqIO.parse(path, 'fasta')]
+
+def ids_with_lengths(path):
+    """The scanner when the sequence lengths are also requested."""
+    return scan_fasta(path, lengths=True).ids
+
+def measure(function, path):
+    """Return the seconds elapsed and the result."""
+    start = time.perf_counter()
+    result = function(path)
+    return time.perf_counter() - start, result
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--records", type=int, default=1000000,
+                        help="Number of records in the synthetic FASTA.")
+    args = parser.parse_args()
+    # Run every method on the same input #
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = make_synthetic_fasta(os.path.join(tmp_dir, 'bench.fasta'),
+                                    args.records)
+        print("Synthetic FASTA: %i records, %.1f MiB" %
+              (args.records, os.path.getsize(path) / 1024**2))
+        methods = [('scanner', fasta_ids), ('lengths', ids_with_lengths),
+                   ('seqio',   ids_with_seqio)]
+        reference, timings = None, {}
+        for title, function in methods:
+            try:
+                elapsed, ids = measure(function, path)
+            except ImportError as error:
+                print("%-8s skipped (%s)" % (title, error))
+                continue
+            if reference is None: reference = ids
+            if ids != reference:
+                sys.exit("The method '%s' returned different ids." % title)
+            timings[title] = elapsed
+            print("%-8s %8.2f s" % (title, elapsed))
+    # Compare #
+    if 'seqio' in timings:
+        print("Speedup over SeqIO: %.1fx" %
+              (timings['seqio'] / timings['scanner']))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A benchmark of the parsing of taxonomic paths done by `lineage.py`.
+
+The example TSV is scaled up `--factor` times (see `bench_tree_engine.py`)
+and every tenth copy gets a number-only segment at the end of its paths,
+like "Bacillus sp. Con a/4". Every row is also repeated `--repeat` times
+with another accession, as several accessions of the same species would.
+
+The rows are then parsed in three ways: with the loop over the segments
+that `make_new_crest_db.py` used before, with the regular expression split
+called for every row, and with the batches of a `LineageParser`. All three
+must give the same paths.
+
+You would call it like this:
+
+    $ ./dev_scripts/bench_lineage.py --factor 5000 --repeat 3
+"""
+
+# Built-in modules #
+import os, sys, csv, time, argparse, tempfile
+
+# Internal modules #
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+from lineage import LineageParser, split_path
+from bench_tree_engine import example_tsv
+
+###############################################################################
+def write_tsv(destination, factor, repeat):
+    """Write the scaled TSV and return its number of rows."""
+    with open(example_tsv) as handle:
+        rows = [line.rstrip('\n').split('\t') for line in handle]
+    count = 0
+    with open(destination, 'w') as handle:
+        for copy in range(factor):
+            number = '/%i' % (copy % 7 + 1) if copy % 10 == 0 else ''
+            for acc, path, name in rows:
+                for i in range(repeat):
+                    handle.write('%s.%i.%i\t%s %i%s\t%s %i\n' %
+                                 (acc, copy, i, path, copy, number, name, copy))
+                    count += 1
+    return count
+
+#-----------------------------------------------------------------------------#
+def parse_loop(path):
+    """The CSV reader and the loop over segments used previously."""
+    result = []
+    with open(path, newline='') as handle:
+        for acc, path, full_name in csv.reader(handle, delimiter='\t'):
+            fixed_path = []
+            for i, segment in enumerate(path.split('/')):
+                if segment.isdigit() and i > 0:
+                    fixed_path[-1] = fixed_path[-1] + '/' + segment
+                else:
+                    fixed_path.append(segment)
+            result.append((acc, fixed_path))
+    return result
+
+def parse_regex(path):
+    """The CSV reader and the regular expression called on every row."""
+    with open(path, newline='') as handle:
+        return [(acc, split_path(path)) for acc, path, full_name
+                in csv.reader(handle, delimiter='\t')]
+
+def parse_batches(path):
+    """The batches of a `LineageParser`, reusing the previous path."""
+    with open(path, 'rb') as handle:
+        return [row for batch in LineageParser().read_batches(handle)
+                for row in batch]
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--factor", type=int, default=5000,
+                        help="How many times to scale up the example TSV.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="How many accessions every path has.")
+    args = parser.parse_args()
+    # Parse the scaled input three ways #
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path  = os.path.join(tmp_dir, 'scaled.tsv')
+        count = write_tsv(path, args.factor, args.repeat)
+        print("Scaled TSV: %i rows" % count)
+        for name, function in (('loop',    parse_loop),
+                               ('regex',   parse_regex),
+                               ('batches', parse_batches)):
+            start = time.perf_counter()
+            results[name] = function(path)
+            seconds = time.perf_counter() - start
+            print("%-10s %8.2f s  %10i rows/s" %
+                  (name, seconds, count / seconds))
+            if name == 'loop': reference = seconds
+    # Check they all agree #
+    assert results['loop'] == results['regex'] == results['batches']
+    print("Speedup: %.2fx" % (reference / seconds))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A benchmark showing that the generation of the `.names` file is linear in
+the number of nodes of the tree.
+
+The depth of every node is recorded when it is inserted in the tree, so
+producing the `.names` lines is a single level-order pass over the nodes.
+The script exits with an error code when the time per node of the largest
+tree is more than `--tolerance` times the one of the smallest tree.
+
+You would call it like this:
+
+    $ ./dev_scripts/bench_names_file.py --rows 1000000
+"""
+
+# Built-in modules #
+import os, sys, time, argparse, tempfile
+
+# Internal modules #
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+from make_new_crest_db import AccessionTSV
+from bench_tree_build import make_synthetic_tsv
+
+###############################################################################
+def time_names(path):
+    """Return the number of nodes and the seconds to generate the lines."""
+    acc_tsv = AccessionTSV(path, snapshot=False)
+    nodes   = len(acc_tsv.tree)
+    start   = time.perf_counter()
+    for line in acc_tsv.names_file.lines(): pass
+    return nodes, time.perf_counter() - start
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--rows", type=int, default=1000000,
+                        help="Number of rows in the largest synthetic TSV.")
+    parser.add_argument("--steps", type=int, default=4,
+                        help="Number of input sizes to test.")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="Maximum allowed growth of the time per node.")
+    args = parser.parse_args()
+    # Try increasing sizes #
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for step in range(1, args.steps + 1):
+            rows = args.rows * step // args.steps
+            path = make_synthetic_tsv(os.path.join(tmp_dir, 'bench.tsv'), rows)
+            nodes, seconds = time_names(path)
+            results.append((nodes, seconds))
+            print("%10i nodes: %8.2f s  (%.2f µs/node)" %
+                  (nodes, seconds, 1e6 * seconds / nodes))
+    # Check that the growth is linear #
+    first = results[0][1]  / results[0][0]
+    last  = results[-1][1] / results[-1][0]
+    ratio = last / first
+    print("Growth of the time per node: %.2fx" % ratio)
+    if ratio > args.tolerance:
+        sys.exit("The generation of the names file is not linear.")
+    print("Success.")
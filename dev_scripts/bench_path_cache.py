@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A benchmark of the cache of the last path used when building the tree in
+`make_new_crest_db.py`.
+
+The example TSV is scaled up `--factor` times (see `bench_tree_engine.py`)
+and parsed once. The rows are then added to a new tree in two ways: with
+`TaxonomyTree.add_path()`, which starts from the root for every row, and
+with a `PathCache`, which starts from the deepest node shared with the
+previous row. Both trees must be identical.
+
+The memory taken by the names in the parsed paths is also measured before
+and after the names shared by consecutive paths are made the same objects
+with `PathCache.share()`, as `AccessionTSV.lineages()` does.
+
+You would call it like this:
+
+    $ ./dev_scripts/bench_path_cache.py --factor 1000
+"""
+
+# Built-in modules #
+import os, sys, time, argparse, tempfile
+
+# Internal modules #
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+from make_new_crest_db import AccessionTSV
+from taxonomy_tree import TaxonomyTree, PathCache
+from bench_tree_engine import scale_tsv, example_tsv
+
+###############################################################################
+def names_size(rows):
+    """The memory in megabytes of the distinct string objects in paths."""
+    objects = {id(name): name for acc, path in rows for name in path}
+    return sum(map(sys.getsizeof, objects.values())) / 1024**2
+
+def build(rows, cached):
+    """Return the tree, the seconds elapsed and the cache used if any."""
+    tree  = TaxonomyTree(root_name="meta")
+    cache = PathCache(tree)
+    add_path = cache.add_path if cached else tree.add_path
+    start = time.perf_counter()
+    for acc, path in rows: tree.add_accession(add_path(path), acc)
+    return tree, time.perf_counter() - start, cache
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--factor", type=int, default=1000,
+                        help="How many times to scale up the example TSV.")
+    args = parser.parse_args()
+    # Parse the scaled input #
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = scale_tsv(example_tsv, os.path.join(tmp_dir, 'scaled.tsv'),
+                         args.factor)
+        rows = [row for batch in AccessionTSV(path).batches()
+                for row in batch]
+    size = names_size(rows)
+    print("Scaled TSV: %i rows" % len(rows))
+    # Build both ways #
+    plain, plain_seconds, _ = build(rows, cached=False)
+    tree, seconds, cache = build(rows, cached=True)
+    assert tree.parent == plain.parent and tree.names == plain.names
+    assert tree.name_idx == plain.name_idx and tree.acc_node == plain.acc_node
+    print("%-10s %8.2f s  %10i rows/s" %
+          ('no cache', plain_seconds, len(rows) / plain_seconds))
+    print("%-10s %8.2f s  %10i rows/s  (%.1f%% hits)" %
+          ('cache', seconds, len(rows) / seconds, 100 * cache.hit_rate))
+    # The cache can also make the names shared #
+    share  = PathCache().share
+    shared = [(acc, share(path)[1]) for acc, path in rows]
+    assert shared == rows
+    print("Names in the parsed paths: %.1f MiB shared instead of %.1f MiB" %
+          (names_size(shared), size))
+    print("Speedup: %.2fx" % (plain_seconds / seconds))
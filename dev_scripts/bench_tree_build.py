@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A regression benchmark for the tree building step of `make_new_crest_db.py`.
+
+It generates synthetic TSV files with a very wide fan-out (thousands of
+children under the root and phylum levels, like SILVA or PR2 exports) and
+times the construction of the tree for increasing numbers of rows.
+
+If looking up the children of a node is not constant time, the time spent
+per row grows with the size of the input. The script exits with an error
+code when the time per row of the largest input is more than `--tolerance`
+times the one of the smallest input.
+
+You would call it like this:
+
+    $ ./dev_scripts/bench_tree_build.py --rows 2000000
+"""
+
+# Built-in modules #
+import os, sys, time, argparse, tempfile
+
+# Internal modules #
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+from make_new_crest_db import AccessionTSV
+
+###############################################################################
+def make_synthetic_tsv(path, rows, fan_out=2000):
+    """
+    Write a TSV with `rows` lines. Every level of the path has up to
+    `fan_out` distinct children so that the tree is as wide as possible.
+    """
+    with open(path, 'w') as handle:
+        for i in range(rows):
+            phylum  = 'Phylum %i'  % (i % fan_out)
+            klass   = 'Class %i'   % ((i // 7) % fan_out)
+            genus   = 'Genus %i'   % (i // 3)
+            species = 'Species %i' % i
+            path_str = '/'.join(('Main genome', 'Eukaryota', phylum, klass,
+                                 genus, species))
+            handle.write('ACC%09i\t%s\t%s\n' % (i, path_str, species))
+    return path
+
+def time_build(path):
+    """Return the number of seconds needed to build the tree."""
+    acc_tsv = AccessionTSV(path, snapshot=False)
+    start   = time.perf_counter()
+    assert acc_tsv.tree
+    return time.perf_counter() - start
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--rows", type=int, default=2000000,
+                        help="Number of rows in the largest synthetic TSV.")
+    parser.add_argument("--steps", type=int, default=4,
+                        help="Number of input sizes to test.")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="Maximum allowed growth of the time per row.")
+    args = parser.parse_args()
+    # Try increasing sizes #
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for step in range(1, args.steps + 1):
+            rows = args.rows * step // args.steps
+            path = make_synthetic_tsv(os.path.join(tmp_dir, 'bench.tsv'), rows)
+            seconds = time_build(path)
+            results.append((rows, seconds))
+            print("%10i rows: %8.2f s  (%.2f µs/row)" %
+                  (rows, seconds, 1e6 * seconds / rows))
+    # Check that the growth is linear #
+    first = results[0][1]  / results[0][0]
+    last  = results[-1][1] / results[-1][0]
+    ratio = last / first
+    print("Growth of the time per row: %.2fx" % ratio)
+    if ratio > args.tolerance:
+        sys.exit("The tree build time does not grow linearly.")
+    print("Success.")
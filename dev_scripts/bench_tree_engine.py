@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A script to compare the memory and time needed to build the taxonomy tree
+with `ete4` objects (as `make_new_crest_db.py` used to do) and with the
+array-backed `TaxonomyTree`.
+
+The example TSV is scaled up `--factor` times. Every copy gets its own
+accessions and its own species names, so that the number of nodes grows
+with the number of rows as it would with a real database.
+
+You would call it like this:
+
+    $ ./dev_scripts/bench_tree_engine.py --factor 1000
+"""
+
+# Built-in modules #
+import os, sys, time, argparse, tempfile, tracemalloc
+
+# Internal modules #
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+from make_new_crest_db import AccessionTSV
+
+# Constants #
+example_tsv = os.path.join(os.path.dirname(this_dir), 'example_files',
+                           '18S_curated_141222_GenBank_nds.tsv')
+
+###############################################################################
+def scale_tsv(source, destination, factor):
+    """Write `factor` copies of the `source` TSV with unique leaves."""
+    with open(source) as handle:
+        rows = [line.rstrip('\n').split('\t') for line in handle]
+    with open(destination, 'w') as handle:
+        for copy in range(factor):
+            for acc, path, name in rows:
+                handle.write('%s.%i\t%s %i\t%s %i\n' %
+                             (acc, copy, path, copy, name, copy))
+    return destination
+
+def build_with_ete(acc_tsv):
+    """The way the tree was built with one `ete4` object per node."""
+    from ete4 import Tree
+    by_nums, by_parent = {}, {}
+    current_num = 0
+    root = Tree()
+    root.name = current_num
+    root.add_prop('taxa', "meta")
+    by_nums[current_num] = root
+    for acc, path, full_name in acc_tsv:
+        fixed_path = []
+        for i, segment in enumerate(path.split('/')):
+            if segment.isdigit() and i > 0:
+                fixed_path[-1] = fixed_path[-1] + '/' + segment
+            else:
+                fixed_path.append(segment)
+        parent, parent_num = root, 0
+        for name in fixed_path:
+            num = by_parent.get((parent_num, name))
+            if num is None:
+                current_num += 1
+                num = current_num
+                node = parent.add_child(name=num)
+                node.add_prop('taxa', name)
+                by_nums[num] = node
+                by_parent[(parent_num, name)] = num
+            else:
+                node = by_nums[num]
+            parent, parent_num = node, num
+        acc_list = node.get_prop('acc')
+        if acc_list is None: node.add_prop('acc', [acc])
+        else:                acc_list.append(acc)
+    return root
+
+def build_with_arrays(acc_tsv):
+    """The way the tree is built now."""
+    return acc_tsv.tree
+
+def measure(function, path):
+    """Return the seconds elapsed and the peak memory in megabytes."""
+    acc_tsv = AccessionTSV(path, snapshot=False)
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(acc_tsv)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1024**2
+    tracemalloc.stop()
+    del result
+    return elapsed, peak
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--factor", type=int, default=1000,
+                        help="How many times to scale up the example TSV.")
+    args = parser.parse_args()
+    # Run both engines on the same input #
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = scale_tsv(example_tsv, os.path.join(tmp_dir, 'scaled.tsv'),
+                         args.factor)
+        tree = AccessionTSV(path, snapshot=False).tree
+        print("Scaled TSV: %i rows, %i nodes" % (len(tree.accessions),
+                                                  len(tree)))
+        del tree
+        engines = [('arrays', build_with_arrays), ('ete4', build_with_ete)]
+        for title, function in engines:
+            try:
+                elapsed, peak = measure(function, path)
+            except ImportError as error:
+                print("%-8s skipped (%s)" % (title, error))
+                continue
+            print("%-8s %8.2f s  %10.1f MiB peak" % (title, elapsed, peak))
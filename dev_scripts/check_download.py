@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A script to verify the resumable downloads of `download.py` against a
+local HTTP server standing in for the real one.
+
+1) A file fetched in parallel ranges must be identical to the original
+   and pass its checksum.
+
+2) A transfer cut in the middle must resume where it stopped when
+   started again, and not from the beginning.
+
+3) A wrong checksum must raise an error and leave no file behind.
+
+4) A tarball and a gzipped file must be extracted while downloading.
+
+5) A server without support for ranges must still work, sending the
+   file only once.
+"""
+
+# Built-in modules #
+import os, sys, io, gzip, hashlib, tarfile, tempfile, threading
+from http.client import HTTPException
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Internal modules #
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+from download import RangeDownload, ChecksumError
+
+###############################################################################
+class StandIn(BaseHTTPRequestHandler):
+    """
+    Serves the bytes in `files` with support for `Range` and `If-Range`.
+    While `cut_after` is set, responses are cut after that many bytes to
+    simulate broken connections. The served bytes are counted.
+    """
+
+    files     = {}
+    ranges    = True
+    cut_after = None
+    served    = 0
+
+    def do_GET(self):
+        data = self.files.get(self.path)
+        if data is None: return self.send_error(404)
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        start, end, status = 0, len(data), 200
+        # Parse the range #
+        header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if header and self.ranges and if_range in (None, etag):
+            first, last = header.split('=')[1].split('-')
+            start = int(first)
+            end   = int(last) + 1 if last else len(data)
+            status = 206
+        # Send #
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(end - start))
+        if status == 206:
+            self.send_header('Content-Range',
+                             'bytes %i-%i/%i' % (start, end - 1, len(data)))
+        self.end_headers()
+        body = data[start:end]
+        if self.cut_after is not None: body = body[:self.cut_after]
+        # The client may close the connection without reading everything #
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        type(self).served += len(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve():
+    """Start the stand-in server in a thread and return its address."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%i' % server.server_port
+
+###############################################################################
+def check_parallel(url, tmp_dir, data):
+    path = os.path.join(tmp_dir, 'parallel.bin')
+    checksum = 'sha256:' + hashlib.sha256(data).hexdigest()
+    RangeDownload(url + '/data', path, jobs=4, segment_size=2**16,
+                  checksum=checksum, verbose=False)()
+    assert open(path, 'rb').read() == data
+    assert not os.path.exists(path + '.part')
+    print("Parallel ranges: identical.")
+
+def check_resume(url, tmp_dir, data):
+    path = os.path.join(tmp_dir, 'resumed.bin')
+    download = RangeDownload(url + '/data', path, jobs=1, segment_size=2**16,
+                             retries=0, verbose=False)
+    # Break the connection after a few segments #
+    received = 0
+    try:
+        for chunk in download.chunks():
+            received += len(chunk)
+            if received >= 5 * 2**16: StandIn.cut_after = 1000
+    except (IOError, HTTPException):
+        pass
+    StandIn.cut_after = None
+    kept = os.path.getsize(path + '.part')
+    assert 0 < kept < len(data)
+    # Start again #
+    StandIn.served = 0
+    download.retries = 2
+    download()
+    assert open(path, 'rb').read() == data
+    assert StandIn.served <= len(data) - kept + 1
+    print("Resuming: restarted at %i bytes, identical." % kept)
+
+def check_checksum(url, tmp_dir, data):
+    path = os.path.join(tmp_dir, 'wrong.bin')
+    try:
+        RangeDownload(url + '/data', path, checksum='md5:' + '0' * 32,
+                      verbose=False)()
+    except ChecksumError:
+        assert not os.path.exists(path)
+        assert not os.path.exists(path + '.part')
+        print("Wrong checksum: detected.")
+    else:
+        raise AssertionError("The wrong checksum was not detected.")
+
+def check_extraction(url, tmp_dir, data):
+    # Tarball #
+    directory = os.path.join(tmp_dir, 'extracted')
+    RangeDownload(url + '/data.tar.gz', os.path.join(tmp_dir, 'data.tar.gz'),
+                  segment_size=2**16, verbose=False).extract_tar(directory)
+    assert open(os.path.join(directory, 'db', 'data.bin'), 'rb').read() == data
+    assert not os.path.exists(os.path.join(tmp_dir, 'data.tar.gz'))
+    # Gzip with two members #
+    destination = os.path.join(tmp_dir, 'data.fasta')
+    RangeDownload(url + '/data.fasta.gz', destination + '.gz',
+                  segment_size=2**16, verbose=False).gunzip_to(destination)
+    assert open(destination, 'rb').read() == data + data
+    print("Extraction while downloading: identical.")
+
+def check_no_ranges(url, tmp_dir, data):
+    StandIn.ranges, StandIn.served = False, 0
+    path = os.path.join(tmp_dir, 'no_ranges.bin')
+    RangeDownload(url + '/data', path, verbose=False)()
+    StandIn.ranges = True
+    assert open(path, 'rb').read() == data
+    # The response to the probe is read, the file is not asked twice #
+    assert StandIn.served == len(data)
+    print("Server without ranges: identical, sent once.")
+
+###############################################################################
+if __name__ == '__main__':
+    # Some data that doesn't compress too well #
+    data = b''.join(hashlib.sha256(b'%i' % i).hexdigest().encode()
+                    for i in range(40000))
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w:gz') as tar:
+        info = tarfile.TarInfo('db/data.bin')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    StandIn.files = {'/data':          data,
+                     '/data.tar.gz':   tar_buffer.getvalue(),
+                     '/data.fasta.gz': gzip.compress(data) + gzip.compress(data)}
+    # Run every check #
+    server, url = serve()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        check_parallel(url, tmp_dir, data)
+        check_resume(url, tmp_dir, data)
+        check_checksum(url, tmp_dir, data)
+        check_extraction(url, tmp_dir, data)
+        check_no_ranges(url, tmp_dir, data)
+    server.shutdown()
+    print("Success.")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A script to verify `newick_names()` of `analyze_tre_files.py`, which reads
+the node names of a Newick file without building the tree.
+
+1) Small trees with named and unnamed nodes must give the expected names
+   and leaves, whatever the size of the chunks they are read in.
+
+2) The example `.tre` file must give the ids of the `.names` file, the ids
+   of the `.map` file as leaves, and its root unnamed (it is node 0 in the
+   `.names` file).
+"""
+
+# Built-in modules #
+import os, sys, io
+
+# Internal modules #
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, this_dir)
+from analyze_tre_files import newick_names
+
+# Constants #
+prefix = os.path.join(os.path.dirname(this_dir), 'example_files',
+                      '18S_curated_141222_GenBank_nds')
+
+# The trees with the names and leaves expected, in the order of the file #
+cases = [
+    ('((2,3)1);\n',         [('2', True), ('3', True), ('1', False),
+                             ('', False)]),
+    ('((2,3),(5)4)1;',      [('2', True), ('3', True), ('', False),
+                             ('5', True), ('4', False), ('1', False)]),
+    ('(((3)),4:0.5)1;',     [('3', True), ('', False), ('', False),
+                             ('4', True), ('1', False)]),
+    ('(2,(,4)3) ;',         [('2', True), ('', True), ('4', True),
+                             ('3', False), ('', False)]),
+    ('( 2 ,\n(4) 3 )1;\n',  [('2', True), ('4', True), ('3', False),
+                             ('1', False)]),
+]
+
+###############################################################################
+def check_cases():
+    for text, expected in cases:
+        for chunk_size in range(1, len(text) + 1):
+            found = list(newick_names(io.StringIO(text), chunk_size))
+            assert found == expected, (text, chunk_size, found)
+    print("Small trees: %i cases correct with every chunk size." % len(cases))
+
+def check_example():
+    with open(prefix + '.tre') as handle: found = list(newick_names(handle))
+    with open(prefix + '.names') as handle:
+        names = {line.split(',')[0] for line in handle}
+    with open(prefix + '.map') as handle:
+        leaves = {line.split(',')[0].strip() for line in handle}
+    assert [name for name, is_leaf in found if not name] == ['']
+    assert {name for name, is_leaf in found if name} == names - {'0'}
+    assert leaves <= {name for name, is_leaf in found if is_leaf}
+    print("Example `.tre` file: %i named nodes and the unnamed root." %
+          (len(names) - 1))
+
+###############################################################################
+if __name__ == '__main__':
+    check_cases()
+    check_example()
+    print("Success.")
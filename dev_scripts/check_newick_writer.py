@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A script to verify the streaming Newick writer of `TaxonomyTree`.
+
+1) The tree built from the example TSV must give back the example `.tre`
+   file byte for byte (that file was written without the root node name).
+
+2) If `ete4` is installed, the output must be identical to the one of
+   `ete4` with `parser=8` and `format_root_node=True`.
+
+3) A tree much deeper than the recursion limit must be writable.
+"""
+
+# Built-in modules #
+import os, sys, io
+
+# Internal modules #
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+from make_new_crest_db import AccessionTSV
+from taxonomy_tree import TaxonomyTree
+
+# Constants #
+prefix = os.path.join(os.path.dirname(this_dir), 'example_files',
+                      '18S_curated_141222_GenBank_nds')
+
+###############################################################################
+def check_example():
+    tree = AccessionTSV(prefix + '.tsv', snapshot=False).tree
+    with open(prefix + '.tre') as handle: expected = handle.read()
+    handle = io.StringIO()
+    tree.write_newick(handle, format_root_node=False, chunk_size=7)
+    assert handle.getvalue() == expected
+    print("Example `.tre` file: identical.")
+
+def check_ete():
+    try:
+        import ete4
+    except ImportError:
+        print("Comparison with ete4: skipped (not installed).")
+        return
+    tree = AccessionTSV(prefix + '.tsv', snapshot=False).tree
+    for format_root_node in (True, False):
+        expected = tree.to_ete().write(parser=8,
+                                       format_root_node=format_root_node)
+        assert tree.newick(format_root_node) == expected
+    print("Comparison with ete4 (version %s): identical." % ete4.__version__)
+
+def check_deep():
+    tree  = TaxonomyTree()
+    depth = sys.getrecursionlimit() * 10
+    tree.add_path(['Taxon %i' % i for i in range(depth)])
+    text = tree.newick()
+    assert text == '(' * depth + str(depth) + ''.join(
+        ')%i' % i for i in range(depth - 1, -1, -1)) + ';'
+    print("Tree with depth %i: written." % depth)
+
+###############################################################################
+if __name__ == '__main__':
+    check_example()
+    check_ete()
+    check_deep()
+    print("Success.")
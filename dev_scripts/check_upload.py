@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A script to verify the uploads of `upload.py` against an S3 stand-in.
+
+By default the stand-in is an in-memory object implementing the few
+client methods used, with the same ETag rules as S3. Pass `--endpoint-url`
+to use a real S3-compatible server instead (such as MinIO or the `moto`
+server running locally), with a bucket that already exists.
+
+1) A new archive must be sent in several concurrent parts, with an ETag
+   equal to the one predicted while compressing.
+
+2) Uploading it again must send nothing.
+
+3) A changed archive must be sent again.
+
+4) The object must be readable by anyone when asked for.
+"""
+
+# Built-in modules #
+import os, sys, random, hashlib, argparse, tempfile, threading
+
+# Internal modules #
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+from archive import make_archive
+from upload import upload_archive, make_client
+
+###############################################################################
+class MissingError(Exception):
+    def __init__(self, code):
+        self.response = {'Error': {'Code': code}}
+
+class InMemoryS3:
+    """Stands in for `boto3.client('s3')`, counting the parts received."""
+
+    def __init__(self):
+        self.objects, self.acls, self.uploads = {}, {}, {}
+        self.parts_received = 0
+        self.lock = threading.Lock()
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects: raise MissingError('404')
+        return {'ETag': '"%s"' % self.objects[Bucket, Key][1]}
+
+    def put_object(self, Bucket, Key, Body, ACL='private'):
+        self.objects[Bucket, Key] = (Body, hashlib.md5(Body).hexdigest())
+        self.acls[Bucket, Key] = ACL
+        return {'ETag': '"%s"' % self.objects[Bucket, Key][1]}
+
+    def put_object_acl(self, Bucket, Key, ACL):
+        self.acls[Bucket, Key] = ACL
+
+    def create_multipart_upload(self, Bucket, Key, ACL='private'):
+        upload_id = str(len(self.uploads))
+        self.uploads[upload_id] = ({}, ACL)
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self.lock:
+            self.uploads[UploadId][0][PartNumber] = Body
+            self.parts_received += 1
+        return {'ETag': '"%s"' % hashlib.md5(Body).hexdigest()}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                  MultipartUpload):
+        parts, acl = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        assert numbers == sorted(parts)
+        body = b''.join(parts[number] for number in numbers)
+        digests = b''.join(hashlib.md5(parts[number]).digest()
+                           for number in numbers)
+        etag = '%s-%i' % (hashlib.md5(digests).hexdigest(), len(numbers))
+        self.objects[Bucket, Key] = (body, etag)
+        self.acls[Bucket, Key] = acl
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+###############################################################################
+def make_database(directory, seed):
+    """A directory with some random content that doesn't compress well."""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    with open(os.path.join(directory, 'db.fasta'), 'wb') as handle:
+        handle.write(bytes(rng.getrandbits(8) for i in range(3 * 2**20)))
+
+def check(client, bucket, tmp_dir):
+    directory = os.path.join(tmp_dir, 'db')
+    archive   = os.path.join(tmp_dir, 'db.tar.gz')
+    # A new archive #
+    make_database(directory, seed=1)
+    hashes = make_archive(directory, archive, part_size=2**20, verbose=False)
+    assert len(hashes['parts']) > 1
+    assert upload_archive(archive, bucket, client=client, jobs=4,
+                          public=True, verbose=False)
+    etag = client.head_object(Bucket=bucket, Key='db.tar.gz')['ETag']
+    assert etag.strip('"') == hashes['etag']
+    print("New archive: sent in %i parts, ETag %s." %
+          (len(hashes['parts']), hashes['etag']))
+    # Again #
+    assert not upload_archive(archive, bucket, client=client, verbose=False)
+    print("Same archive: skipped.")
+    # Changed #
+    make_database(directory, seed=2)
+    make_archive(directory, archive, part_size=2**20, verbose=False)
+    assert upload_archive(archive, bucket, client=client, public=True,
+                          verbose=False)
+    print("Changed archive: sent again.")
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("--endpoint-url", default=None,
+                        help="The address of an S3-compatible server.")
+    parser.add_argument("--bucket", default='crest4-test',
+                        help="The bucket to use on that server.")
+    args = parser.parse_args()
+    # Pick the stand-in #
+    if args.endpoint_url: client = make_client(args.endpoint_url)
+    else:                 client = InMemoryS3()
+    # Run the checks #
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        check(client, args.bucket, tmp_dir)
+    # The access rights, only visible on the in-memory stand-in #
+    if isinstance(client, InMemoryS3):
+        assert client.acls[args.bucket, 'db.tar.gz'] == 'public-read'
+        assert client.parts_received == 2 * 4
+        print("Public access: granted.")
+    print("Success.")
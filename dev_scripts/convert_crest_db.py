@@ -9,7 +9,7 @@ format used in `crest4`.
 """
 
 # Imports #
-import os, inspect, sh
+import sys, inspect
 from autopaths import Path
 from fasta import FASTA
 
@@ -17,6 +17,14 @@ from fasta import FASTA
 this_file = Path((inspect.stack()[0])[1])
 this_dir  = this_file.directory
 
+# Internal modules #
+sys.path.insert(0, str(this_dir.directory))
+from binary_db import BinaryDatabase, compile_database
+from fasta_tools import FastaIndex, build_index, clean_fasta
+from external_sort import ExternalSorter
+from archive import make_archive
+from upload import upload_archive, make_client, make_public
+
 ###############################################################################
 class OldDatabase:
     """
@@ -63,76 +71,64 @@ class OldDatabase:
     def new_fasta(self):
         return FASTA(self.new_dir + self.short_name + '.fasta')
 
+    @property
+    def new_bin(self):
+        return self.new_dir + self.short_name + '.bin'
+
     @property
     def new_tar_gz(self):
         return self.new_dir.directory + self.short_name + '.tar.gz'
 
+    @property
+    def new_tar_zst(self):
+        return self.new_dir.directory + self.short_name + '.tar.zst'
+
     #------------------------------- Conversion ------------------------------#
-    def convert_map(self):
-        # How to convert the lines #
-        def process_map(lines):
-            # Initialize #
-            result = []
-            for line in lines:
-                # Parse the line #
-                num, name, minus, frac = line.strip().split('\t')
-                # Check if we are still in the names at the top of the file #
-                if frac != '-1': continue
-                # Remove commas #
-                if ',' in name:
-                    print("Removed a comma from '%s'" % name)
-                    name = name.replace(',', '')
-                # Add this entry #
-                result.append((num, name))
-            # Sort all entries #
-            result.sort(key=lambda elem: int(elem[0]))
-            # Return entries one by one #
-            for item in result:
-                yield ','.join(item) + '\n'
-        # Convert the old to new #
-        with open(self.orig_map, 'rt') as old, \
-             open(self.new_map, 'wt') as new:
-            new.writelines(process_map(old))
-        # Return #
-        return self.new_map
-
-    def convert_names(self):
-        # How to convert the lines #
-        def process_names(lines):
-            # Initialize #
-            result = []
-            for line in lines:
+    def convert_map_and_names(self, buffer_lines=10**6):
+        """
+        The old `.map` file contains the names at the top and the map at
+        the bottom. Both new files are written in a single pass over it,
+        sorted by node number. When the old file is already in order the
+        lines go straight to their destination, otherwise an external
+        merge sort keeps at most `buffer_lines` lines in memory.
+        """
+        by_num  = lambda line: int(line.split(',', 1)[0])
+        names   = ExternalSorter(by_num, buffer_lines)
+        mapping = ExternalSorter(by_num, buffer_lines)
+        in_map  = False
+        with open(self.orig_map, 'rt') as old:
+            for line in old:
                 # Parse the line #
                 num, name, minus, frac = line.strip().split('\t')
-                # Check if we have reached the maps at the bottom of the file #
-                if frac == '-1': break
+                # The names stop where the map at the bottom starts #
+                if frac == '-1': in_map = True
+                elif in_map: continue
                 # Remove commas #
                 if ',' in name:
                     print("Removed a comma from '%s'" % name)
                     name = name.replace(',', '')
                 # Add this entry #
-                result.append((num, name, frac))
-            # Sort all entries #
-            result.sort(key=lambda elem: int(elem[0]))
-            # Return entries one by one #
-            for item in result:
-                yield ','.join(item) + '\n'
-        # Convert the old to new #
-        with open(self.orig_map, 'rt') as old, \
-             open(self.new_names, 'wt') as new:
-            new.writelines(process_names(old))
+                if in_map: mapping.add(','.join((num, name)) + '\n')
+                else:      names.add(','.join((num, name, frac)) + '\n')
+        # Move or merge the results #
+        for sorter, path in ((mapping, self.new_map), (names, self.new_names)):
+            if not sorter.in_order:
+                print("Sorting %i lines of '%s'" % (sorter.count, path.name))
+            sorter.write(path)
         # Return #
-        return self.new_names
-
-    def convert_fasta(self):
-        # If the FASTA is not present, copy it from the original #
-        if not self.new_fasta:
-            print("\nDuplicated the FASTA file to '%s'" % self.new_fasta.with_tilda)
-            self.orig_fasta.copy(self.new_fasta)
-        # Remove duplicate entries #
-        self.new_fasta.remove_duplicates()
-        # Back transcribe #
-        self.new_fasta.convert_U_to_T()
+        return self.new_map, self.new_names
+
+    def convert_fasta(self, by_sequence=False, jobs=None):
+        """
+        Copy the original FASTA while removing duplicate entries and back
+        transcribing, all in one streaming pass over the file. Duplicates
+        are found by accession, or by sequence if `by_sequence` is true.
+        """
+        print("\nCleaning the FASTA file to '%s'" % self.new_fasta.with_tilda)
+        kept, removed = clean_fasta(self.orig_fasta.path, self.new_fasta.path,
+                                    by_sequence=by_sequence, jobs=jobs)
+        print("Kept %i sequences and removed %i duplicates." % (kept, removed))
+        return self.new_fasta
 
     def convert(self):
         # Message #
@@ -142,66 +138,93 @@ class OldDatabase:
         self.new_dir.create_if_not_exists()
         # Call methods #
         print("\nConverting file '%s'" %  self.orig_map.with_tilda)
-        self.convert_map()
-        self.convert_names()
+        self.convert_map_and_names()
         print("\nConverting file '%s'" %  self.orig_fasta.with_tilda)
         self.convert_fasta()
         # Copy the tree file #
         self.orig_tre.copy(self.new_tre)
 
+    def compile(self):
+        """Generate the binary version of the map, names and tree files."""
+        print("\nCompiling file '%s'" % self.new_bin.with_tilda)
+        return compile_database(self.new_dir + self.short_name, self.new_bin)
+
+    def index(self):
+        """Write the `.fai` offset index of the new FASTA file."""
+        print("\nIndexing file '%s'" % self.new_fasta.with_tilda)
+        return build_index(self.new_fasta.path)
+
+    @property
+    def sequences(self):
+        """Random access to the sequences of the new FASTA file."""
+        return FastaIndex(self.new_fasta.path)
+
     @property
     def db(self):
+        """The memory-mapped binary version of the new database."""
+        return BinaryDatabase(self.new_bin)
+
+    @property
+    def crest4_db(self):
+        """The new database as parsed from its text files by `crest4`."""
         from crest4 import databases
-        db = getattr(databases, self.short_name)
-        return db
+        return getattr(databases, self.short_name)
 
     def check(self):
         # Check that the parsing of the resulting files works #
         print("\nChecking file '%s'" % self.new_map)
+        text = self.crest4_db
         # Map file #
-        print("Number of entries in map file: ", len(self.db.acc_to_node))
+        print("Number of entries in map file: ", len(text.acc_to_node))
         # Names file #
-        print("Number of entries in names file: ", len(self.db.node_to_name))
+        print("Number of entries in names file: ", len(text.node_to_name))
         # Tree file #
-        print("Number of nodes in tree file: ", len(self.db.tree))
-
-    def compress(self):
+        print("Number of nodes in tree file: ", len(text.tree))
+        # Check that the binary file can be read back #
+        print("\nChecking file '%s'" % self.new_bin)
+        db = self.db
+        print("Number of entries in binary map: ", len(db.acc_to_node))
+        print("Number of nodes in binary file: ",
+              sum(1 for node in db.nodes()))
+        # Check that every accession points to an existing node #
+        assert all(db.parent[node] != -2 for node in db.acc_node)
+        # Check that both versions have the same accessions #
+        assert len(db.acc_to_node) == len(text.acc_to_node)
+
+    def compress(self, compression='gzip', jobs=None):
         """
-        Runs a command similar to:
+        Package the new directory into a tarball, equivalent to:
+
+             $ tar --exclude .DS_Store -cf - db | pigz -9 > db.tar.gz
 
-             $ tar --no-mac-metadata --exclude .DS_Store --options gzip:compression-level=9 -zcvf db.tar.gz db
+        The compression runs on all cores, inside this process and without
+        changing the working directory. Pass 'zstd' for a faster option.
         """
         # Prepare to compress the directory #
         print("Compressing the directory at '%s'" % self.new_dir.with_tilda)
-        # Make a copy of the environment #
-        env_vars = os.environ.copy()
-        env_vars['COPYFILE_DISABLE'] = '1'
-        # The arguments for the command line #
-        options = ["--no-mac-metadata", "--exclude", ".DS_Store",
-                   "--options", "gzip:compression-level=9", "-zcvf"]
-        # Change the working directory #
-        os.chdir(self.new_dir.directory)
-        # Compress the directory #
-        sh.tar(*options, self.new_tar_gz, self.short_name,
-               _env=env_vars, _fg=True)
-
-    def upload(self):
-        # Message #
+        output = self.new_tar_gz if compression == 'gzip' else self.new_tar_zst
+        return make_archive(self.new_dir, output, compression, jobs=jobs)
+
+    # The bucket where the archives are published #
+    bucket = 'crest4'
+
+    def upload(self, public=True, client=None):
+        """
+        Send the archive to S3 in concurrent parts, unless the object there
+        already has the same content. Pass a `client` to use another
+        S3-compatible server.
+        """
         print("Upload the file at '%s'" % self.new_tar_gz.with_tilda)
-        # Get the AWS S3 resource #
-        import boto3
-        s3 = boto3.resource('s3')
-        # Get the bucket #
-        bucket = s3.Bucket('crest4')
-        # Upload #
-        return bucket.upload_file(self.new_tar_gz, self.new_tar_gz.name)
-
-    def make_public(self):
+        return upload_archive(self.new_tar_gz, self.bucket, client=client,
+                              public=public)
+
+    def make_public(self, client=None):
         """
         A method to make the newly uploaded object in the AWS S3 bucket
-        readable by anyone. #TODO
+        readable by anyone.
         """
-        pass
+        return make_public(client or make_client(), self.bucket,
+                           self.new_tar_gz.name)
 
 ###############################################################################
 class SilvaMod128(OldDatabase):
@@ -238,6 +261,8 @@ silvamod138pr2 = SilvaMod138Pr2()
 # Example of how to use these objects #
 if __name__ == '__main__':
     silvamod138pr2.convert()
+    silvamod138pr2.compile()
+    silvamod138pr2.index()
     silvamod138pr2.check()
     silvamod138pr2.compress()
     silvamod138pr2.upload()
@@ -8,15 +8,18 @@ A script to download the old crest databases to disk.
 """
 
 # Imports #
-import inspect
+import sys, inspect
 import crest4
 from autopaths import Path
-from plumbing.scraping  import download_from_url
 
 # Get the current directory of this python script #
 this_file = Path((inspect.stack()[0])[1])
 this_dir  = this_file.directory
 
+# Internal modules #
+sys.path.insert(0, str(this_dir.directory))
+from download import RangeDownload
+
 ###############################################################################
 class OldDatabase:
     """
@@ -29,34 +32,28 @@ class OldDatabase:
         return this_dir + '../databases_orig/' + self.short_name + '/'
 
     def download_file(self, dest_dir, url):
-        # Download #
-        return download_from_url(url,
-                                 destination = dest_dir,
-                                 uncompress  = False,
-                                 user_agent  = "crest4 v" + crest4.__version__,
-                                 stream      = True,
-                                 progress    = True,
-                                 desc        = self.short_name)
+        """
+        The download is resumed if a previous one was interrupted, and
+        the file is uncompressed while it arrives by the methods below.
+        """
+        dest_dir.create_if_not_exists()
+        return RangeDownload(url, dest_dir + url.split('/')[-1],
+                             jobs       = 8,
+                             user_agent = "crest4 v" + crest4.__version__)
 
     def download_tar(self):
-        # Download #
-        tar = self.download_file(self.base_dir, self.tar_url)
-        # Uncompress #
-        tar.untargz_to(self.base_dir)
+        # Download and uncompress at the same time, removing the tarball #
+        self.download_file(self.base_dir, self.tar_url) \
+            .extract_tar(self.base_dir)
         # Move files out one step and remove useless subdirectory #
         contents = self.base_dir + self.dir_name + '/'
         contents.unnest()
-        # Remove tarball #
-        tar.remove()
 
     def download_fasta(self):
-        # Download #
+        # Download and uncompress at the same time, removing the archive #
         gz = self.download_file(self.base_dir, self.fasta_url)
-        # Uncompress #
-        if gz.endswith('.tar.gz'): gz.untargz_to()
-        else:                      gz.ungzip_to()
-        # Remove #
-        gz.remove()
+        if gz.path.endswith('.tar.gz'): gz.extract_tar(self.base_dir)
+        else:                           gz.gunzip_to(gz.path[:-len('.gz')])
 
     def download(self):
         self.download_tar()
@@ -10,10 +10,15 @@ a genus and a species name across the dataset.
 """
 
 # Built-in modules #
-import csv, argparse, gzip
+import os, sys, argparse
 from collections import defaultdict
 from functools import cached_property
 
+# Internal modules #
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from decompress import open_input
+from lineage import LineageParser
+
 ###############################################################################
 class AccessionTSV:
     """
@@ -35,17 +40,14 @@ class AccessionTSV:
         return defaultdict(lambda: {'ranks': set(), 'accessions': {}})
 
     def __iter__(self):
-        """Here we create a CSV reader object on the input file."""
-        # Check if file is gzipped by reading the magic number #
-        with open(self.tsv_path, 'rb') as f:
-            magic_number = f.read(2)
-        # Open with gzip if magic number matches  #
-        if magic_number.startswith(b'\x1f\x8b'):
-            file_obj = gzip.open(self.tsv_path, 'rt')
-        else:
-            file_obj = open(self.tsv_path)
-        # Return the reader #
-        return csv.reader(file_obj, delimiter='\t')
+        """
+        Yield `(acc, fixed_path)` tuples parsed by the `lineage` module. If
+        the file is compressed (gzip or zstd), it is uncompressed in the
+        background. Consecutive rows with the same path share the same list.
+        """
+        with open_input(self.tsv_path, 'rb') as handle:
+            for batch in LineageParser().read_batches(handle):
+                yield from batch
 
     def __call__(self):
         """
@@ -53,18 +55,11 @@ class AccessionTSV:
         Report all the names found at multiple distinct levels.
         """
         # Iterate over rows #
-        for row in self:
-            # Parse the row #
-            acc, path, full_name = row
-            # Split the path into a list #
-            path = path.split('/')
-            # Join numerical segments back with their preceding segments #
-            fixed_path = []
-            for i, segment in enumerate(path):
-                if segment.isdigit() and i > 0:
-                    fixed_path[-1] = fixed_path[-1] + '/' + segment
-                else:
-                    fixed_path.append(segment)
+        previous = None
+        for acc, fixed_path in self:
+            # The same path as the previous row adds nothing new #
+            if fixed_path is previous: continue
+            previous = fixed_path
             # Make a list of tuples with names and ranks associated #
             with_ranks = list(zip(fixed_path, range(1, len(fixed_path)+1)))
             # Record each name and its rank #
@@ -94,7 +89,7 @@ if __name__ == '__main__':
         "tsv_file",
         metavar = "TSV_FILE",
         type    = str,
-        help    = "Path to the input TSV file (can be gzipped)."
+        help    = "Path to the input TSV file (can be gzip or zstd compressed)."
     )
     # Parse arguments from command line #
     args = parser.parse_args()
@@ -4,42 +4,36 @@
 """
 Script to generate the databases that VSEARCH will use.
 This process takes a FASTA as input and indexes it, producing a file '.udb'
+
+Every database directory given is indexed, several at the same time within
+a budget of threads. See `udb_index.py` for how the FASTA is streamed to
+`vsearch` and how up to date indexes are skipped.
+
+You would call it like this:
+
+    $ ./dev_scripts/vsearch_generate.py ../databases/* --threads 16
 """
 
 # Built-in modules #
-import sys
+import os, sys, argparse
 
 # Internal modules #
-import crest4
-
-# First party modules #
-from seqsearch.search.vsearch import VSEARCHdb
-from plumbing.scraping import download_from_url
-from autopaths import Path
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(this_dir))
+from udb_index import index_all
 
 ###############################################################################
-# Where the original fasta file is located #
-base_url  = "https://services.cbu.uib.no/supplementary/crest/fasta/"
-file_name = "silvamod128.fasta.gz"
-
-# The destination #
-dest_dir = "~/repos/crest4/databases/silvamod128/"
-dest_file = Path(dest_dir + file_name)
-
-# Download #
-download_from_url(base_url + file_name,
-                  destination = dest_dir,
-                  uncompress  = True,
-                  user_agent  = "crest4 v" + crest4.__version__,
-                  stream      = True,
-                  progress    = True,
-                  desc        = 'silvamod128')
-
-# Remove the compressed file #
-dest_file.remove()
-
-# The resulting fasta #
-fasta = VSEARCHdb(dest_file.prefix_path)
-
-# Start the indexing #
-fasta.makedb(verbose=True, stdout=sys.stdout)
\ No newline at end of file
+if __name__ == '__main__':
+    # Make an argument parser #
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument("db_dirs", nargs='+',
+                        help="The database directories to index.")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="The total number of threads (defaults to all).")
+    parser.add_argument("--threads-per-db", type=int, default=4,
+                        help="The number of threads of every vsearch run.")
+    parser.add_argument("--force", action="store_true",
+                        help="Index again even if the index is up to date.")
+    args = parser.parse_args()
+    # Run it #
+    index_all(args.db_dirs, args.threads, args.threads_per_db, args.force)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Resumable downloads of large files over HTTP, in parallel byte ranges.
+
+The file is cut in segments of `segment_size` bytes that are requested
+with `Range` headers by several threads at once. The segments are then
+consumed in order, so that the data can be:
+
+    * appended to a `.part` file next to the destination, which always
+      holds the beginning of the file that was already received. If the
+      transfer breaks, the next attempt restarts where it stopped (as long
+      as the `ETag` of the remote file did not change).
+    * hashed as it streams in, to check it against an expected checksum
+      without reading the file again.
+    * decompressed or extracted on the fly, instead of writing the
+      archive first and reading it back.
+
+If the server does not support ranges, the file is streamed in one piece
+and cannot be resumed.
+
+Typically you would use it like this:
+
+    >>> download = RangeDownload(url, 'silvamod128.tar.gz', jobs=8,
+    ...                          checksum='sha256:0123...')
+    >>> download.extract_tar('databases_orig/silvamod128/')
+"""
+
+# Built-in modules #
+import os, io, json, time, zlib, hashlib, tarfile
+import http.client, urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Internal modules #
+from decompress import BackgroundReader
+
+###############################################################################
+class ChecksumError(Exception):
+    pass
+
+class RangeDownload:
+    """
+    Downloads `url` to `path`. The `checksum` is optional and formatted
+    as 'algorithm:hexdigest', for instance 'md5:d41d8cd98f...'.
+    """
+
+    def __init__(self, url, path, jobs=4, segment_size=2**23, checksum=None,
+                 user_agent=None, retries=5, timeout=60, verbose=True):
+        self.url          = url
+        self.path         = str(path)
+        self.jobs         = jobs
+        self.segment_size = segment_size
+        self.checksum     = checksum
+        self.user_agent   = user_agent
+        self.retries      = retries
+        self.timeout      = timeout
+        self.verbose      = verbose
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        return "<%s object of '%s'>" % (self.__class__.__name__, self.url)
+
+    @property
+    def part_path(self):
+        return self.path + '.part'
+
+    @property
+    def state_path(self):
+        return self.path + '.part.json'
+
+    # ------------------------------- HTTP ---------------------------------- #
+    def request(self, start=None, end=None, etag=None):
+        """Open the URL, optionally asking for the bytes `start` to `end`."""
+        headers = {}
+        if self.user_agent: headers['User-Agent'] = self.user_agent
+        if start is not None:
+            headers['Range'] = 'bytes=%i-%s' % (start, '' if end is None
+                                                else end - 1)
+            if etag: headers['If-Range'] = etag
+        request = urllib.request.Request(self.url, headers=headers)
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def probe(self):
+        """
+        Ask for the first byte to learn the size of the file, its version
+        (the `ETag` or else the modification date) and whether ranges are
+        supported. If they are not, the server is already sending the whole
+        file: the response is then returned open, to be read instead of
+        asking again. Otherwise None is returned in its place.
+        """
+        response = self.request(0, 1)
+        etag = response.headers.get('ETag') or \
+               response.headers.get('Last-Modified')
+        if response.status == 206:
+            with response: response.read()
+            total = response.headers['Content-Range'].rsplit('/', 1)[1]
+            return int(total), etag, True, None
+        length = response.headers.get('Content-Length')
+        return (int(length) if length else None), etag, False, response
+
+    def fetch(self, start, end, etag):
+        """
+        Get the bytes from `start` to `end`, trying again with an
+        increasing delay if the connection fails. This runs in a worker.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                with self.request(start, end, etag) as response:
+                    if response.status != 206:
+                        msg = "The remote file '%s' changed during download."
+                        raise Exception(msg % self.url)
+                    data = response.read()
+                if len(data) != end - start:
+                    raise IOError("Received %i bytes instead of %i." %
+                                  (len(data), end - start))
+                return data
+            except (OSError, http.client.HTTPException):
+                if attempt == self.retries: raise
+                time.sleep(min(2 ** attempt * 0.1, 10))
+
+    # ------------------------------ Resuming ------------------------------- #
+    def resume_offset(self, size, etag):
+        """
+        How many bytes of the `.part` file can be kept. Nothing is kept if
+        the remote file is not exactly the one we started to download.
+        """
+        if not os.path.exists(self.part_path): return 0
+        if not os.path.exists(self.state_path): return 0
+        with open(self.state_path) as handle: state = json.load(handle)
+        if state != {'url': self.url, 'size': size, 'etag': etag}: return 0
+        if etag is None: return 0
+        return min(os.path.getsize(self.part_path), size)
+
+    # ------------------------------ Streaming ------------------------------ #
+    def chunks(self):
+        """
+        Yield the content of the file in order, from the `.part` file for
+        what was already downloaded and then from the network. Everything
+        yielded is also appended to the `.part` file and hashed. When done,
+        the checksum is verified and the `.part` file renamed to `path`.
+        """
+        size, etag, ranges, response = self.probe()
+        offset = self.resume_offset(size, etag) if ranges else 0
+        if self.verbose and offset:
+            print("Resuming '%s' at %i of %i bytes." % (self.url, offset, size))
+        # The hash of the whole content #
+        algorithm, expected = (self.checksum.split(':', 1) if self.checksum
+                               else ('sha256', None))
+        digest = hashlib.new(algorithm)
+        # Keep track of what we are downloading #
+        with open(self.state_path, 'w') as handle:
+            json.dump({'url': self.url, 'size': size, 'etag': etag}, handle)
+        start = time.perf_counter()
+        with open(self.part_path, 'r+b' if offset else 'wb') as part:
+            # What was already there #
+            part.seek(0)
+            while part.tell() < offset:
+                data = part.read(min(self.segment_size, offset - part.tell()))
+                digest.update(data)
+                yield data
+            part.truncate(offset)
+            # The rest #
+            if ranges: remote = self.fetch_segments(offset, size, etag)
+            else:      remote = self.fetch_stream(response)
+            for data in remote:
+                part.write(data)
+                part.flush()
+                digest.update(data)
+                yield data
+            received = part.tell()
+        # Check the result #
+        if size is not None and received != size:
+            raise IOError("Received %i bytes instead of %i." % (received, size))
+        if expected and digest.hexdigest() != expected.lower():
+            os.remove(self.part_path)
+            os.remove(self.state_path)
+            msg = "The %s of '%s' is %s instead of %s."
+            raise ChecksumError(msg % (algorithm, self.url, digest.hexdigest(),
+                                       expected))
+        os.replace(self.part_path, self.path)
+        os.remove(self.state_path)
+        # Report #
+        if self.verbose:
+            elapsed = time.perf_counter() - start
+            print("Downloaded %.1f MiB in %.1f s (%.1f MiB/s)" %
+                  ((received - offset) / 1024**2, elapsed,
+                   (received - offset) / 1024**2 / max(elapsed, 1e-9)))
+
+    def fetch_segments(self, offset, size, etag):
+        """The segments from `offset` on, fetched `jobs` at a time."""
+        window = deque()
+        bounds = ((start, min(start + self.segment_size, size))
+                  for start in range(offset, size, self.segment_size))
+        with ThreadPoolExecutor(self.jobs) as pool:
+            for start, end in bounds:
+                window.append(pool.submit(self.fetch, start, end, etag))
+                if len(window) >= self.jobs * 2:
+                    yield window.popleft().result()
+            while window: yield window.popleft().result()
+
+    def fetch_stream(self, response=None):
+        """
+        The whole file in one request, for servers without ranges. The
+        `response` of that request can be given if it was already made.
+        """
+        with response or self.request() as response:
+            while True:
+                data = response.read(self.segment_size)
+                if not data: return
+                yield data
+
+    # ------------------------------ Outputs -------------------------------- #
+    def __call__(self):
+        """Download the file to `path` and return it."""
+        for data in self.chunks(): pass
+        return self.path
+
+    def open(self):
+        """A binary file-like object reading the content as it arrives."""
+        return io.BufferedReader(BackgroundReader(self.chunks()))
+
+    def extract_tar(self, directory, keep=False):
+        """
+        Extract a tarball (compressed or not) to `directory` while it is
+        being downloaded. The archive is removed afterwards unless `keep`.
+        """
+        with self.open() as handle:
+            with tarfile.open(fileobj=handle, mode='r|*') as tar:
+                tar.extractall(directory, filter='data')
+            # Read the padding after the end of the archive #
+            while handle.read(2**20): pass
+        if not keep: os.remove(self.path)
+        return directory
+
+    def gunzip_to(self, destination, keep=False):
+        """
+        Decompress a gzipped file to `destination` while it is being
+        downloaded. The compressed file is removed afterwards unless `keep`.
+        """
+        decompressor = zlib.decompressobj(31)
+        with open(destination, 'wb') as handle:
+            for data in self.chunks():
+                # Handle files with several gzip members #
+                while data:
+                    if decompressor.eof: decompressor = zlib.decompressobj(31)
+                    handle.write(decompressor.decompress(data))
+                    data = decompressor.unused_data
+        if not keep: os.remove(self.path)
+        return destination
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    import argparse
+    parser = argparse.ArgumentParser(description=
+        "Download a file in parallel byte ranges, resuming if interrupted.")
+    parser.add_argument("url", help="The address of the file.")
+    parser.add_argument("path", help="Where to save it.")
+    parser.add_argument("--jobs", type=int, default=4,
+                        help="The number of parallel connections.")
+    parser.add_argument("--checksum", default=None,
+                        help="The expected hash, as 'algorithm:hexdigest'.")
+    args = parser.parse_args()
+    # Run it #
+    print(RangeDownload(args.url, args.path, args.jobs,
+                        checksum=args.checksum)())
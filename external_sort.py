@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Sorting of text files that might not fit in memory.
+
+Lines are added one by one to an `ExternalSorter`. As long as they arrive
+in order, they are written straight to disk, so an input that is already
+sorted costs a single write and no sorting at all. Once a line arrives out
+of order, the following lines are gathered in a buffer of bounded size
+that is sorted and spilled to a temporary file (a "run") every time it
+fills up. The runs are then merged with `heapq.merge`, at most
+`max_fan_in` of them at a time. When there are more runs than that,
+consecutive groups of runs are first merged into longer runs, in as many
+passes as needed, so that the number of open files stays bounded.
+
+The sort is stable: lines with equal keys keep their input order.
+
+The buffer is limited either to a number of lines or, with `buffer_bytes`,
+to an approximate amount of memory. The latter counts the string objects
+and the keys made while sorting them, so that the memory used stays about
+the same whatever the length of the lines. The read buffers of the files
+being merged are also sized to fit in `buffer_bytes`.
+
+Typically you would use it like this:
+
+    >>> sorter = ExternalSorter(key=lambda line: int(line.split(',')[0]))
+    >>> for line in lines: sorter.add(line)
+    >>> sorter.write('sorted.csv')
+"""
+
+# Built-in modules #
+import os, sys, heapq, shutil, tempfile, contextlib
+
+###############################################################################
+def open_files_limit():
+    """The number of files this process can open, or None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY: return None
+    return soft
+
+#-----------------------------------------------------------------------------#
+class ExternalSorter:
+    """
+    Sorts lines ending with a newline by `key`, keeping at most
+    `buffer_lines` of them (or about `buffer_bytes` of memory) in memory
+    at any time. Either limit can be disabled by setting it to None.
+    """
+
+    # The largest number of runs merged at the same time, unless the limit
+    # of open files is too low for it (see `open_files_limit()`) #
+    max_fan_in = 64
+
+    def __init__(self, key, buffer_lines=10**6, tmp_dir=None,
+                 buffer_bytes=None):
+        self.key          = key
+        self.buffer_lines = buffer_lines
+        self.buffer_bytes = buffer_bytes
+        self.tmp_dir      = tempfile.mkdtemp(prefix='sort_', dir=tmp_dir)
+        self.run_count    = 0
+        # Leave files for the caller and for other sorters merging at once #
+        limit = open_files_limit()
+        if limit is not None:
+            self.max_fan_in = max(2, min(self.max_fan_in, limit // 4))
+        # The first run is written while the input is in order #
+        self.runs     = []
+        self.spool    = open(self.new_run(), 'wt')
+        self.in_order = True
+        self.last_key = None
+        # Afterwards lines are buffered #
+        self.buffer = []
+        self.size   = 0
+        self.count  = 0
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        return "<%s object with %i lines in %i runs>" % \
+               (self.__class__.__name__, self.count, len(self.runs))
+
+    def new_run(self):
+        """The path to a new temporary file, added to the list of runs."""
+        path = os.path.join(self.tmp_dir, 'run_%i.txt' % self.run_count)
+        self.run_count += 1
+        self.runs.append(path)
+        return path
+
+    # ------------------------------ Adding --------------------------------- #
+    def add(self, line):
+        self.count += 1
+        # Still in order #
+        if self.in_order:
+            key = self.key(line)
+            if self.last_key is None or not key < self.last_key:
+                self.spool.write(line)
+                self.last_key = key
+                return
+            # The first line out of order ends the first run #
+            self.spool.close()
+            self.in_order = False
+        # Buffer and spill #
+        self.buffer.append(line)
+        # Every line costs its string, its key and two list slots #
+        self.size += 2 * sys.getsizeof(line) + 16
+        if self.buffer_lines is not None and \
+           len(self.buffer) >= self.buffer_lines: self.spill()
+        elif self.buffer_bytes is not None and \
+           self.size >= self.buffer_bytes: self.spill()
+
+    def add_all(self, lines):
+        for line in lines: self.add(line)
+        return self
+
+    def spill(self):
+        """Sort the buffer and write it as a new run."""
+        if not self.buffer: return
+        self.buffer.sort(key=self.key)
+        with open(self.new_run(), 'wt') as handle:
+            handle.writelines(self.buffer)
+        self.buffer = []
+        self.size   = 0
+
+    # ----------------------------- Reading --------------------------------- #
+    def finish(self):
+        """
+        Flush everything to disk and merge runs until there are at most
+        `max_fan_in` of them. No lines can be added afterwards.
+        """
+        self.spool.close()
+        self.spill()
+        while len(self.runs) > self.max_fan_in:
+            runs, self.runs = self.runs, []
+            for i in range(0, len(runs), self.max_fan_in):
+                group = runs[i:i + self.max_fan_in]
+                if len(group) == 1:
+                    self.runs.append(group[0])
+                    continue
+                # Groups are consecutive, so the merge stays stable #
+                with open(self.new_run(), 'wt') as handle:
+                    handle.writelines(self.merge(group))
+                for path in group: os.remove(path)
+
+    @property
+    def read_buffer(self):
+        """The buffer size of every file read while merging."""
+        if self.buffer_bytes is None: return 2**16
+        share = self.buffer_bytes // (2 * self.max_fan_in)
+        return max(2**12, min(2**16, share))
+
+    def merge(self, runs):
+        """Iterate over the lines of the sorted `runs` in sorted order."""
+        with contextlib.ExitStack() as stack:
+            handles = [stack.enter_context(open(path, 'rt',
+                                                buffering=self.read_buffer))
+                       for path in runs]
+            yield from heapq.merge(*handles, key=self.key)
+
+    def __iter__(self):
+        """Iterate over all the lines in sorted order."""
+        self.finish()
+        yield from self.merge(self.runs)
+
+    def write(self, path):
+        """
+        Write all the lines in sorted order to `path`. If they were
+        already sorted, the first run is simply moved there.
+        """
+        self.finish()
+        if len(self.runs) == 1:
+            shutil.move(self.runs[0], path)
+        else:
+            with open(path, 'wt') as handle: handle.writelines(self)
+        self.cleanup()
+        return path
+
+    def cleanup(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
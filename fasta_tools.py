@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Fast access to the FASTA files of crest4 databases.
+
+Parsing a reference FASTA with `Bio.SeqIO` creates a `SeqRecord` object
+with its full sequence for every entry, even when only the identifiers are
+needed. Here the file is memory mapped instead, and the header lines are
+found with a regular expression running over the whole map in C. Since the
+pattern starts with a literal newline and `>`, the search skips quickly
+over the sequences. No object is created per record except the identifier
+itself.
+
+Typically you would use it like this:
+
+    >>> ids = fasta_ids('silvamod138pr2.fasta')
+    >>> records = scan_fasta('silvamod138pr2.fasta')
+    >>> records.ids[0], records.offsets[0], records.lengths[0]
+
+To fetch sequences by accession, a `.fai` index compatible with `samtools`
+is written next to the FASTA and used through the `FastaIndex` class:
+
+    >>> fasta = FastaIndex('silvamod138pr2.fasta')
+    >>> fasta['OQ071217']
+"""
+
+# Built-in modules #
+import os, re, mmap, hashlib
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+# Constants #
+first_header = re.compile(rb'>(\S*)')
+next_header  = re.compile(rb'\n>(\S*)')
+u_to_t       = bytes.maketrans(b'Uu', b'Tt')
+
+###############################################################################
+@contextmanager
+def map_file(path):
+    """Memory map a file read-only. Empty files give an empty `bytes`."""
+    with open(path, 'rb') as handle:
+        try:
+            data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield b''
+            return
+        try:
+            yield data
+        finally:
+            data.close()
+
+def find_headers(data):
+    """Iterate over the match of every header line in `data`."""
+    first = first_header.match(data)
+    if first: yield first
+    yield from next_header.finditer(data)
+
+def fasta_ids(path):
+    """The list of all identifiers in a FASTA file, in order."""
+    with map_file(path) as data:
+        first = first_header.match(data)
+        ids   = [first.group(1)] if first else []
+        ids  += next_header.findall(data)
+        return [raw.decode() for raw in ids]
+
+def iter_fasta_ids(path):
+    """The same as `fasta_ids` without holding the whole list in memory."""
+    with map_file(path) as data:
+        for match in find_headers(data):
+            yield match.group(1).decode()
+
+#-----------------------------------------------------------------------------#
+class FastaRecords:
+    """
+    The result of scanning a FASTA file, stored as parallel columns:
+
+    * `ids`     - the identifier of every record.
+    * `offsets` - int64, the byte offset of the `>` of every record.
+    * `lengths` - int64, the number of residues of every record (only
+                  filled when asked for since it requires reading the
+                  sequences, otherwise empty).
+    """
+
+    def __init__(self, ids, offsets, lengths):
+        self.ids     = ids
+        self.offsets = offsets
+        self.lengths = lengths
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        return "<%s object with %i records>" % (self.__class__.__name__,
+                                                len(self))
+
+    def __len__(self):
+        return len(self.ids)
+
+def scan_fasta(path, lengths=False):
+    """
+    Find every record of a FASTA file and return a `FastaRecords`. The
+    residues are counted by subtracting the line breaks from the size of
+    the sequence block, with one C level count per record.
+    """
+    ids, offsets, sizes = [], array('q'), array('q')
+    with map_file(path) as data:
+        for match in find_headers(data):
+            ids.append(match.group(1).decode())
+            offsets.append(match.start(1) - 1)
+        if lengths:
+            ends = offsets[1:] + array('q', [len(data)])
+            for start, end in zip(offsets, ends):
+                start = data.find(b'\n', start, end) + 1 or end
+                block = data[start:end]
+                sizes.append(len(block) - block.count(b'\n')
+                                        - block.count(b'\r'))
+    return FastaRecords(ids, offsets, sizes)
+
+###############################################################################
+def index_records(data):
+    """
+    Yield the `.fai` entry of every record in the mapped FASTA `data`:
+    name, number of residues, offset of the first residue, residues per
+    line and bytes per line. As with `samtools faidx`, all the lines of a
+    record except the last one must have the same width.
+    """
+    matches = list(find_headers(data))
+    ends = [match.start(1) - 1 for match in matches[1:]] + [len(data)]
+    for match, end in zip(matches, ends):
+        name  = match.group(1).decode()
+        start = data.find(b'\n', match.end(), end) + 1 or end
+        block = data[start:end]
+        length = len(block) - block.count(b'\n') - block.count(b'\r')
+        # The width of the first line sets the geometry #
+        first = block.find(b'\n')
+        if first < 0: line_bytes = line_bases = len(block.rstrip(b'\r'))
+        else:         line_bytes, line_bases = first + 1, \
+                                               len(block[:first].rstrip(b'\r'))
+        # Check that the other lines follow it #
+        if length and len(block.rstrip(b'\r\n')) != \
+           span_of(length, line_bases, line_bytes):
+            msg = "The record '%s' has lines of different widths."
+            raise ValueError(msg % name)
+        yield name, length, start, line_bases, line_bytes
+
+def span_of(length, line_bases, line_bytes):
+    """The bytes used by `length` residues, without the last line break."""
+    if not length: return 0
+    return length + (length - 1) // line_bases * (line_bytes - line_bases)
+
+def build_index(fasta_path, index_path=None):
+    """
+    Write a `.fai` index next to the FASTA file, in the same format as
+    `samtools faidx` so that other tools can use it too.
+    Returns the path to the file written.
+    """
+    if index_path is None: index_path = fasta_path + '.fai'
+    tmp_path = index_path + '.tmp'
+    with map_file(fasta_path) as data, open(tmp_path, 'wt') as handle:
+        for entry in index_records(data):
+            handle.write('%s\t%i\t%i\t%i\t%i\n' % entry)
+    os.replace(tmp_path, index_path)
+    return index_path
+
+#-----------------------------------------------------------------------------#
+class FastaIndex:
+    """
+    Random access to the sequences of a FASTA file through its `.fai`
+    index. The index is built first if it's missing or older than the
+    FASTA. Fetching a record is a dictionary lookup followed by a slice of
+    the memory map, whatever the size of the file.
+
+        >>> fasta = FastaIndex('silvamod138pr2.fasta')
+        >>> fasta['OQ071217']
+        >>> fasta.write('clade.fasta', fasta.clade(db, 12))
+    """
+
+    def __init__(self, fasta_path, index_path=None):
+        self.fasta_path = fasta_path
+        self.index_path = index_path or fasta_path + '.fai'
+        # Build the index if needed #
+        if not os.path.exists(self.index_path) or \
+           os.path.getmtime(self.index_path) < os.path.getmtime(fasta_path):
+            build_index(fasta_path, self.index_path)
+        # Load it, keeping the first record when names are repeated #
+        self.entries = {}
+        with open(self.index_path, 'rt') as handle:
+            for line in handle:
+                name, *numbers = line.rstrip('\n').split('\t')
+                if name not in self.entries:
+                    self.entries[name] = tuple(map(int, numbers[:4]))
+        # Map the FASTA #
+        with open(fasta_path, 'rb') as handle:
+            self.mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        return "<%s object on '%s' with %i records>" % \
+               (self.__class__.__name__, self.fasta_path, len(self))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __getitem__(self, name):
+        """The sequence of the record called `name` as a string."""
+        length, offset, line_bases, line_bytes = self.entries[name]
+        end = offset + span_of(length, line_bases, line_bytes)
+        return self.mmap[offset:end].translate(None, b'\r\n').decode()
+
+    def fetch(self, names):
+        """
+        Yield `(name, sequence)` for every name requested. Names that are
+        not in the FASTA raise a `KeyError`.
+        """
+        for name in names: yield name, self[name]
+
+    def clade(self, db, node):
+        """
+        The accessions of all the leaves under `node`, where `db` is the
+        `BinaryDatabase` of the crest4 database this FASTA belongs to.
+        """
+        return db.clade_accessions(node)
+
+    def write(self, path, names, width=None):
+        """
+        Write the records called `names` to a new FASTA file, wrapping the
+        sequences at `width` characters if given.
+        """
+        with open(path, 'wt') as handle:
+            for name, seq in self.fetch(names):
+                if width:
+                    seq = '\n'.join(seq[i:i + width]
+                                     for i in range(0, len(seq), width))
+                handle.write('>%s\n%s\n' % (name, seq))
+        return path
+
+    def close(self):
+        self.mmap.close()
+
+###############################################################################
+def fasta_chunks(handle, chunk_size=2**22):
+    """
+    Read a FASTA file in blocks of about `chunk_size` bytes that always
+    contain whole records, each block starting with a `>`. Anything
+    before the first header is skipped.
+    """
+    rest = b''
+    while True:
+        chunk = handle.read(chunk_size)
+        data  = rest + chunk
+        if not rest: data = data[data.find(b'>'):] if b'>' in data else b''
+        cut = data.rfind(b'\n>') + 1 if chunk else len(data)
+        if cut: yield data[:cut]
+        rest = data[cut:]
+        if not chunk: return
+
+def clean_chunk(chunk, by_sequence=False):
+    """
+    Back-transcribe the sequences of a block of records and compute the
+    key used to find duplicates (the accession, or a hash of the sequence).
+    Returns the new block, the keys and where every record starts in it.
+    This runs in the worker processes.
+    """
+    pieces, keys, starts, position = [], [], array('q'), 0
+    matches = list(find_headers(chunk))
+    ends = [match.start(1) - 1 for match in matches[1:]] + [len(chunk)]
+    for match, end in zip(matches, ends):
+        body = chunk.find(b'\n', match.end(), end) + 1 or end
+        seq  = chunk[body:end].translate(u_to_t)
+        record = chunk[match.start(1) - 1:body] + seq
+        if not record.endswith(b'\n'): record += b'\n'
+        if by_sequence:
+            residues = seq.translate(None, b'\r\n').upper()
+            keys.append(hashlib.blake2b(residues, digest_size=16).digest())
+        else:
+            keys.append(match.group(1))
+        starts.append(position)
+        pieces.append(record)
+        position += len(record)
+    return b''.join(pieces), keys, starts
+
+def clean_fasta(source, destination, by_sequence=False, jobs=None,
+                chunk_size=2**22):
+    """
+    Write a copy of the FASTA file `source` to `destination` in one
+    streaming pass, removing duplicates and converting U to T.
+
+    * Duplicates are records whose accession was already seen, or whose
+      sequence was already seen if `by_sequence` is true. The first one
+      is kept.
+    * The blocks of records are processed on `jobs` worker processes
+      (defaults to all cores) but written in their original order.
+
+    Returns the number of records kept and the number removed.
+    """
+    # The pool, with only a bounded number of blocks in flight #
+    jobs = jobs or os.cpu_count()
+    pool = ProcessPoolExecutor(jobs) if jobs > 1 else None
+    submit = pool.submit if pool else \
+             lambda function, *args: FinishedFuture(function(*args))
+    # Keep the first occurrence of every key #
+    seen, kept, removed = set(), 0, 0
+    def write(handle, block, keys, starts):
+        nonlocal kept, removed
+        fresh = [key not in seen and not seen.add(key) for key in keys]
+        kept += sum(fresh)
+        removed += len(keys) - sum(fresh)
+        # The common case, the whole block is new #
+        if all(fresh): return handle.write(block)
+        # Otherwise only some records are written #
+        ends = starts[1:] + array('q', [len(block)])
+        for is_new, start, end in zip(fresh, starts, ends):
+            if is_new: handle.write(block[start:end])
+    # Stream through the file #
+    tmp_path = destination + '.tmp'
+    try:
+        with open(source, 'rb') as old, open(tmp_path, 'wb') as new:
+            window = deque()
+            for chunk in fasta_chunks(old, chunk_size):
+                window.append(submit(clean_chunk, chunk, by_sequence))
+                if len(window) >= jobs * 2:
+                    write(new, *window.popleft().result())
+            while window: write(new, *window.popleft().result())
+        os.replace(tmp_path, destination)
+    finally:
+        if pool: pool.shutdown(cancel_futures=True)
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+    return kept, removed
+
+class FinishedFuture:
+    """Looks like a `Future` when a block is processed without a pool."""
+    def __init__(self, value): self.value = value
+    def result(self): return self.value
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    import argparse
+    parser = argparse.ArgumentParser(description=
+        "Print the identifiers found in a FASTA file.")
+    parser.add_argument("fasta", help="The path to the FASTA file.")
+    parser.add_argument("--lengths", action="store_true",
+                        help="Also print the offset and length of records.")
+    parser.add_argument("--index", action="store_true",
+                        help="Write the `.fai` index instead.")
+    args = parser.parse_args()
+    # Run it #
+    if args.index:
+        print(build_index(args.fasta))
+    elif args.lengths:
+        records = scan_fasta(args.fasta, lengths=True)
+        for row in zip(records.ids, records.offsets, records.lengths):
+            print("%s\t%i\t%i" % row)
+    else:
+        for acc in fasta_ids(args.fasta): print(acc)
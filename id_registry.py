@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A persistent registry of node numbers, stored with a crest4 database.
+
+When a tree is built from scratch, its nodes are numbered in the order in
+which their paths first appear in the input. Reordering the input, or
+adding a single taxon early in it, then changes most of the numbers, and
+everything made from the previous numbers has to be redone.
+
+The registry remembers the number given to every taxonomic path. A path is
+identified by a 64-bit hash computed from the hash of its parent and its
+own name, so that the hash of a node is found in constant time once its
+parent's is known. The registry file is simply the array of those hashes
+indexed by node number, after a small header:
+
+    * 8 bytes  - the magic string `CRESTIDS`.
+    * 4 bytes  - the version of the format, as a little-endian uint32.
+    * 8 bytes  - the number of node numbers, as a little-endian uint64.
+    * the hashes as little-endian uint64, zero for numbers not in use.
+
+Numbers are never given to another path, even after their path disappears
+from the taxonomy. New paths get numbers after the largest one in use.
+
+Typically you would use it like this:
+
+    >>> registry = IdRegistry('silvamod138pr2.ids')
+    >>> path_hash = registry.child_hash(registry.root_hash, 'Main genome')
+    >>> node = registry.get(path_hash)
+"""
+
+# Built-in modules #
+import os, sys, struct, hashlib
+from array import array
+
+# Constants #
+REGISTRY_MAGIC   = b'CRESTIDS'
+REGISTRY_VERSION = 1
+HEADER = struct.Struct('<8sIQ')
+
+###############################################################################
+class IdRegistry:
+    """
+    Links the hash of every taxonomic path to its node number. The file at
+    `path` is loaded if it exists, otherwise the registry starts empty.
+    """
+
+    # The root is always number zero and its path is empty #
+    root_hash = 1
+
+    def __init__(self, path):
+        self.path    = str(path)
+        self.hashes  = array('Q', [self.root_hash])
+        self.changed = False
+        if os.path.exists(self.path): self.load()
+        self.numbers = {h: num for num, h in enumerate(self.hashes) if h}
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        return "<%s object with %i numbers on '%s'>" % \
+               (self.__class__.__name__, len(self.numbers), self.path)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @staticmethod
+    def child_hash(parent_hash, name):
+        """The hash of the path made of a parent path and one more name."""
+        digest = hashlib.blake2b(parent_hash.to_bytes(8, 'little') +
+                                 name.encode(), digest_size=8).digest()
+        # Zero marks the numbers that are not in use #
+        return int.from_bytes(digest, 'little') or 1
+
+    # ------------------------------ Lookups -------------------------------- #
+    def get(self, path_hash):
+        """The number of the path with this hash, or None if it's new."""
+        return self.numbers.get(path_hash)
+
+    def add(self, path_hash):
+        """Give the next free number to a new path and return it."""
+        num = len(self.hashes)
+        self.hashes.append(path_hash)
+        self.numbers[path_hash] = num
+        self.changed = True
+        return num
+
+    def tree_hashes(self, tree):
+        """
+        The hash of every node of a `TaxonomyTree`, in a dictionary keyed
+        by node number.
+        """
+        result = {0: self.root_hash}
+        for node in tree.preorder():
+            if node == 0: continue
+            result[node] = self.child_hash(result[tree.parent[node]],
+                                           tree.name(node))
+        return result
+
+    @classmethod
+    def from_tree(cls, path, tree):
+        """
+        Make a registry with the numbers that the nodes of `tree` already
+        have, for instance to start using one with an existing database.
+        """
+        registry = cls(path)
+        if len(registry) > 1:
+            raise Exception("The registry '%s' is not empty." % registry.path)
+        hashes = registry.tree_hashes(tree)
+        registry.hashes = array('Q', [0]) * len(tree)
+        for node, path_hash in hashes.items():
+            registry.hashes[node] = path_hash
+        registry.numbers = {h: num for num, h in hashes.items()}
+        registry.changed = True
+        return registry
+
+    # ------------------------------ Storage -------------------------------- #
+    def load(self):
+        with open(self.path, 'rb') as handle:
+            magic, version, count = HEADER.unpack(handle.read(HEADER.size))
+            if magic != REGISTRY_MAGIC:
+                raise Exception("The file '%s' is not a registry." % self.path)
+            if version != REGISTRY_VERSION:
+                msg = "The registry '%s' has version %i instead of %i."
+                raise Exception(msg % (self.path, version, REGISTRY_VERSION))
+            self.hashes = array('Q')
+            self.hashes.fromfile(handle, count)
+        if sys.byteorder != 'little': self.hashes.byteswap()
+
+    def save(self):
+        """Write the registry if it changed, replacing the file at once."""
+        if not self.changed and os.path.exists(self.path): return self.path
+        hashes = array('Q', self.hashes)
+        if sys.byteorder != 'little': hashes.byteswap()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as handle:
+            handle.write(HEADER.pack(REGISTRY_MAGIC, REGISTRY_VERSION,
+                                     len(hashes)))
+            hashes.tofile(handle)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+        return self.path
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Parsing of the taxonomic paths found in the TSV files exported from ARB.
+
+Every row of such a file has three columns: the accession, the path in the
+tree of life and the name of the taxon. The path uses "/" as a separator,
+but the same character also appears within taxon names, followed by a
+number, as in these two paths:
+
+    .../Peptostreptococcaceae/Peptoclostridium/4/[Clostridium] hiranonis
+    .../Bacillaceae/Bacillus/Bacillus sp. Con a/4
+
+So, segments that are just numbers are kept inside the name before them.
+Rather than checking every segment in a Python loop, paths are split by a
+precompiled regular expression matching every "/" except those followed by
+a number-only segment. Most paths don't have any such segment, which is
+checked with another regular expression, and are simply split on "/".
+
+Consecutive rows very often have the same path (several accessions of the
+same species). A `LineageParser` remembers the last path it split and then
+returns the same list again without splitting anything. These lists are
+shared between rows and should not be modified.
+
+The batch interface parses whole blocks of lines at once. The checks for
+quotes, carriage returns, numbers and the number of columns are made once
+per block. Blocks that pass them are split once on tabs and newlines, the
+columns are taken with slices, and only the paths that differ from the row
+before are split, so that no Python code runs for each row.
+Typically you would use it like this:
+
+    >>> with open('export.tsv', 'rb') as handle:
+    >>>     for batch in LineageParser().read_batches(handle):
+    >>>         for acc, fixed_path in batch: print(acc, fixed_path[-1])
+"""
+
+# Built-in modules #
+import re, csv
+from operator import ne
+from itertools import repeat, compress, accumulate
+
+# Splits a path on every "/" except those followed by a number-only segment #
+split_numbers = re.compile(r'/(?!\d+(?:/|$))').split
+
+# Finds number-only segments in a path or in a block of TSV lines #
+find_number = re.compile(r'/\d+(?:[/\t\n]|$)').search
+
+# All the bytes except tabs and newlines, to check the columns of a block #
+not_separators = bytes(sorted(set(range(256)) - set(b'\t\n')))
+
+###############################################################################
+def split_path(path):
+    """Split a path into the list of its taxon names, keeping numbers."""
+    if find_number(path): return split_numbers(path)
+    return path.split('/')
+
+#-----------------------------------------------------------------------------#
+class LineageParser:
+    """
+    Parses the rows of a TSV file into `(acc, fixed_path)` tuples,
+    reusing the list of the previous row when the path is the same.
+    The rows are counted for error messages.
+    """
+
+    def __init__(self):
+        self.last_path  = None
+        self.last_split = None
+        self.row_num    = 0
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        return "<%s object at row %i>" % (self.__class__.__name__,
+                                          self.row_num)
+
+    def split(self, path):
+        """Split one path, unless it is the same as the previous one."""
+        if path != self.last_path:
+            self.last_path, self.last_split = path, split_path(path)
+        return self.last_split
+
+    # ------------------------------ Batches -------------------------------- #
+    def parse_block(self, block):
+        """
+        Parse a block of complete lines in bytes, each ending with a
+        newline. When the block contains neither quotes nor carriage
+        returns, and only lines with two tabs, it is parsed by
+        `parse_simple()`. Otherwise it is parsed by `parse_lines()`.
+        """
+        text = block.decode()
+        if b'"' not in block and b'\r' not in block:
+            # Removing everything but the separators must leave "\t\t\n"s #
+            separators = block.translate(None, not_separators)
+            if separators == b'\t\t\n' * (len(separators) // 3):
+                batch = self.parse_simple(text)
+                if batch is not None: return batch
+        lines = text.split('\n')
+        lines.pop()
+        return self.parse_lines(lines)
+
+    def parse_simple(self, text):
+        """
+        Parse a block of lines already checked to all have three columns.
+        Returns None if an accession is missing.
+        """
+        fields = text.replace('\n', '\t').split('\t')
+        accs, paths = fields[0:-1:3], fields[1:-1:3]
+        if not paths: return []
+        if '' in accs: return None
+        # Only split the paths that differ from the row before. The one of
+        # the row before the block is number zero #
+        changed = list(map(ne, paths, [self.last_path] + paths[:-1]))
+        changes = list(compress(paths, changed))
+        # Look for numbers in all of them joined together #
+        if find_number('/'.join(changes)) is None:
+            splits = list(map(str.split, changes, repeat('/')))
+        else:
+            splits = list(map(split_numbers, changes))
+        splits.insert(0, self.last_split)
+        # Every row takes the split of the last change before it #
+        self.last_path  = paths[-1]
+        self.last_split = splits[-1]
+        self.row_num   += len(paths)
+        return list(zip(accs, map(splits.__getitem__, accumulate(changed))))
+
+    def parse_lines(self, lines):
+        """
+        Parse TSV lines one by one, with the real CSV parser if they have
+        quotes, and report the rows that are not valid.
+        """
+        batch = []
+        for line in lines:
+            self.row_num += 1
+            if line.endswith('\r'): line = line[:-1]
+            # Quoted fields need the real CSV parser #
+            if '"' in line:
+                fields = next(csv.reader([line], delimiter='\t'))
+            else:
+                fields = line.split('\t')
+            # Check that the row has three columns #
+            if len(fields) != 3:
+                msg = "The row %i does not contain three columns:\n%s"
+                raise Exception(msg % (self.row_num, fields))
+            # Parse the row (the full_name is ignored) #
+            acc, path, full_name = fields
+            # Check we have an accession #
+            if not acc:
+                msg = "This row does not contain an accession:\n%s"
+                raise Exception(msg % fields)
+            # Split the path into a list, keeping numbers in names #
+            batch.append((acc, self.split(path)))
+        return batch
+
+    def read_batches(self, handle, block_size=2**16, size=None):
+        """
+        Yield lists of `(acc, fixed_path)` tuples, one list per block of
+        about `block_size` bytes read from the binary file `handle`. If
+        `size` is given, only that many bytes are read.
+        """
+        rest = b''
+        while True:
+            if size is None: block = handle.read(block_size)
+            else:
+                block = handle.read(min(block_size, size))
+                size -= len(block)
+            # The last line might not end with a newline #
+            if not block:
+                if not rest: break
+                block, rest = rest + b'\n', b''
+            # Only keep complete lines in the block #
+            else:
+                block = rest + block
+                cut   = block.rfind(b'\n') + 1
+                block, rest = block[:cut], block[cut:]
+                if not block: continue
+            # Parse them #
+            yield self.parse_block(block)
@@ -14,6 +14,12 @@ This script generates the following output:
 1) A `.map` file
 2) A `.names` file.
 3) A `.tre` file
+4) A `.bin` file, which is a compiled binary version of the three others
+   that can be memory-mapped (see the `binary_db` module).
+
+It also saves the parsed tree to a binary `.snapshot` file, so that running
+the script again on the same input skips the parsing (use `--no-snapshot`
+to disable this).
 
 The TSV file to parse as input contains three columns:
 
@@ -88,10 +94,41 @@ Typically, you would call this script like this:
 
     $ crest4_utils/make_new_crest_db.py \
       crest4_utils/example_files/18S_curated_141222_GenBank_nds.tsv
+
+With `--jobs`, the tree is built by several processes, each parsing its
+own part of the TSV file (which must not be compressed). The node numbers
+are the same as when using a single process:
+
+    $ crest4_utils/make_new_crest_db.py export.tsv --jobs 8
+
+If the database of a previous version of the TSV file already exists, you
+can apply only the accessions that were added, removed or moved since. The
+existing node numbers are then kept and new nodes are numbered after them:
+
+    $ crest4_utils/make_new_crest_db.py new_export.tsv --previous old_export.tsv
+
+Alternatively, the number of every taxonomic path can be kept in a registry
+stored with the database, so that reordered or updated inputs keep the same
+numbers. Outputs whose contents did not change are then not rewritten:
+
+    $ crest4_utils/make_new_crest_db.py export.tsv --registry
+
+If the TSV file is too large for its tree to fit in memory, the tree can be
+built on disk within a memory budget given in MiB instead. The node numbers
+are the same, but the `.bin` file is not written:
+
+    $ crest4_utils/make_new_crest_db.py huge_export.tsv --memory 2048
 """
 
 # Built-in modules #
-import os, functools, csv, gzip
+import os, mmap, time, shutil, filecmp, tempfile, contextlib
+import functools, csv
+
+# Internal modules #
+from taxonomy_tree import TaxonomyTree, PathCache
+from decompress import open_input, is_compressed
+from external_sort import ExternalSorter
+from lineage import LineageParser
 
 ###############################################################################
 class AccessionTSV:
@@ -101,106 +138,267 @@ class AccessionTSV:
     """
 
     # ------------------------------ Methods -------------------------------- #
-    def __init__(self, path):
-        """Here we record the full path of the input file."""
+    def __init__(self, path, snapshot=True, prefix=None, jobs=1):
+        """
+        Here we record the full path of the input file. If `snapshot` is
+        true, the tree is saved to a binary snapshot next to the outputs
+        and loaded from there on the next run if the input hasn't changed.
+        The outputs are written next to the input unless a `prefix` is
+        given (a path without extension). With `jobs` above one, the tree
+        is built by several processes, each parsing part of the input.
+        """
         self.tsv_path = path
+        self.snapshot = snapshot
+        self.prefix   = prefix
+        self.jobs     = jobs
 
     def __iter__(self):
-        """Here we create a CSV reader object on the input file."""
-        # Check if the file is gzipped by reading the magic number #
-        with open(self.tsv_path, 'rb') as f:
-            magic_number = f.read(2)
-        # Open with gzip if the magic number matches #
-        if magic_number.startswith(b'\x1f\x8b'):
-            file_obj = gzip.open(self.tsv_path, 'rt')
-        else:
-            file_obj = open(self.tsv_path)
-        # Return the reader #
-        return csv.reader(file_obj, delimiter='\t')
+        """
+        Here we create a CSV reader object on the input file. If the file
+        is compressed (gzip or zstd), it is uncompressed in the background.
+        """
+        return csv.reader(open_input(self.tsv_path, 'rt'), delimiter='\t')
 
-    def __call__(self):
-        assert self.tree
-        return self.tree_file(), self.map_file(), self.names_file()
+    def open_binary(self):
+        """Open the input file in binary mode, uncompressing if needed."""
+        return open_input(self.tsv_path, 'rb')
+
+    def batches(self, block_size=2**16):
+        """
+        Yield lists of `(acc, fixed_path)` tuples, one list per block of
+        about `block_size` bytes read from the input. This is much faster
+        than going through `csv.reader` line by line. See the `lineage`
+        module for how the paths are split. Consecutive rows with the same
+        path share the same list.
+        """
+        with self.open_binary() as handle:
+            yield from LineageParser().read_batches(handle, block_size)
+
+    def lineages(self):
+        """
+        Return a dictionary linking every accession to its taxonomic path
+        as a tuple. Accessions are expected to be unique in the file. The
+        names shared by consecutive paths are only stored once.
+        """
+        share, result = PathCache().share, {}
+        for batch in self.batches():
+            for acc, path in batch:
+                result[acc] = tuple(share(path)[1])
+        return result
+
+    def __call__(self, jobs=None):
+        """
+        Build the tree and write the three output files. With `jobs` above
+        one, the outputs are written at the same time by several workers.
+        """
+        if jobs is None: jobs = self.jobs
+        # Build the tree and its layouts before any writer starts #
+        self.tree.freeze()
+        outputs = [self.tree_file, self.map_file, self.names_file,
+                   self.binary_file]
+        # Sequentially #
+        if jobs <= 1: return tuple(output() for output in outputs)
+        # In parallel #
+        return self.write_parallel(outputs, jobs)
+
+    def write_parallel(self, outputs, jobs):
+        """
+        The writers only read the finished tree. On platforms that can
+        `fork`, every worker is a child process sharing the memory pages of
+        the tree with the parent (copy-on-write), so nothing is pickled.
+        Elsewhere, we fall back to threads.
+        """
+        # Distribute the outputs to the workers in round-robin #
+        jobs   = min(jobs, len(outputs))
+        groups = [outputs[i::jobs] for i in range(jobs)]
+        run    = lambda group: [output() for output in group]
+        # Processes #
+        import multiprocessing
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+            workers = [context.Process(target=run, args=(group,))
+                       for group in groups]
+            for worker in workers: worker.start()
+            for worker in workers: worker.join()
+            for worker in workers:
+                if worker.exitcode != 0:
+                    msg = "A writer process failed with exit code %i."
+                    raise Exception(msg % worker.exitcode)
+        # Threads #
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(jobs) as pool:
+                list(pool.map(run, groups))
+        # Return #
+        return tuple(output.output_path for output in outputs)
 
     # ----------------------------- Properties ------------------------------ #
     @property
     def output_dir(self):
         """Where to store all the outputs."""
-        return os.path.dirname(self.tsv_path) + '/'
+        return os.path.dirname(self.output_prefix) + '/'
 
     @property
     def output_prefix(self):
         """Full name of the input file without the last extension."""
+        if self.prefix is not None: return str(self.prefix)
         return os.path.splitext(self.tsv_path)[0]
 
     @functools.cached_property
     def tree(self):
-        """Build the tree in memory using all entries."""
-        # Import #
-        from ete4 import Tree
-        # Initialize a hashmap of the nodes by number #
-        self.by_nums = {}
-        # Initialize the hashmap with numbers (of the nodes) by names #
-        self.by_names = {}
-        # Initialize the node number to zero #
-        current_num = 0
-        # Set the root name to "meta" #
-        root_name = "meta"
-        # Make the root of the tree #
-        self.root_node = Tree()
-        self.root_node.name = current_num
-        self.root_node.add_prop('taxa', root_name)
-        # Iterate over rows #
-        for i, row in enumerate(self):
-            # Check that the row has three columns #
-            if len(row) != 3:
-                msg = "The row %i does not contain three columns:\n%s"
-                raise Exception(msg % (i+1, row))
-            # Parse the row (the full_name is ignored) #
-            acc, path, full_name = row
-            # Check we have an accession #
-            if not acc:
-                msg = "This row does not contain an accession:\n%s"
-                raise Exception(msg % row)
-            # Split the path into a list #
-            path = path.split('/')
-            # Check we have a path #
-            if not path:
-                msg = "This row does not contain a taxonomic path:\n%s"
-                raise Exception(msg % row)
-            # Join numerical segments back with their preceding segments #
-            fixed_path = []
-            for i, segment in enumerate(path):
-                if segment.isdigit() and i > 0:
-                    fixed_path[-1] = fixed_path[-1] + '/' + segment
-                else:
-                    fixed_path.append(segment)
-            # Always start from the same root node before looping #
-            parent = self.root_node
-            # Iterate over the path #
-            for name in fixed_path:
-                # Check if the node exits, but only in the immediate children #
-                for child in parent.get_children():
-                    if child.get_prop('taxa') == name:
-                        # Retrieve the node if it exists already #
-                        node = child
-                        break
-                else:
-                    # Increment node number #
-                    current_num += 1
-                    # Append to the parent #
-                    node = parent.add_child(name=current_num)
-                    # Add the name #
-                    node.add_prop('taxa', name)
-                # Set the parent for the next iteration #
-                parent = node
-            # When we are on the last step of the path, add the accession.
-            # Here we can support missing `acc` feature too.
-            acc_list = node.get_prop('acc')
-            if acc_list is None: node.add_prop('acc', [acc])
-            else:                acc_list.append(acc)
+        """
+        The tree with all entries. See the `taxonomy_tree` module for the
+        description of the returned object.
+        """
+        # Try the snapshot first #
+        if not self.snapshot: return self.build_tree()
+        tree = self.load_snapshot()
+        if tree is not None: return tree
+        # Record the state of the inputs before they are parsed #
+        stats = [os.stat(path) for path in self.inputs]
+        tree  = self.build_tree()
+        self.save_snapshot(tree, stats)
+        return tree
+
+    def build_tree(self):
+        """Build the tree in memory by parsing all entries."""
+        # With several processes if possible #
+        if self.jobs > 1 and not is_compressed(self.tsv_path):
+            return self.build_tree_parallel()
+        # Make the tree with its root named "meta" and numbered zero #
+        tree  = TaxonomyTree(root_name="meta")
+        cache = PathCache(tree)
+        start = time.perf_counter()
+        rows  = 0
+        # Iterate over batches of parsed rows #
+        for batch in self.batches():
+            for acc, fixed_path in batch:
+                # Iterate over the path, starting from the deepest node it
+                # shares with the previous one. Other children are found
+                # through a hashmap lookup.
+                node = cache.add_path(fixed_path)
+                # When we are on the last step of the path, add the accession #
+                tree.add_accession(node, acc)
+            rows += len(batch)
         # Return #
-        return self.root_node
+        self.report_build(rows, time.perf_counter() - start, cache)
+        return tree
+
+    @staticmethod
+    def report_build(rows, seconds, cache):
+        msg = ("Built the tree from %i rows in %.2f s (%i rows/s), with %.1f%%"
+               " of the path segments found in the cache.")
+        print(msg % (rows, seconds, rows / max(seconds, 1e-9),
+                     100 * cache.hit_rate))
+
+    def byte_ranges(self, count):
+        """
+        Split the input file in about `count` ranges of bytes of the same
+        size, each made of whole lines.
+        """
+        size, cuts = os.path.getsize(self.tsv_path), [0]
+        with open(self.tsv_path, 'rb') as handle:
+            for i in range(1, count):
+                handle.seek(size * i // count)
+                handle.readline()
+                cuts.append(handle.tell())
+        cuts.append(size)
+        return [(start, end) for start, end in zip(cuts, cuts[1:])
+                if end > start]
+
+    def build_tree_parallel(self):
+        """
+        Build the same tree with `jobs` processes. The input is split in
+        ranges of whole lines and every worker parses one range into a
+        separate tree (see `build_range()`).
+
+        In the sequential build, nodes are numbered in the order in which
+        their path first appears. The ranges are in the order of the file
+        and the nodes of every tree are in the order of their creation, so
+        merging the trees one after the other with `TaxonomyTree.merge()`
+        gives exactly the same numbers. Only the nodes also found in an
+        earlier range need a lookup, and the merge of the first ranges
+        happens while the workers are still parsing the next ones.
+        """
+        import multiprocessing
+        start  = time.perf_counter()
+        ranges = self.byte_ranges(2 * self.jobs)
+        tasks  = [(self.tsv_path, first, end) for first, end in ranges]
+        # Merge the trees in the order of the file as they come #
+        tree, cache = TaxonomyTree(root_name="meta"), PathCache()
+        with multiprocessing.Pool(max(1, min(self.jobs, len(tasks)))) as pool:
+            for result in pool.imap(build_range, tasks):
+                parent, depth, name_idx, names, accessions, ends = result[:6]
+                mapping = tree.merge(parent, depth, name_idx, names)
+                tree.accessions += accessions
+                tree.acc_node.extend(map(mapping.__getitem__, ends))
+                cache.hits    += result[6]
+                cache.lookups += result[7]
+        # Return #
+        self.report_build(len(tree.accessions), time.perf_counter() - start,
+                          cache)
+        return tree
+
+    # ----------------------------- Snapshots ------------------------------- #
+    snapshot_extension = '.snapshot'
+
+    @property
+    def snapshot_path(self):
+        return self.output_prefix + self.snapshot_extension
+
+    @property
+    def inputs(self):
+        """All the files that the tree depends on."""
+        return [self.tsv_path]
+
+    @staticmethod
+    def file_hash(path, chunk_size=2**22):
+        """The hexadecimal BLAKE2 digest of a file's contents."""
+        import hashlib
+        digest = hashlib.blake2b()
+        with open(path, 'rb') as handle:
+            while True:
+                chunk = handle.read(chunk_size)
+                if not chunk: return digest.hexdigest()
+                digest.update(chunk)
+
+    def load_snapshot(self):
+        """
+        Return the tree stored in the snapshot if it was made by the same
+        class from the same inputs, otherwise `None`. The inputs are
+        compared by size and modification time, and if only the time
+        differs (e.g. after a copy), by the hash of their contents.
+        """
+        # Read the header #
+        if not os.path.exists(self.snapshot_path): return None
+        with open(self.snapshot_path, 'rb') as handle:
+            header = TaxonomyTree.read_header(handle)
+        if header is None: return None
+        metadata = header['metadata']
+        # Check the inputs #
+        if metadata['builder'] != self.__class__.__name__: return None
+        if len(metadata['inputs']) != len(self.inputs): return None
+        for path, key in zip(self.inputs, metadata['inputs']):
+            stat = os.stat(path)
+            if stat.st_size != key['size']: return None
+            if stat.st_mtime_ns == key['mtime_ns']: continue
+            if self.file_hash(path) != key['hash']: return None
+        # Load it #
+        return TaxonomyTree.load(self.snapshot_path)
+
+    def save_snapshot(self, tree, stats):
+        """Save the tree with the `os.stat()` of the inputs taken earlier."""
+        inputs = [{'size':     stat.st_size,
+                   'mtime_ns': stat.st_mtime_ns,
+                   'hash':     self.file_hash(path)}
+                  for path, stat in zip(self.inputs, stats)]
+        metadata = {'builder': self.__class__.__name__, 'inputs': inputs}
+        return tree.save(self.snapshot_path, metadata)
+
+    @functools.cached_property
+    def ete_tree(self):
+        """The same tree as an `ete4` object, only built if requested."""
+        return self.tree.to_ete()
 
     # ---------------------------- Composition ------------------------------ #
     @functools.cached_property
@@ -215,6 +413,411 @@ class AccessionTSV:
     def tree_file(self):
         return TreeFile(self)
 
+    @functools.cached_property
+    def binary_file(self):
+        return BinaryFile(self)
+
+###############################################################################
+def build_range(task):
+    """
+    Build the tree of the rows in one range of bytes of a TSV file, in a
+    worker process of a parallel build. Returns the parent, depth and name
+    index of every node, the table of names, the accessions, the node of
+    every accession, and the hits and lookups of the path cache.
+    """
+    path, start, end = task
+    tree  = TaxonomyTree(root_name="meta")
+    cache = PathCache(tree)
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        try:
+            for batch in LineageParser().read_batches(handle, size=end-start):
+                for acc, fixed_path in batch:
+                    tree.add_accession(cache.add_path(fixed_path), acc)
+        except Exception as error:
+            msg = "%s\n(rows counted from the byte %i of '%s')"
+            raise Exception(msg % (error, start, path)) from None
+    return (tree.parent, tree.depth, tree.name_idx, tree.names,
+            tree.accessions, tree.acc_node, cache.hits, cache.lookups)
+
+###############################################################################
+class IncrementalTSV(AccessionTSV):
+    """
+    Represents a new version of a TSV file for which the database of a
+    previous version already exists. Instead of building the tree from
+    scratch, the previous database is loaded and only the accessions that
+    were added, removed or moved are applied to it.
+
+    Existing nodes keep their number, so that old crest4 results stay
+    comparable, and new nodes get numbers after the current maximum. Nodes
+    left without any accession are removed and their numbers not reused.
+    """
+
+    def __init__(self, path, previous_tsv, snapshot=True, prefix=None):
+        """
+        The previous `.map`, `.names` and `.tre` files are expected to be
+        next to the previous TSV file, as written by `AccessionTSV`.
+        """
+        super().__init__(path, snapshot, prefix)
+        self.previous = AccessionTSV(previous_tsv, snapshot=False)
+
+    @property
+    def previous_database(self):
+        """The paths to the `.tre`, `.names` and `.map` files."""
+        prefix = self.previous.output_prefix
+        return [prefix + TreeFile.extension,
+                prefix + NamesFile.extension,
+                prefix + MapFile.extension]
+
+    @property
+    def inputs(self):
+        return [self.tsv_path, self.previous.tsv_path] + self.previous_database
+
+    def build_tree(self):
+        """Apply the differences between the two TSV files."""
+        # Load the previous database #
+        tree = TaxonomyTree.from_database(*self.previous_database)
+        # Compare the two versions of the input #
+        old, new = self.previous.lineages(), self.lineages()
+        removed = [acc for acc, path in old.items() if new.get(acc) != path]
+        added   = [acc for acc, path in new.items() if old.get(acc) != path]
+        # Accessions on internal nodes are not in the `.map` file #
+        in_map = set(tree.accessions)
+        for acc, path in old.items():
+            if acc in in_map or new.get(acc) != path: continue
+            node = tree.find_path(path)
+            if node is not None: tree.add_accession(node, acc)
+        del in_map
+        # Apply the changes #
+        tree.remove_accessions(removed)
+        for acc in added:
+            tree.add_accession(tree.add_path(new[acc]), acc)
+        pruned = tree.prune()
+        # Report #
+        moved = len(set(removed) & set(added))
+        msg = "Added %i, removed %i and moved %i accessions (%i nodes pruned)."
+        print(msg % (len(added) - moved, len(removed) - moved, moved, pruned))
+        # Return #
+        return tree
+
+###############################################################################
+class StableTSV(AccessionTSV):
+    """
+    Represents a TSV file whose node numbers are kept in a registry stored
+    with the database (see the `id_registry` module). The same taxonomic
+    path then always gets the same number, whatever the order of the rows
+    and from one release to the next, and unchanged outputs are not
+    rewritten at all.
+
+    The tree is first built as usual (with several processes if asked) and
+    then renumbered. Paths already in the registry get their number back.
+    New paths get the next free numbers in the alphabetical order of their
+    lineages, which puts parents before children and doesn't depend on the
+    order of the rows either. For the same reason, the accessions of every
+    leaf are sorted. The numbers of paths that disappeared stay unused.
+
+    If there is no registry yet but the outputs of a previous build are
+    there, the registry starts with their numbers, so that adopting it
+    keeps all the current numbers.
+
+    There is no snapshot of the tree, as the registry must be read and
+    updated every time the outputs are written. A snapshot would skip
+    `build_tree()` and ignore a registry that was edited or deleted.
+    """
+
+    registry_extension = '.ids'
+
+    def __init__(self, path, prefix=None, jobs=1):
+        super().__init__(path, snapshot=False, prefix=prefix, jobs=jobs)
+
+    @property
+    def registry_path(self):
+        return self.output_prefix + self.registry_extension
+
+    def load_registry(self):
+        """The existing registry, or one made from the previous outputs."""
+        from id_registry import IdRegistry
+        if os.path.exists(self.registry_path):
+            return IdRegistry(self.registry_path)
+        previous = [self.output_prefix + extension for extension in
+                    (TreeFile.extension, NamesFile.extension, MapFile.extension)]
+        if all(os.path.exists(path) for path in previous):
+            tree = TaxonomyTree.from_database(*previous)
+            return IdRegistry.from_tree(self.registry_path, tree)
+        return IdRegistry(self.registry_path)
+
+    def build_tree(self):
+        """Build the tree and give every node its registered number."""
+        draft    = super().build_tree()
+        registry = self.load_registry()
+        hashes   = registry.tree_hashes(draft)
+        # The paths that are already known #
+        numbers = {node: registry.get(path_hash)
+                   for node, path_hash in hashes.items()}
+        # The new ones, in an order independent from the rows #
+        new = sorted((draft.lineage(node), node)
+                     for node, num in numbers.items() if num is None)
+        for lineage, node in new: numbers[node] = registry.add(hashes[node])
+        # Copy the tree with the new numbers, parents first #
+        tree = TaxonomyTree(root_name=draft.name(0))
+        for node in draft.preorder():
+            if node == 0: continue
+            tree.add_node(numbers[node], numbers[draft.parent[node]],
+                          draft.name(node))
+        for acc, node in sorted(zip(draft.accessions, draft.acc_node)):
+            tree.add_accession(numbers[node], acc)
+        # Remember the new numbers #
+        registry.save()
+        msg = "Kept the numbers of %i nodes and numbered %i new ones."
+        print(msg % (len(numbers) - 1 - len(new), len(new)))
+        return tree
+
+###############################################################################
+class ExternalTSV(AccessionTSV):
+    """
+    Represents a TSV file too large for its tree to fit in memory. The
+    same `.tre`, `.map` and `.names` files are written, but no tree object
+    is ever made. Instead, the rows and then the nodes go through a few
+    external sorts (see the `external_sort` module) and the outputs are
+    streamed from the sorted runs. The sort buffers take about `memory`
+    bytes in total, whatever the size of the input.
+
+    The node numbers are exactly those of the sequential build. There, a
+    node is numbered when the first row going through it is parsed, so the
+    numbers follow the order of the pairs (first row under the node, depth
+    of the node). Here, that pair is found for every node while walking
+    the rows sorted by path, and the nodes are then numbered by sorting
+    on it. The steps are:
+
+    1) Sort the rows by path. Rows with the same path keep their order.
+    2) Walk the sorted rows as a depth-first traversal of the tree. Every
+       node gets a temporary number in that order and its creation pair.
+    3) Sort the nodes by creation pair to give them their final number.
+    4) Sort the nodes by the list of numbers from the root down to them,
+       which is the preorder of the `.tre` and `.map` files, and by depth
+       first, which is the levelorder of the `.names` file.
+
+    The `.bin` file is not written, as it needs the whole tree in memory.
+    It can be made afterwards with `binary_db.compile_database()`.
+    """
+
+    # Joins the segments of a path in the sort keys. It comes before any
+    # other character, so that a path comes right before its children #
+    separator = '\x00'
+
+    def __init__(self, path, memory=2**30, tmp_dir=None, prefix=None):
+        """
+        The temporary files are written in `tmp_dir`, by default next to
+        the outputs. They are about as large as the input.
+        """
+        super().__init__(path, snapshot=False, prefix=prefix)
+        self.memory  = memory
+        self.tmp_dir = tmp_dir
+
+    def sorter(self, key, work_dir, share=1.0):
+        """An external sorter using a `share` of the memory budget."""
+        return ExternalSorter(key, buffer_lines=None, tmp_dir=work_dir,
+                              buffer_bytes=int(self.memory * share))
+
+    @staticmethod
+    def until_tab(line):
+        return line[:line.index('\t')]
+
+    def __call__(self, jobs=1):
+        """
+        Build the tree on disk and write the three output files. They are
+        all streamed from the same sorted runs, so `jobs` is ignored.
+        """
+        work_dir = self.tmp_dir or os.path.dirname(
+                   os.path.abspath(self.output_prefix))
+        work_dir = tempfile.mkdtemp(prefix='build_', dir=work_dir)
+        try:
+            rows = self.sorted_rows(work_dir)
+            count, max_depth, creation = self.walk(rows, work_dir)
+            rows.cleanup()
+            with self.numbering(creation, count, work_dir) as numbers:
+                preorder, levelorder = self.layouts(numbers, work_dir)
+            creation.cleanup()
+            self.write_tree_and_map(preorder)
+            self.write_names(levelorder, max_depth)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return (self.tree_file.output_path, self.map_file.output_path,
+                self.names_file.output_path)
+
+    # ------------------------------- Steps --------------------------------- #
+    def sorted_rows(self, work_dir):
+        """Sort the lines `path, row, acc` by path. Returns the sorter."""
+        rows = self.sorter(self.until_tab, work_dir)
+        join = self.separator.join
+        row  = 0
+        for batch in self.batches():
+            for acc, fixed_path in batch:
+                rows.add('%s\t%i\t%s\n' % (join(fixed_path), row, acc))
+                row += 1
+        return rows
+
+    def walk(self, rows, work_dir):
+        """
+        Go through the rows sorted by path, going up the tree to the node
+        shared with the previous path and down again creating new nodes.
+        The nodes are written to `nodes.txt` with their depth and name, the
+        line number being their temporary number. The accessions are
+        written to `accs.txt` with the temporary number of their node.
+        Returns the count of nodes, the maximum depth, and the sorter of
+        the nodes by creation pair.
+        """
+        creation = self.sorter(lambda line: line[:14], work_dir)
+        nodes = open(os.path.join(work_dir, 'nodes.txt'), 'w')
+        accs  = open(os.path.join(work_dir, 'accs.txt'), 'w')
+        nodes.write('0\tmeta\n')
+        # The current path with the temporary number of every node on it
+        # and the first row under it, starting with the root #
+        names, temps, firsts = [], [0], [-1]
+        count, max_depth = 1, 0
+        def go_up():
+            temp, first = temps.pop(), firsts.pop()
+            if first < firsts[-1]: firsts[-1] = first
+            creation.add('%010x%04x\t%i\n' % (first, len(names), temp))
+            names.pop()
+        # Iterate over the sorted rows #
+        for line in rows:
+            path, row, acc = line[:-1].split('\t')
+            path, row = path.split(self.separator), int(row)
+            # Go up to the deepest node shared with the previous path #
+            shared = 0
+            for old, new in zip(names, path):
+                if old != new: break
+                shared += 1
+            while len(names) > shared: go_up()
+            # Go down creating the new nodes #
+            for name in path[shared:]:
+                names.append(name)
+                temps.append(count)
+                firsts.append(row)
+                nodes.write('%i\t%s\n' % (len(names), name))
+                count += 1
+            if len(names) > max_depth: max_depth = len(names)
+            # The accession goes on the last node #
+            accs.write('%i\t%s\n' % (temps[-1], acc))
+        # Close the last path #
+        while names: go_up()
+        nodes.close()
+        accs.close()
+        return count, max_depth, creation
+
+    @contextlib.contextmanager
+    def numbering(self, creation, count, work_dir):
+        """
+        Give every node its final number in the order of creation. Yields
+        the final numbers indexed by temporary number, in an array mapped
+        from a file on disk.
+        """
+        path = os.path.join(work_dir, 'numbers.bin')
+        with open(path, 'w+b') as handle:
+            handle.truncate(4 * count)
+            mapped  = mmap.mmap(handle.fileno(), 4 * count)
+            numbers = memoryview(mapped).cast('I')
+            try:
+                numbers[0] = 0
+                for num, line in enumerate(creation, 1):
+                    numbers[int(line[15:])] = num
+                yield numbers
+            finally:
+                numbers.release()
+                mapped.close()
+
+    def read_nodes(self, work_dir):
+        """
+        Yield every node as `(temp, depth, name, is_leaf)` in the order of
+        `nodes.txt`. As it is a preorder, a node is a leaf if the next one
+        is not deeper.
+        """
+        previous = None
+        with open(os.path.join(work_dir, 'nodes.txt')) as handle:
+            for temp, line in enumerate(handle):
+                depth, name = line[:-1].split('\t', 1)
+                depth = int(depth)
+                if previous: yield previous + (depth <= previous[1],)
+                previous = (temp, depth, name)
+        yield previous + (True,)
+
+    def read_accessions(self, work_dir):
+        """Yield `(temp, acc)` pairs in the order of `accs.txt`."""
+        with open(os.path.join(work_dir, 'accs.txt')) as handle:
+            for line in handle:
+                temp, acc = line[:-1].split('\t', 1)
+                yield int(temp), acc
+
+    def layouts(self, numbers, work_dir):
+        """
+        Sort the nodes in the two orders of the outputs. The key of a node
+        is the list of numbers from the root down to it, in fixed width
+        hexadecimal. Sorted as strings, the keys give the preorder with
+        children by increasing number, as written by `ete4`. With the
+        depth in front, they give the levelorder. Accessions come in the
+        first order, right after their leaf.
+        """
+        preorder   = self.sorter(self.until_tab, work_dir, share=0.5)
+        levelorder = self.sorter(self.until_tab, work_dir, share=0.5)
+        accs       = self.read_accessions(work_dir)
+        next_acc   = next(accs, None)
+        keys       = []
+        for temp, depth, name, is_leaf in self.read_nodes(work_dir):
+            del keys[depth:]
+            keys.append('%08x' % numbers[temp])
+            key = ''.join(keys)
+            preorder.add(key + '\t\n')
+            levelorder.add('%04x%s\t%s\n' % (depth, key, name))
+            # Accessions on internal nodes are not in the map file #
+            while next_acc is not None and next_acc[0] == temp:
+                if is_leaf: preorder.add(key + '\t' + next_acc[1] + '\n')
+                next_acc = next(accs, None)
+        return preorder, levelorder
+
+    def write_tree_and_map(self, preorder):
+        """
+        Both outputs are written from the preorder. A node is only known
+        to be internal when the next one is deeper, so every node is
+        written when the next one is read.
+        """
+        tree_path, map_path = self.tree_file.output_path, \
+                              self.map_file.output_path
+        with open(tree_path, 'w') as tre, open(map_path, 'w') as map_handle:
+            opened, previous = [], None
+            for line in preorder:
+                key, acc = line[:-1].split('\t')
+                num = str(int(key[-8:], 16))
+                if acc:
+                    map_handle.write(num + ',' + acc + '\n')
+                    continue
+                depth = len(key) // 8 - 1
+                if previous is not None:
+                    previous_depth, previous_num = previous
+                    if depth > previous_depth:
+                        tre.write('(')
+                        opened.append(previous_num)
+                    else:
+                        pieces = [previous_num]
+                        while len(opened) > depth:
+                            pieces.append(')' + opened.pop())
+                        pieces.append(',')
+                        tre.write(''.join(pieces))
+                previous = depth, num
+            tre.write(previous[1] + ''.join(')' + num
+                                            for num in reversed(opened)) + ';')
+        preorder.cleanup()
+
+    def write_names(self, levelorder, max_depth):
+        smlrty = {d: str(s)
+                  for d, s in NamesFile.similarities(max_depth).items()}
+        with open(self.names_file.output_path, 'w') as handle:
+            for line in levelorder:
+                key, name = line[:-1].split('\t', 1)
+                handle.write(str(int(key[-8:], 16)) + ',' + name + ',' +
+                             smlrty[int(key[:4], 16)] + '\n')
+        levelorder.cleanup()
+
 ###############################################################################
 class OutputFile:
     """Parent class for all outputs generated by the script."""
@@ -225,10 +828,30 @@ class OutputFile:
         self.acc_tsv = tsv_path
 
     def __call__(self):
-        with open(self.output_path, 'w') as handle:
-            handle.writelines(self.lines())
+        with self.replacing() as tmp_path:
+            with open(tmp_path, 'w') as handle:
+                handle.writelines(self.lines())
         return self.output_path
 
+    @contextlib.contextmanager
+    def replacing(self):
+        """
+        Yield a temporary path to write the output to. Once it is written,
+        it replaces the previous output, unless both are identical, in
+        which case the previous one is kept untouched (with its time).
+        """
+        tmp_path = self.output_path + '.tmp'
+        try:
+            yield tmp_path
+        except BaseException:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise
+        if os.path.exists(self.output_path) and \
+           filecmp.cmp(tmp_path, self.output_path, shallow=False):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, self.output_path)
+
     # ----------------------------- Properties ------------------------------ #
     @property
     def output_path(self):
@@ -244,22 +867,25 @@ class MapFile(OutputFile):
     extension = '.map'
 
     def lines(self):
-        for leaf in self.acc_tsv.tree.traverse():
-            if not leaf.is_leaf(): continue
+        tree = self.acc_tsv.tree
+        for node in tree.preorder():
+            if not tree.is_leaf(node): continue
             # Check if the leaf has an accession #
-            if leaf.get_prop('acc') is None: self.show_bad_leaf(leaf)
+            accessions = tree.node_accessions(node)
+            if not accessions: self.show_bad_leaf(node)
             # Return the line (support multiple accessions too) #
-            for acc in leaf.get_prop('acc'):
-                yield str(leaf.name) + ',' + acc + '\n'
+            for acc in accessions:
+                yield str(node) + ',' + acc + '\n'
 
     def show_bad_leaf(self, leaf):
         # List the parents #
+        tree = self.acc_tsv.tree
         msg  = "Leaf node %s (%s) is missing an accession ('%s')."
-        path = [node.get_prop('taxa') for node in leaf.ancestors()]
+        path = [tree.name(node) for node in tree.ancestors(leaf)]
         path = '/'.join(reversed(path))
-        msg  = msg % (leaf.name, leaf.get_prop('taxa'), path)
+        msg  = msg % (leaf, tree.name(leaf), path)
         # We also want to see the children #
-        more = '/'.join([node.get_prop('taxa') for node in leaf.get_children()])
+        more = '/'.join([tree.name(node) for node in tree.children(leaf)])
         # Stop here #
         raise Exception(msg + "\nChildren: " + more)
 
@@ -278,13 +904,13 @@ class NamesFile(OutputFile):
              4: 0.87,
              5: 0.89, ... }
         """
-        # Get the maximum depth #
-        depth = lambda leaf: self.acc_tsv.tree.get_distance(self.acc_tsv.tree,
-                                                            leaf,
-                                                            topological=True)
-        max_depth = int(max(depth(leaf)
-                            for leaf in self.acc_tsv.tree.traverse()
-                            if leaf.is_leaf()))
+        # Get the maximum depth, the depths are recorded at insertion time
+        # and the deepest node of a tree is always a leaf #
+        return self.similarities(max(self.acc_tsv.tree.depth))
+
+    @staticmethod
+    def similarities(max_depth):
+        """The same dictionary for a tree whose deepest node is known."""
         # Build the dictionary #
         result = {d: round((0.99 - 0.02 * (max_depth - d)), 2)
                   for d in range(3, max_depth + 1)}
@@ -296,16 +922,16 @@ class NamesFile(OutputFile):
         return result
 
     def lines(self):
-        """The `node.name` here represents it's numerical ID here."""
-        for node in self.acc_tsv.tree.traverse("levelorder"):
-            depth  = self.acc_tsv.tree.get_distance(
-                self.acc_tsv.tree,
-                node,
-                topological=True,
-            )
-            smlrty = self.depth_to_smlrty[depth]
-            yield (str(node.name) + ',' + node.get_prop('taxa') + ',' +
-                   str(smlrty)+ '\n')
+        """
+        The node number is the first column. Both the depths and the
+        similarities are looked up instead of being recomputed per node.
+        """
+        tree = self.acc_tsv.tree
+        depth, names, name_idx = tree.depth, tree.names, tree.name_idx
+        smlrty = {d: str(s) for d, s in self.depth_to_smlrty.items()}
+        for node in tree.levelorder():
+            yield (str(node) + ',' + names[name_idx[node]] + ',' +
+                   smlrty[depth[node]] + '\n')
 
 ###############################################################################
 class TreeFile(OutputFile):
@@ -313,13 +939,38 @@ class TreeFile(OutputFile):
     extension = '.tre'
 
     def __call__(self):
-        # Call function from ete #
-        self.acc_tsv.tree.write(parser=8,
-                                outfile=self.output_path,
-                                format_root_node=True)
+        # Same output as `ete4` with `parser=8` and `format_root_node` #
+        with self.replacing() as tmp_path:
+            with open(tmp_path, 'w') as handle:
+                self.acc_tsv.tree.write_newick(handle, format_root_node=True)
         # Return #
         return self.output_path
 
+###############################################################################
+class BinaryFile(OutputFile):
+    """
+    Represents the compiled binary version of the three other files, with
+    the same contents (see the `binary_db` module).
+    """
+    extension = '.bin'
+
+    def __call__(self):
+        from binary_db import write_database
+        tree = self.acc_tsv.tree
+        # The similarities are the same as in the names file #
+        depth_to_smlrty = self.acc_tsv.names_file.depth_to_smlrty
+        similarity = (depth_to_smlrty.get(depth, 0.0) for depth in tree.depth)
+        names = (tree.name(node) for node in range(len(tree)))
+        # The accessions are the same as in the map file #
+        accessions = (line.rstrip('\n').split(',', 1)[::-1]
+                      for line in self.acc_tsv.map_file.lines())
+        accessions = ((acc, int(num)) for acc, num in accessions)
+        # Write #
+        with self.replacing() as tmp_path:
+            write_database(tmp_path, tree.parent, tree.depth, similarity,
+                           names, accessions)
+        return self.output_path
+
 ###############################################################################
 if __name__ == '__main__':
     # Create a shell parser #
@@ -330,13 +981,49 @@ if __name__ == '__main__':
     help_msg = "The path to the TSV file to process."
     parser.add_argument("input_tsv", help=help_msg, type=str)
 
+    # Optionally start from the database of a previous version #
+    help_msg = ("The path to the previous version of the TSV file. Its "
+                "database must be next to it. Only the differences are "
+                "applied and existing node numbers are kept.")
+    parser.add_argument("--previous", help=help_msg, type=str)
+
+    # Optionally disable the snapshot #
+    help_msg = ("Don't save the parsed tree to a binary snapshot and don't "
+                "load it from one.")
+    parser.add_argument("--no-snapshot", help=help_msg, action='store_true')
+
+    # Optionally build the tree and write the outputs in parallel #
+    help_msg = ("The number of processes building the tree, and of output "
+                "files to write at the same time.")
+    parser.add_argument("--jobs", help=help_msg, type=int, default=1)
+
+    # Optionally build the tree on disk #
+    help_msg = ("Build the tree on disk for inputs that don't fit in memory, "
+                "using about this many MiB. The `.bin` file is not written.")
+    parser.add_argument("--memory", help=help_msg, type=int)
+
+    # Optionally keep the node numbers in a registry #
+    help_msg = ("Keep the node numbers of every taxonomic path in a `.ids` "
+                "file next to the outputs, and reuse them on the next build. "
+                "No snapshot is saved in this mode.")
+    parser.add_argument("--registry", help=help_msg, action='store_true')
+
     # Parse the shell arguments #
     args = parser.parse_args()
     tsv_path = args.input_tsv
+    if sum(map(bool, (args.memory, args.previous, args.registry))) > 1:
+        parser.error("Only one of --memory, --previous and --registry "
+                     "can be used.")
 
     # Run it #
-    acc_tsv = AccessionTSV(tsv_path)
-    print(acc_tsv())
+    snapshot = not args.no_snapshot
+    if args.previous:   acc_tsv = IncrementalTSV(tsv_path, args.previous,
+                                                 snapshot=snapshot)
+    elif args.memory:   acc_tsv = ExternalTSV(tsv_path, args.memory * 2**20)
+    elif args.registry: acc_tsv = StableTSV(tsv_path, jobs=args.jobs)
+    else:               acc_tsv = AccessionTSV(tsv_path, snapshot=snapshot,
+                                               jobs=args.jobs)
+    print(acc_tsv(jobs=args.jobs))
 
     # Show success #
     print("Success.")
\ No newline at end of file
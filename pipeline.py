@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A single command going from an ARB export to a packaged crest4 database.
+
+The work is split in stages that declare the files they read and write:
+
+    * taxonomy - the `.tre`, `.map`, `.names` and `.bin` files from the
+                 TSV (see `make_new_crest_db.py`), and with `--registry`
+                 the `.ids` file keeping the node numbers between releases.
+    * fasta    - the FASTA without duplicates and with U converted to T
+                 (see `fasta_tools.clean_fasta`).
+    * index    - the `.fai` offset index of that FASTA.
+    * udb      - the `.udb` index of that FASTA made by VSEARCH (see
+                 `udb_index.py`).
+    * check    - every accession of the map must be in the FASTA.
+    * package  - the `.tar.gz` of the database directory (see `archive.py`).
+    * upload   - only if a bucket is given (see `upload.py`).
+
+A stage depends on the stages that write its inputs. Stages whose
+dependencies are done run at the same time, so the taxonomy and the FASTA
+are processed concurrently, and the `--jobs` cores are split between them.
+Every stage runs in its own child process, forked from the main process
+while it has a single thread. A stage can then start pools of worker
+processes without the risk of a fork happening while a sibling stage holds
+a lock. The size and
+modification time of the inputs and outputs of every stage are recorded in
+a state file when it succeeds. On the next run, a stage is skipped if
+those are unchanged and its parameters are the same.
+
+The time spent in every stage is printed at the end.
+
+Typically you would call it like this:
+
+    $ ./pipeline.py export.tsv export.fasta --name silvamod138pr2 \
+      --output-dir ../databases/ --bucket crest4
+"""
+
+# Built-in modules #
+import os, json, time, traceback, multiprocessing
+from multiprocessing.connection import wait
+
+###############################################################################
+class Stage:
+    """
+    A step of the pipeline. The `function` is called with the number of
+    cores it may use. The `params` are any JSON-serializable values that
+    change the result.
+    """
+
+    def __init__(self, name, function, inputs=(), outputs=(), after=(),
+                 params=None):
+        self.name     = name
+        self.function = function
+        self.inputs   = [str(path) for path in inputs]
+        self.outputs  = [str(path) for path in outputs]
+        self.after    = list(after)
+        self.params   = params
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        return "<%s object '%s'>" % (self.__class__.__name__, self.name)
+
+    @staticmethod
+    def stat(path):
+        """The size and modification time of a file, or None if absent."""
+        if not os.path.exists(path): return None
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def fingerprint(self):
+        """Everything that must be unchanged for the stage to be skipped."""
+        return {'inputs':  {path: self.stat(path) for path in self.inputs},
+                'outputs': {path: self.stat(path) for path in self.outputs},
+                'params':  self.params}
+
+#-----------------------------------------------------------------------------#
+class Pipeline:
+    """
+    Runs `stages` in the order of their dependencies, using at most `jobs`
+    cores in total, remembering what was done in the JSON file `state_path`.
+    """
+
+    def __init__(self, stages, state_path, jobs=2):
+        self.stages     = {stage.name: stage for stage in stages}
+        self.state_path = str(state_path)
+        self.jobs       = max(1, jobs)
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        return "<%s object with %i stages>" % (self.__class__.__name__,
+                                               len(self.stages))
+
+    def dependencies(self, stage):
+        """The names of the stages writing the inputs of `stage`."""
+        writers = {path: other.name for other in self.stages.values()
+                   for path in other.outputs}
+        found = set(stage.after)
+        found.update(writers[path] for path in stage.inputs if path in writers)
+        found.discard(stage.name)
+        return found
+
+    # ------------------------------- State --------------------------------- #
+    def load_state(self):
+        if not os.path.exists(self.state_path): return {}
+        with open(self.state_path) as handle: return json.load(handle)
+
+    def save_state(self, state):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as handle: json.dump(state, handle, indent=4)
+        os.replace(tmp_path, self.state_path)
+
+    # ------------------------------ Running -------------------------------- #
+    @staticmethod
+    def run_stage(stage, cores, connection):
+        """
+        Call the function of `stage` and send the exception it raised, or
+        None, through `connection`. This runs in the child process.
+        """
+        try:
+            stage.function(cores)
+            error = None
+        except BaseException as exception:
+            traceback.print_exc()
+            error = exception
+        try:
+            connection.send(error)
+        except Exception:
+            # The exception could not be pickled #
+            connection.send(Exception(repr(error)))
+        connection.close()
+
+    def start_stage(self, stage, cores):
+        """
+        Fork the child process running `stage` and return it with the end
+        of the pipe its outcome will come from. Where `fork` is not
+        available, the stage runs here and the process is None.
+        """
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.run_stage(stage, cores, writer)
+            return None, reader
+        context = multiprocessing.get_context('fork')
+        process = context.Process(target=self.run_stage,
+                                  args=(stage, cores, writer),
+                                  name=stage.name)
+        process.start()
+        writer.close()
+        return process, reader
+
+    def finish_stage(self, stage, process, reader):
+        """Wait for the child process of `stage` and raise its exception."""
+        try:
+            error = reader.recv()
+        except EOFError:
+            process.join()
+            msg = "The stage '%s' exited with code %s."
+            error = Exception(msg % (stage.name, process.exitcode))
+        reader.close()
+        if process is not None: process.join()
+        if error is not None: raise error
+        for path in stage.outputs:
+            if not os.path.exists(path):
+                msg = "The stage '%s' did not create '%s'."
+                raise Exception(msg % (stage.name, path))
+
+    def __call__(self, force=False, verbose=True):
+        """
+        Run all the stages and return the seconds spent in each (None for
+        those that were skipped). Stages are started as soon as all their
+        dependencies are done, and share the cores that are free at that
+        moment.
+        """
+        state    = self.load_state()
+        needs    = {name: self.dependencies(stage)
+                    for name, stage in self.stages.items()}
+        unknown  = {dep for deps in needs.values() for dep in deps} - \
+                   set(self.stages)
+        if unknown: raise ValueError("Unknown stages: %s" % sorted(unknown))
+        # The name of every running stage with its process, pipe, cores
+        # and start time #
+        timings, running, failure = {}, {}, None
+        def done(name, seconds, fingerprint):
+            timings[name], state[name] = seconds, fingerprint
+            self.save_state(state)
+            if verbose:
+                if seconds is None: print("Stage '%s' is up to date." % name)
+                else: print("Stage '%s' done in %.1f s." % (name, seconds))
+        try:
+            while len(timings) < len(self.stages):
+                # Find what is ready, skipping what is up to date #
+                ready = [name for name, deps in needs.items()
+                         if name not in timings and name not in running
+                         and deps <= set(timings)]
+                skipped = [name for name in ready if not force and
+                           state.get(name) is not None and
+                           state[name] == self.stages[name].fingerprint()]
+                if skipped and not failure:
+                    for name in skipped: done(name, None, state[name])
+                    continue
+                # Start what is ready, splitting the free cores #
+                free  = self.jobs - sum(job[2] for job in running.values())
+                ready = [] if failure else ready[:max(0, free)]
+                for i, name in enumerate(ready):
+                    cores = free // len(ready) + (i < free % len(ready))
+                    if verbose:
+                        print("Stage '%s' started with %i cores." %
+                              (name, cores))
+                    process, reader = self.start_stage(self.stages[name],
+                                                       cores)
+                    running[name] = (process, reader, cores,
+                                     time.perf_counter())
+                if not running:
+                    if failure: raise failure
+                    raise ValueError("The stages have circular dependencies.")
+                # Wait for one to finish #
+                readers = {job[1]: name for name, job in running.items()}
+                name = readers[wait(list(readers))[0]]
+                process, reader, cores, start = running.pop(name)
+                try:
+                    self.finish_stage(self.stages[name], process, reader)
+                except BaseException as error:
+                    failure = failure or error
+                    continue
+                done(name, time.perf_counter() - start,
+                     self.stages[name].fingerprint())
+        finally:
+            # Don't leave stages running after a failure or an interruption #
+            for process, reader, cores, start in running.values():
+                if process is None: continue
+                process.terminate()
+                process.join()
+        # Report #
+        if verbose: print(self.report(timings))
+        return timings
+
+    def report(self, timings):
+        lines = ["%-10s %s" % (name, "skipped" if seconds is None
+                                     else "%8.2f s" % seconds)
+                 for name, seconds in timings.items()]
+        return '\n'.join(["Timings:"] + lines)
+
+###############################################################################
+def database_pipeline(tsv_path, fasta_path, name, output_dir, bucket=None,
+                      jobs=None, by_sequence=False, registry=False):
+    """
+    Declare all the stages that make the crest4 database called `name`
+    in `output_dir` from an ARB TSV export and its FASTA file.
+    """
+    # Imported here so that the module stays light #
+    from make_new_crest_db import AccessionTSV, StableTSV
+    from fasta_tools import clean_fasta, build_index, FastaIndex
+    from binary_db import BinaryDatabase
+    from archive import make_archive, hashes_path
+    from upload import upload_archive
+    from udb_index import UDBIndex
+    # Paths #
+    jobs    = jobs or os.cpu_count()
+    db_dir  = os.path.join(str(output_dir), name)
+    prefix  = os.path.join(db_dir, name)
+    tables  = [prefix + ext for ext in ('.tre', '.map', '.names', '.bin')]
+    if registry: tables.append(prefix + StableTSV.registry_extension)
+    fasta   = prefix + '.fasta'
+    index   = fasta + '.fai'
+    udb     = prefix + '.udb'
+    tarball = os.path.join(str(output_dir), name + '.tar.gz')
+    exclude = ('.DS_Store', os.path.basename(udb) + '.json')
+    os.makedirs(db_dir, exist_ok=True)
+    # The functions #
+    def taxonomy(cores):
+        if registry: builder = StableTSV(tsv_path, prefix=prefix, jobs=cores)
+        else:        builder = AccessionTSV(tsv_path, snapshot=False,
+                                            prefix=prefix, jobs=cores)
+        builder()
+    def sequences(cores):
+        kept, removed = clean_fasta(fasta_path, fasta, by_sequence, cores)
+        print("Kept %i sequences and removed %i duplicates." % (kept, removed))
+    def check(cores):
+        db, fasta_index = BinaryDatabase(prefix + '.bin'), FastaIndex(fasta)
+        missing = [acc for acc in db.acc_to_node if acc not in fasta_index]
+        db.close()
+        fasta_index.close()
+        if missing:
+            msg = "%i accessions of the map are not in the FASTA, e.g. %s."
+            raise Exception(msg % (len(missing), missing[:5]))
+    # The stages #
+    stages = [
+        Stage('taxonomy', taxonomy, [tsv_path], tables,
+              params={'registry': registry}),
+        Stage('fasta', sequences, [fasta_path], [fasta],
+              params={'by_sequence': by_sequence}),
+        Stage('index', lambda cores: build_index(fasta), [fasta], [index]),
+        Stage('udb', lambda cores: UDBIndex(db_dir)(threads=cores),
+              [fasta], [udb]),
+        Stage('check', check, [prefix + '.bin', index]),
+        Stage('package', lambda cores: make_archive(
+                             db_dir, tarball, jobs=cores, exclude=exclude),
+              tables + [fasta, index, udb],
+              [tarball, hashes_path(tarball)], after=['check']),
+    ]
+    if bucket:
+        stages.append(Stage('upload', lambda cores: upload_archive(
+                                tarball, bucket, public=True),
+                            [tarball], params={'bucket': bucket}))
+    # Return #
+    state_path = os.path.join(str(output_dir), name + '.pipeline.json')
+    return Pipeline(stages, state_path, jobs=jobs)
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    import argparse
+    parser = argparse.ArgumentParser(description=
+        "Make a packaged crest4 database from an ARB export in one command.")
+    parser.add_argument("input_tsv", help="The TSV file exported from ARB.")
+    parser.add_argument("input_fasta", help="The FASTA file exported from ARB.")
+    parser.add_argument("--name", required=True,
+                        help="The name of the database.")
+    parser.add_argument("--output-dir", default='.',
+                        help="Where to create the database directory.")
+    parser.add_argument("--bucket", default=None,
+                        help="Upload the archive to this S3 bucket.")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="The number of cores to use.")
+    parser.add_argument("--by-sequence", action="store_true",
+                        help="Remove duplicates by sequence, not accession.")
+    parser.add_argument("--registry", action="store_true",
+                        help="Keep the node numbers between releases.")
+    parser.add_argument("--force", action="store_true",
+                        help="Run every stage even if it is up to date.")
+    args = parser.parse_args()
+    # Run it #
+    pipeline = database_pipeline(args.input_tsv, args.input_fasta, args.name,
+                                 args.output_dir, args.bucket, args.jobs,
+                                 args.by_sequence, args.registry)
+    pipeline(force=args.force)
+    print("Success.")
@@ -0,0 +1,604 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A compact, array-backed taxonomy tree used when building crest4 databases.
+
+Creating one `ete4.Tree` object per taxon costs several hundred bytes and a
+lot of time per node, which adds up when the taxonomy has millions of nodes.
+Instead, every node here is just an integer (its number in the database)
+and its attributes are stored in parallel arrays:
+
+    * `parent`   - the number of the parent node (-1 for the root).
+    * `depth`    - the topological distance to the root.
+    * `name_idx` - the index of the taxon name in the interned name table.
+
+Node numbers that are not used (for instance after nodes were removed from
+a tree loaded from an existing database) have their parent set to `UNUSED`.
+
+Each taxon name is only stored once in `names`, no matter how many nodes
+carry it. The children of a node are found in a CSR (compressed sparse row)
+layout that is computed once the tree is complete: the children of node `n`
+are `child_list[child_start[n]:child_start[n+1]]`. The accessions are stored
+with the same layout.
+
+The tree can be saved to a versioned binary snapshot with `save()` and
+loaded back with `load()`, which costs almost nothing compared to parsing
+the original input again. The snapshot is a small JSON header followed by
+the raw arrays and the name tables, each at a recorded byte offset.
+
+If you need an `ete4` object, for instance to plot the tree, call the
+`to_ete()` method. This is the only place where `ete4` is imported.
+
+When adding many paths in a row, a `PathCache` only looks up the segments
+that differ from the previous path, as consecutive rows of a taxonomy
+usually share most of their lineage.
+"""
+
+# Built-in modules #
+import os, io, re, sys, json, struct
+from array import array
+
+# Constants #
+UNUSED = -2
+SNAPSHOT_MAGIC   = b'TAXOTREE'
+SNAPSHOT_VERSION = 1
+
+###############################################################################
+class TaxonomyTree:
+    """
+    A rooted tree where node numbers are attributed in order of creation,
+    starting with zero for the root.
+    """
+
+    def __init__(self, root_name="meta"):
+        # The interned name table and its reverse index #
+        self.names      = []
+        self.name_index = {}
+        # The parallel arrays describing every node #
+        self.parent   = array('i', [-1])
+        self.depth    = array('i', [0])
+        self.name_idx = array('i', [self.intern(root_name)])
+        # Hashmap of children keyed by the parent number and name index #
+        self.by_parent = {}
+        # The accessions and the node they are attached to #
+        self.accessions = []
+        self.acc_node   = array('i')
+        # The CSR layouts are computed lazily #
+        self.csr = None
+
+    def __getattr__(self, attr):
+        """
+        The hashmaps are not stored in snapshots, they are only rebuilt
+        from the arrays the first time they are needed.
+        """
+        if attr == 'name_index':
+            self.name_index = dict(zip(self.names, range(len(self.names))))
+            return self.name_index
+        if attr == 'by_parent':
+            self.by_parent = {(parent << 32) | name_idx: node
+                              for node, (parent, name_idx)
+                              in enumerate(zip(self.parent, self.name_idx))
+                              if parent >= 0}
+            return self.by_parent
+        raise AttributeError(attr)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        msg = "<%s object with %i nodes and %i accessions>"
+        return msg % (self.__class__.__name__, len(self), len(self.accessions))
+
+    # ------------------------------ Building ------------------------------- #
+    def intern(self, name):
+        """Return the index of `name` in the name table, adding it if new."""
+        index = self.name_index.get(name)
+        if index is None:
+            index = len(self.names)
+            self.names.append(name)
+            self.name_index[name] = index
+        return index
+
+    def add_child(self, parent, name):
+        """
+        Return the number of the child of `parent` called `name`, creating
+        that node if it doesn't exist yet.
+        """
+        name_idx = self.intern(name)
+        # The key packs both integers in a single one to save memory #
+        key = (parent << 32) | name_idx
+        node = self.by_parent.get(key)
+        if node is None:
+            node = len(self.parent)
+            self.parent.append(parent)
+            self.depth.append(self.depth[parent] + 1)
+            self.name_idx.append(name_idx)
+            self.by_parent[key] = node
+            self.csr = None
+        return node
+
+    def add_path(self, path):
+        """Follow (and create if needed) the nodes of `path` from the root."""
+        node = 0
+        for name in path:
+            node = self.add_child(node, name)
+        return node
+
+    def add_node(self, node, parent, name):
+        """
+        Create a node with a given number, as when loading an existing
+        database. Numbers that are skipped are marked as `UNUSED`.
+        """
+        if node == 0:
+            self.name_idx[0] = self.intern(name)
+            return node
+        # Grow the arrays if needed #
+        missing = node + 1 - len(self.parent)
+        if missing > 0:
+            self.parent.extend([UNUSED] * missing)
+            self.depth.extend([0] * missing)
+            self.name_idx.extend([0] * missing)
+        elif self.parent[node] != UNUSED:
+            raise Exception("The node number %i is used twice." % node)
+        # Fill the slot #
+        name_idx = self.intern(name)
+        self.parent[node]   = parent
+        self.depth[node]    = self.depth[parent] + 1
+        self.name_idx[node] = name_idx
+        self.by_parent[(parent << 32) | name_idx] = node
+        self.csr = None
+        return node
+
+    def merge(self, parent, depth, name_idx, names):
+        """
+        Add the nodes of another tree given by its arrays, in their order.
+        The nodes whose path already exists here are reused and the others
+        are appended, so numbers follow creation as if the other tree's
+        paths had been added here. Returns the array giving the number
+        here of every node of the other tree.
+        """
+        renamed   = array('i', map(self.intern, names))
+        mapping   = array('i', [0]) * len(parent)
+        by_parent = self.by_parent
+        start     = len(self.parent)
+        new, keys = array('i'), []
+        # A child of a node created by this merge is always new as well #
+        for node in range(1, len(parent)):
+            above = mapping[parent[node]]
+            key   = (above << 32) | renamed[name_idx[node]]
+            if above < start:
+                found = by_parent.get(key)
+                if found is not None:
+                    mapping[node] = found
+                    continue
+            mapping[node] = start + len(new)
+            new.append(node)
+            keys.append(key)
+        # Append the new nodes all at once #
+        self.parent.extend(mapping[parent[node]] for node in new)
+        self.depth.extend(depth[node] for node in new)
+        self.name_idx.extend(renamed[name_idx[node]] for node in new)
+        by_parent.update(zip(keys, range(start, len(self.parent))))
+        self.csr = None
+        return mapping
+
+    def add_accession(self, node, acc):
+        """Attach the accession `acc` to the node numbered `node`."""
+        self.accessions.append(acc)
+        self.acc_node.append(node)
+        self.csr = None
+
+    def find_path(self, path):
+        """Return the node at the end of `path`, or `None` if it's missing."""
+        node = 0
+        for name in path:
+            name_idx = self.name_index.get(name)
+            if name_idx is None: return None
+            node = self.by_parent.get((node << 32) | name_idx)
+            if node is None: return None
+        return node
+
+    # ------------------------------ Removing ------------------------------- #
+    def remove_accessions(self, accessions):
+        """
+        Detach the given accessions from their nodes. Return the set of
+        those that were not found in the tree.
+        """
+        missing = set(accessions)
+        if not missing: return missing
+        for i, acc in enumerate(self.accessions):
+            if acc in missing and self.acc_node[i] >= 0:
+                self.acc_node[i] = -1
+                missing.discard(acc)
+        self.csr = None
+        return missing
+
+    def prune(self):
+        """
+        Remove every node (except the root) that has no accession attached
+        to it or to any of its descendants. Return the number removed.
+        """
+        _, _, acc_start, _ = self.freeze()
+        # Go through the nodes with children before their parents #
+        used = bytearray(len(self))
+        for node in reversed(list(self.preorder())):
+            if used[node] or acc_start[node] != acc_start[node + 1]:
+                used[node] = 1
+                parent = self.parent[node]
+                if parent >= 0: used[parent] = 1
+        # Remove the others #
+        removed = 0
+        for node in range(1, len(self)):
+            parent = self.parent[node]
+            if used[node] or parent == UNUSED: continue
+            del self.by_parent[(parent << 32) | self.name_idx[node]]
+            self.parent[node] = UNUSED
+            self.depth[node]  = 0
+            removed += 1
+        self.csr = None
+        return removed
+
+    # ------------------------------ Layouts -------------------------------- #
+    @staticmethod
+    def group_by(keys, count):
+        """
+        Counting sort of the positions of `keys` (integers in the range
+        [0, count)) returning a CSR layout. Positions keep their original
+        relative order inside each group.
+        """
+        start = array('i', bytes(4 * (count + 1)))
+        for key in keys:
+            start[key + 1] += 1
+        for i in range(count):
+            start[i + 1] += start[i]
+        fill  = array('i', start)
+        order = array('i', bytes(4 * len(keys)))
+        for position, key in enumerate(keys):
+            order[fill[key]] = position
+            fill[key] += 1
+        return start, order
+
+    def freeze(self):
+        """
+        Compute the CSR layouts of the children and of the accessions.
+        Children are listed by increasing number, which is their order of
+        creation, just like with `ete4`.
+        """
+        if self.csr is not None: return self.csr
+        count = len(self.parent)
+        # The root, the unused nodes and the removed accessions have a
+        # negative key, they are grouped under a virtual last slot #
+        virtual  = lambda keys: array('i', (k if k >= 0 else count
+                                            for k in keys))
+        parents  = array('i', self.parent)
+        parents[0] = count
+        if UNUSED in parents: parents = virtual(parents)
+        acc_node = self.acc_node
+        if -1 in acc_node: acc_node = virtual(acc_node)
+        child_start, child_list = self.group_by(parents, count + 1)
+        acc_start, acc_list = self.group_by(acc_node, count + 1)
+        self.csr = (child_start, child_list, acc_start, acc_list)
+        return self.csr
+
+    # ------------------------------ Queries -------------------------------- #
+    def name(self, node):
+        return self.names[self.name_idx[node]]
+
+    def children(self, node):
+        child_start, child_list, _, _ = self.freeze()
+        return child_list[child_start[node]:child_start[node + 1]]
+
+    def is_leaf(self, node):
+        child_start = self.freeze()[0]
+        return child_start[node] == child_start[node + 1]
+
+    def node_accessions(self, node):
+        """The accessions attached to this node in order of insertion."""
+        _, _, acc_start, acc_list = self.freeze()
+        return [self.accessions[i]
+                for i in acc_list[acc_start[node]:acc_start[node + 1]]]
+
+    def ancestors(self, node):
+        """Yield the parents of `node` up to the root."""
+        node = self.parent[node]
+        while node != -1:
+            yield node
+            node = self.parent[node]
+
+    def lineage(self, node):
+        """The list of taxon names from the root down to this node."""
+        path = [self.name(n) for n in self.ancestors(node)]
+        return list(reversed(path)) + [self.name(node)]
+
+    # ----------------------------- Traversals ------------------------------ #
+    def preorder(self):
+        """Yield the node numbers, parents before their children."""
+        child_start, child_list, _, _ = self.freeze()
+        stack = [0]
+        pop, extend = stack.pop, stack.extend
+        while stack:
+            node = pop()
+            yield node
+            extend(reversed(child_list[child_start[node]:
+                                       child_start[node + 1]]))
+
+    def levelorder(self):
+        """Yield the node numbers, one depth level after the other."""
+        child_start, child_list, _, _ = self.freeze()
+        queue = array('i', [0])
+        extend = queue.extend
+        for node in queue:
+            yield node
+            extend(child_list[child_start[node]:child_start[node + 1]])
+
+    # ------------------------------ Loading -------------------------------- #
+    @staticmethod
+    def read_newick(handle, chunk_size=2**20):
+        """
+        Parse the Newick text in the open file `handle` chunk by chunk and
+        return two lists: the name of every node and the index of its parent
+        (-1 for the root). Nodes are listed with parents before children.
+        Unnamed nodes get `None` and distances are ignored.
+        """
+        names, parents = [], []
+        # The node whose children are being parsed and the last one closed #
+        current, closed = -1, None
+        tokenize = re.compile(r'[(),;]|[^(),;]+').findall
+        rest = ''
+        while True:
+            chunk = handle.read(chunk_size)
+            text  = rest + chunk
+            # Keep a name that might be cut at the end of the chunk #
+            cut  = max(text.rfind(c) for c in '(),;') + 1 if chunk else len(text)
+            text, rest = text[:cut], text[cut:]
+            for token in tokenize(text):
+                if token == '(':
+                    names.append(None)
+                    parents.append(current)
+                    current, closed = len(names) - 1, None
+                elif token == ')':
+                    current, closed = parents[current], current
+                elif token in ',;':
+                    closed = None
+                else:
+                    name = token.strip().split(':')[0] or None
+                    if closed is not None:
+                        names[closed] = name
+                    elif name is not None:
+                        names.append(name)
+                        parents.append(current)
+            if not chunk: break
+        return names, parents
+
+    @classmethod
+    def from_database(cls, tre_path, names_path, map_path):
+        """
+        Load an existing database made of a `.tre`, a `.names` and a `.map`
+        file, keeping all node numbers as they are.
+        """
+        # The taxon name of every node number #
+        taxa = {}
+        with open(names_path) as handle:
+            for line in handle:
+                num, rest = line.rstrip('\n').split(',', 1)
+                taxa[int(num)] = rest.rsplit(',', 1)[0]
+        # The structure of the tree #
+        with open(tre_path) as handle:
+            names, parents = cls.read_newick(handle)
+        # Create the nodes, parents first #
+        tree = cls(root_name=taxa[0])
+        numbers = [int(name) if name is not None else 0 for name in names]
+        for i, num in enumerate(numbers):
+            if parents[i] == -1: continue
+            tree.add_node(num, numbers[parents[i]], taxa[num])
+        # The accessions #
+        with open(map_path) as handle:
+            for line in handle:
+                num, acc = line.rstrip('\n').split(',', 1)
+                tree.add_accession(int(num), acc)
+        # Return #
+        return tree
+
+    # ----------------------------- Snapshots ------------------------------- #
+    snapshot_arrays = ('parent', 'depth', 'name_idx', 'acc_node')
+    snapshot_tables = ('names', 'accessions')
+
+    def save(self, path, metadata=None):
+        """
+        Write a binary snapshot of the tree to `path`. The `metadata` is any
+        JSON-serializable object stored in the header, for instance to
+        check later that the snapshot is still up to date.
+        """
+        # The raw contents of every section #
+        sections = [getattr(self, name).tobytes()
+                    for name in self.snapshot_arrays]
+        sections += ['\n'.join(getattr(self, name)).encode()
+                     for name in self.snapshot_tables]
+        counts = [len(getattr(self, name)) for name in
+                  self.snapshot_arrays + self.snapshot_tables]
+        # The header #
+        header = {'version':   SNAPSHOT_VERSION,
+                  'byteorder': sys.byteorder,
+                  'itemsize':  self.parent.itemsize,
+                  'sections':  self.snapshot_arrays + self.snapshot_tables,
+                  'counts':    counts,
+                  'sizes':     [len(section) for section in sections],
+                  'metadata':  metadata}
+        header = json.dumps(header).encode()
+        # Write to a temporary file first so a snapshot is never partial #
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as handle:
+            handle.write(SNAPSHOT_MAGIC)
+            handle.write(struct.pack('<I', len(header)))
+            handle.write(header)
+            for section in sections: handle.write(section)
+        os.replace(tmp_path, path)
+        return path
+
+    @staticmethod
+    def read_header(handle):
+        """
+        Read the header of a snapshot from the open file `handle`. Returns
+        `None` if the file is not a snapshot of the current version.
+        """
+        if handle.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC: return None
+        size   = struct.unpack('<I', handle.read(4))[0]
+        header = json.loads(handle.read(size))
+        if header['version'] != SNAPSHOT_VERSION: return None
+        return header
+
+    @classmethod
+    def load(cls, path):
+        """Load a tree from a snapshot written by `save()`."""
+        tree = cls.__new__(cls)
+        tree.csr = None
+        with open(path, 'rb') as handle:
+            header = cls.read_header(handle)
+            if header is None:
+                raise Exception("The file '%s' is not a valid snapshot." % path)
+            sections = zip(header['sections'], header['counts'],
+                           header['sizes'])
+            for name, count, size in sections:
+                data = handle.read(size)
+                if name in cls.snapshot_arrays:
+                    values = array('i')
+                    values.frombytes(data)
+                    if header['byteorder'] != sys.byteorder: values.byteswap()
+                else:
+                    values = data.decode().split('\n') if count else []
+                if len(values) != count:
+                    raise Exception("The snapshot '%s' is truncated." % path)
+                setattr(tree, name, values)
+        return tree
+
+    # ------------------------------ Exports -------------------------------- #
+    def write_newick(self, handle, format_root_node=True, chunk_size=2**16):
+        """
+        Write the tree in the Newick format to the open file `handle`, with
+        node numbers as names and no distances, byte for byte like `ete4`
+        does with `parser=8`. The tree is walked iteratively (no recursion
+        limit) and the text is written in chunks of about `chunk_size`
+        pieces, so the whole string never exists in memory.
+        """
+        child_start, child_list, _, _ = self.freeze()
+        # Pieces of text waiting to be written #
+        pieces = []
+        add = pieces.append
+        # The stack contains nodes to open, negative numbers `~node` for
+        # nodes to close and `None` for the commas between siblings #
+        stack = [0]
+        pop, push = stack.pop, stack.append
+        while stack:
+            item = pop()
+            if item is None:
+                add(',')
+            elif item < 0:
+                node = ~item
+                add(')' if node == 0 and not format_root_node
+                    else ')' + str(node))
+            else:
+                first, last = child_start[item], child_start[item + 1]
+                if first == last:
+                    if item != 0 or format_root_node: add(str(item))
+                else:
+                    add('(')
+                    push(~item)
+                    push(child_list[last - 1])
+                    for i in range(last - 2, first - 1, -1):
+                        push(None)
+                        push(child_list[i])
+            if len(pieces) >= chunk_size:
+                handle.write(''.join(pieces))
+                pieces.clear()
+        add(';')
+        handle.write(''.join(pieces))
+
+    def newick(self, format_root_node=True):
+        """Return the Newick text as a string, only for small trees."""
+        handle = io.StringIO()
+        self.write_newick(handle, format_root_node)
+        return handle.getvalue()
+
+    def to_ete(self):
+        """
+        Convert to an `ete4.Tree` with the same `name`, `taxa` and `acc`
+        properties as were produced before this class existed.
+        """
+        from ete4 import Tree
+        nodes = [None] * len(self)
+        for node in self.preorder():
+            if node == 0:
+                ete_node = Tree()
+                ete_node.name = 0
+            else:
+                ete_node = nodes[self.parent[node]].add_child(name=node)
+            ete_node.add_prop('taxa', self.name(node))
+            accessions = self.node_accessions(node)
+            if accessions: ete_node.add_prop('acc', accessions)
+            nodes[node] = ete_node
+        return nodes[0]
+
+###############################################################################
+class PathCache:
+    """
+    Adds paths to a `TaxonomyTree` while remembering the nodes of the last
+    one. Only the segments after the first difference with the previous
+    path are looked up in the tree, the nodes of the others are reused.
+
+    The shared segments are also replaced by the string objects of the
+    previous path, so that paths kept in memory don't hold a copy of the
+    same names for every row. The `tree` can be omitted to only do that.
+
+    The share of segments found in the cache is `hits / lookups`.
+    """
+
+    def __init__(self, tree=None):
+        self.tree    = tree
+        self.given   = None
+        self.path    = []
+        self.nodes   = [0]
+        self.hits    = 0
+        self.lookups = 0
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        return "<%s object with a hit rate of %.1f%%>" % \
+               (self.__class__.__name__, 100 * self.hit_rate)
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def share(self, path):
+        """
+        Return the number of segments at the start of `path` that are the
+        same as in the previous path, and a list of the segments of `path`
+        in which those are the objects of the previous path. That list
+        becomes the previous path. The `path` given is not modified, as
+        the parser shares it between rows (see the `lineage` module).
+        """
+        # The parser gives the same list to rows with the same path #
+        if path is self.given:
+            shared = len(self.path)
+        else:
+            previous, self.given = self.path, path
+            shared, limit = 0, min(len(path), len(previous))
+            while shared < limit and path[shared] == previous[shared]:
+                shared += 1
+            self.path = previous[:shared] + path[shared:] if shared else path
+        self.hits    += shared
+        self.lookups += len(self.path)
+        return shared, self.path
+
+    def add_path(self, path):
+        """The same as `TaxonomyTree.add_path()`, for a list."""
+        shared, path = self.share(path)
+        nodes  = self.nodes
+        del nodes[shared + 1:]
+        node, add_child = nodes[-1], self.tree.add_child
+        for i in range(shared, len(path)):
+            node = add_child(node, path[i])
+            nodes.append(node)
+        return node
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+The VSEARCH index of the FASTA file in a database directory, a `.udb` file
+made by `vsearch --makeudb_usearch`.
+
+The FASTA can be gzipped, in which case it is decompressed in the
+background and streamed to `vsearch` through a pipe, so no uncompressed
+copy is ever written to disk. Several directories can be indexed at the
+same time within a budget of threads with `index_all`.
+
+An index is not made again if its `.udb` was made from the same FASTA. The
+hash of the FASTA is saved in a `.udb.json` file next to the index. The
+hash is only computed again when the size or modification time of the
+FASTA changed.
+
+Typically you would use it like this:
+
+    >>> UDBIndex('databases/silvamod138pr2')(threads=16)
+"""
+
+# Built-in modules #
+import os, json, shutil, hashlib, subprocess, threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Internal modules #
+from decompress import open_input
+
+###############################################################################
+class UDBIndex:
+    """The VSEARCH index of the FASTA file in one database directory."""
+
+    extensions = ('.fasta', '.fasta.gz')
+
+    def __init__(self, db_dir):
+        self.db_dir = os.path.normpath(db_dir)
+        self.name   = os.path.basename(self.db_dir)
+        prefix      = os.path.join(self.db_dir, self.name)
+        self.fasta  = next((prefix + ext for ext in self.extensions
+                            if os.path.exists(prefix + ext)), None)
+        self.udb    = prefix + '.udb'
+        self.cache  = self.udb + '.json'
+
+    def __repr__(self):
+        """A simple representation of this object to avoid memory addresses."""
+        return "<%s object on '%s'>" % (self.__class__.__name__, self.db_dir)
+
+    # ------------------------------- Cache --------------------------------- #
+    @staticmethod
+    def file_hash(path, chunk_size=2**22):
+        """The hexadecimal BLAKE2 digest of a file's contents."""
+        digest = hashlib.blake2b()
+        with open(path, 'rb') as handle:
+            while True:
+                chunk = handle.read(chunk_size)
+                if not chunk: return digest.hexdigest()
+                digest.update(chunk)
+
+    def key(self, fasta_hash=None):
+        stat = os.stat(self.fasta)
+        return {'fasta':    os.path.basename(self.fasta),
+                'size':     stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'hash':     fasta_hash or self.file_hash(self.fasta)}
+
+    def up_to_date(self):
+        """
+        True if the `.udb` is newer than the FASTA and was made from the
+        same content. The hash is only checked if the size or time differ.
+        """
+        if not os.path.exists(self.udb) or not os.path.exists(self.cache):
+            return False
+        with open(self.cache) as handle: cached = json.load(handle)
+        stat = os.stat(self.fasta)
+        if cached.get('fasta') != os.path.basename(self.fasta): return False
+        if cached['size'] != stat.st_size: return False
+        if cached['mtime_ns'] == stat.st_mtime_ns and \
+           os.path.getmtime(self.udb) >= os.path.getmtime(self.fasta):
+            return True
+        # Maybe only the time changed, e.g. after a copy #
+        fasta_hash = self.file_hash(self.fasta)
+        if cached['hash'] != fasta_hash: return False
+        with open(self.cache, 'w') as handle:
+            json.dump(self.key(fasta_hash), handle, indent=4)
+        return True
+
+    # ------------------------------ Indexing ------------------------------- #
+    def __call__(self, threads=1, force=False):
+        """
+        Run `vsearch --makeudb_usearch` with the FASTA on its standard
+        input. Returns False if the index was already up to date.
+        """
+        if self.fasta is None:
+            raise FileNotFoundError("No FASTA file in '%s'." % self.db_dir)
+        if not force and self.up_to_date(): return False
+        # Hash the FASTA as it is on disk, reading it again in a thread #
+        digest = hashlib.blake2b()
+        tmp_path = self.udb + '.tmp'
+        command = ['vsearch', '--makeudb_usearch', '-', '--output', tmp_path,
+                   '--threads', str(threads), '--quiet']
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        hasher = threading.Thread(target=self.hash_into, args=(digest,))
+        hasher.start()
+        try:
+            with open_input(self.fasta, 'rb') as handle:
+                shutil.copyfileobj(handle, process.stdin, 2**20)
+        except BrokenPipeError:
+            pass
+        except BaseException:
+            # Don't leave vsearch waiting for the rest of its input #
+            process.kill()
+            raise
+        finally:
+            try: process.stdin.close()
+            except BrokenPipeError: pass
+            hasher.join()
+            if process.wait() != 0 and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if process.returncode != 0:
+            msg = "vsearch failed on '%s' with exit code %i."
+            raise Exception(msg % (self.fasta, process.returncode))
+        # Save the result and what it was made from #
+        os.replace(tmp_path, self.udb)
+        with open(self.cache, 'w') as handle:
+            json.dump(self.key(digest.hexdigest()), handle, indent=4)
+        return True
+
+    def hash_into(self, digest, chunk_size=2**22):
+        """Hash the FASTA file as it is on disk (compressed or not)."""
+        with open(self.fasta, 'rb') as handle:
+            while True:
+                chunk = handle.read(chunk_size)
+                if not chunk: return
+                digest.update(chunk)
+
+###############################################################################
+def index_all(db_dirs, threads=None, threads_per_db=4, force=False):
+    """
+    Index every database directory, with at most `threads` threads in
+    total. Every `vsearch` process gets `threads_per_db` of them.
+    """
+    threads  = threads or os.cpu_count()
+    per_db   = max(1, min(threads_per_db, threads))
+    indexes  = [UDBIndex(db_dir) for db_dir in db_dirs]
+    def run(index):
+        done = index(per_db, force)
+        print("%-30s %s" % (index.name, "indexed" if done else "up to date"))
+        return done
+    with ThreadPoolExecutor(max(1, threads // per_db)) as pool:
+        return list(pool.map(run, indexes))
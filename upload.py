@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Uploading of database archives to S3 in concurrent multipart transfers.
+
+The archive is cut in parts of the same size as the one used to compute
+its hashes when it was made (see `archive.py`), so that the ETag S3 will
+give to the object is known in advance:
+
+    * if the object already in the bucket has that ETag, nothing is sent.
+    * otherwise the parts are sent on `jobs` threads, each reading its own
+      slice of the file, and the ETag returned for every part is checked
+      against the MD5 computed during compression.
+
+The object can be made readable by anyone at the end.
+
+Any client with the interface of `boto3.client('s3')` can be passed, for
+instance one created with an `endpoint_url` pointing to a local
+S3-compatible server for testing.
+
+Typically you would use it like this:
+
+    >>> upload_archive('silvamod138pr2.tar.gz', 'crest4', public=True)
+"""
+
+# Built-in modules #
+import os, time
+from concurrent.futures import ThreadPoolExecutor
+
+# Internal modules #
+from archive import read_hashes, hash_file
+
+# Constants #
+MISSING_CODES = ('404', 'NoSuchKey', 'NotFound')
+
+###############################################################################
+def make_client(endpoint_url=None):
+    """A `boto3` S3 client, optionally for another S3-compatible server."""
+    import boto3
+    return boto3.client('s3', endpoint_url=endpoint_url)
+
+def remote_etag(client, bucket, key):
+    """The ETag of an object without its quotes, or None if it's absent."""
+    try:
+        response = client.head_object(Bucket=bucket, Key=key)
+    except Exception as error:
+        code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+        if code in MISSING_CODES: return None
+        raise
+    return response['ETag'].strip('"')
+
+def make_public(client, bucket, key):
+    """Let anyone read the object."""
+    return client.put_object_acl(Bucket=bucket, Key=key, ACL='public-read')
+
+#-----------------------------------------------------------------------------#
+def upload_part(client, path, bucket, key, upload_id, number, start, size,
+                expected_md5):
+    """Send one part and check what S3 received. Runs in a worker thread."""
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        data = handle.read(size)
+    response = client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                  PartNumber=number, Body=data)
+    etag = response['ETag'].strip('"')
+    if etag != expected_md5:
+        msg = "Part %i of '%s' was corrupted during the upload."
+        raise IOError(msg % (number, path))
+    return {'PartNumber': number, 'ETag': response['ETag']}
+
+def upload_archive(path, bucket, key=None, client=None, jobs=8, public=False,
+                   verbose=True):
+    """
+    Upload the file at `path` to `bucket` under `key` (its file name by
+    default), unless an identical object is already there.
+    Returns True if something was sent.
+    """
+    path   = str(path)
+    key    = key or os.path.basename(path)
+    client = client or make_client()
+    # The hashes computed during compression, or now if they are missing #
+    hashes = read_hashes(path)
+    if not hashes or 'parts' not in hashes: hashes = hash_file(path)
+    # Skip if nothing changed #
+    if remote_etag(client, bucket, key) == hashes['etag']:
+        if verbose: print("The object '%s' is already up to date." % key)
+        if public: make_public(client, bucket, key)
+        return False
+    # Small files are sent in one go #
+    start = time.perf_counter()
+    acl = {'ACL': 'public-read'} if public else {}
+    size, part_size = hashes['size'], hashes['part_size']
+    if size <= part_size:
+        with open(path, 'rb') as handle:
+            client.put_object(Bucket=bucket, Key=key, Body=handle.read(), **acl)
+    # Others in parts on several threads #
+    else:
+        upload_id = client.create_multipart_upload(Bucket=bucket, Key=key,
+                                                   **acl)['UploadId']
+        try:
+            with ThreadPoolExecutor(jobs) as pool:
+                futures = [pool.submit(upload_part, client, path, bucket, key,
+                                       upload_id, i + 1, offset,
+                                       min(part_size, size - offset), md5)
+                           for i, (offset, md5) in enumerate(
+                               zip(range(0, size, part_size), hashes['parts']))]
+                parts = [future.result() for future in futures]
+            client.complete_multipart_upload(Bucket=bucket, Key=key,
+                UploadId=upload_id, MultipartUpload={'Parts': parts})
+        except BaseException:
+            client.abort_multipart_upload(Bucket=bucket, Key=key,
+                                          UploadId=upload_id)
+            raise
+    # Check that S3 agrees with the hashes #
+    if remote_etag(client, bucket, key) != hashes['etag']:
+        raise IOError("The object '%s' does not have the expected ETag." % key)
+    # Report #
+    if verbose:
+        elapsed = time.perf_counter() - start
+        print("Uploaded %.1f MiB in %.1f s (%.1f MiB/s)" %
+              (size / 1024**2, elapsed, size / 1024**2 / max(elapsed, 1e-9)))
+    return True
+
+###############################################################################
+if __name__ == '__main__':
+    # Make an argument parser #
+    import argparse
+    parser = argparse.ArgumentParser(description=
+        "Upload a database archive to S3 unless it is already there.")
+    parser.add_argument("path", help="The archive to upload.")
+    parser.add_argument("bucket", help="The name of the bucket.")
+    parser.add_argument("--public", action="store_true",
+                        help="Make the object readable by anyone.")
+    parser.add_argument("--endpoint-url", default=None,
+                        help="The address of another S3-compatible server.")
+    parser.add_argument("--jobs", type=int, default=8,
+                        help="The number of parts sent at the same time.")
+    args = parser.parse_args()
+    # Run it #
+    upload_archive(args.path, args.bucket, client=make_client(args.endpoint_url),
+                   jobs=args.jobs, public=args.public)